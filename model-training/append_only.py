@@ -0,0 +1,155 @@
+"""
+Append-only directories shared by the on-disk caches and the dataset store
+
+token_cache.py, feature_cache.py and dataset_store.py keep their data in
+files that only ever grow. manifest.json, fsynced and replaced atomically
+after the appended data is on disk, is the only record of how much of each
+file is valid: readers stop there, and the next writer truncates whatever
+an interrupted append left behind, so a crash never leaves a broken
+directory. Writers take a file lock, so parallel jobs can share one.
+
+RowCache adds fixed-shape numpy rows looked up by a hash of a text, which
+is what both caches store.
+"""
+
+import os
+import json
+import hashlib
+import contextlib
+from pathlib import Path
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): one writer at a time is assumed
+    fcntl = None
+
+KEY_DTYPE = np.dtype('V16')
+
+
+def text_key(text):
+    """16-byte hash identifying a text exactly"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=KEY_DTYPE.itemsize).digest()
+
+
+class AppendOnlyDir:
+    """Directory of append-only files committed by manifest.json
+
+    Subclasses set FORMAT and bump it whenever their file layout changes.
+    """
+
+    FORMAT = 1
+
+    def __init__(self, path):
+        self.dir = Path(path)
+
+    def _path(self, name):
+        return self.dir / name
+
+    def _read_manifest(self):
+        """The committed manifest, None when there is none yet"""
+        try:
+            with open(self._path('manifest.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, manifest):
+        """Commit manifest, assumes the lock is held and the data it counts is on disk"""
+        manifest = {'format': self.FORMAT, **manifest}
+        tmp_path = self._path('manifest.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path('manifest.json'))
+        return manifest
+
+    def _append_bytes(self, name, committed, data):
+        """Write data after the first committed bytes of a file and sync it"""
+        with open(self._path(name), 'ab') as f:
+            # Drop whatever an interrupted append left past the committed bytes
+            f.truncate(committed)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @contextlib.contextmanager
+    def _locked(self):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self._path('.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class RowCache(AppendOnlyDir):
+    """Memory-mapped rows of fixed-shape arrays, one row per distinct text
+
+    layout maps each array's name to its dtype and row shape; the committed
+    rows of an array are available as the attribute of that name.
+    """
+
+    def __init__(self, path, layout):
+        super().__init__(path)
+        self.layout = {name: (np.dtype(dtype), tuple(shape)) for name, (dtype, shape) in layout.items()}
+        self.rows = 0
+        self.index = {}
+        self._open()
+
+    def _shapes(self):
+        return {name: list(shape) for name, (_, shape) in self.layout.items()}
+
+    def _committed_rows(self):
+        manifest = self._read_manifest()
+        if (manifest is None or manifest.get('format') != self.FORMAT
+                or manifest.get('shapes') != self._shapes()):
+            return 0
+        return manifest['rows']
+
+    def _open(self):
+        """Map the committed rows and rebuild the hash -> row index"""
+        self.rows = self._committed_rows()
+        for name, (dtype, shape) in self.layout.items():
+            if self.rows:
+                array = np.memmap(self._path(f'{name}.bin'), dtype=dtype, mode='r',
+                                  shape=(self.rows, *shape))
+            else:
+                array = np.empty((0, *shape), dtype=dtype)
+            setattr(self, name, array)
+
+        self.index = {}
+        if self.rows:
+            keys = np.memmap(self._path('keys.bin'), dtype=KEY_DTYPE, mode='r', shape=(self.rows,))
+            self.index = {bytes(key): row for row, key in enumerate(keys)}
+
+    def _append(self, arrays, keys):
+        """Commit one new row per key, assumes the lock is held"""
+        for name, (dtype, shape) in self.layout.items():
+            row_bytes = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            data = np.ascontiguousarray(arrays[name], dtype=dtype).tobytes()
+            self._append_bytes(f'{name}.bin', self.rows * row_bytes, data)
+        self._append_bytes('keys.bin', self.rows * KEY_DTYPE.itemsize, b''.join(keys))
+        self._write_manifest({'rows': self.rows + len(keys), 'shapes': self._shapes()})
+
+    def _lookup(self, texts, compute):
+        """Row of every text; compute(texts) returns {name: rows} for the ones not cached yet"""
+        keys = [text_key(text) for text in texts]
+        if any(key not in self.index for key in keys):
+            with self._locked():
+                # Another job may have added rows since this one opened the cache
+                self._open()
+                missing = {}
+                for text, key in zip(texts, keys):
+                    if key not in self.index:
+                        missing.setdefault(key, text)
+                if missing:
+                    self._append(compute(list(missing.values())), list(missing.keys()))
+                    self._open()
+
+        return np.array([self.index[key] for key in keys], dtype=np.int64)
@@ -0,0 +1,92 @@
+"""
+Compare tokenizer throughput on the training commands
+
+    slow     transformers' pure Python WordPiece tokenizer, one text per call
+    fast     the Rust tokenizer from tokenizer.json, one text per call
+    batched  the Rust tokenizer, the whole set in one encode_batch call
+
+Each mode must produce the same token ids; the slow mode is skipped when
+transformers is not installed.
+
+Requirements:
+    pip install tokenizers
+    pip install transformers    # for the slow baseline
+"""
+
+import time
+import argparse
+from dataset_store import DEFAULT_STORE, load_examples
+from fast_tokenizer import load_tokenizer
+from inference_server import model_path
+
+
+def load_slow_tokenizer(model_dir):
+    """The pure Python tokenizer, or None without transformers"""
+    try:
+        from transformers import DistilBertTokenizer
+    except ImportError:
+        return None
+    tokenizer = DistilBertTokenizer.from_pretrained(model_dir)
+    if getattr(tokenizer, 'is_fast', False):
+        # Newer transformers back DistilBertTokenizer with Rust as well
+        from transformers.models.bert.tokenization_bert_legacy import BertTokenizerLegacy
+        tokenizer = BertTokenizerLegacy.from_pretrained(model_dir)
+    return tokenizer
+
+
+def throughput(encode, texts, repeats):
+    """Best texts/second over repeats runs, and the ids of the last run"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        ids = encode(texts)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best, ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark slow, fast and batched tokenization")
+    parser.add_argument("--model-path", default=model_path)
+    parser.add_argument("--data", default=DEFAULT_STORE,
+                        help="Dataset store or JSON list of {text, intent}")
+    parser.add_argument("--max-length", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    texts = [item['text'] for item in load_examples(args.data)]
+
+    start = time.perf_counter()
+    fast = load_tokenizer(args.model_path)
+    fast_load = time.perf_counter() - start
+    fast.encode_ids(texts[:1], args.max_length)
+    rust = fast.tokenizer
+
+    modes = {
+        "fast": lambda batch: [rust.encode(text).ids for text in batch],
+        "batched": lambda batch: fast.encode_ids(batch, args.max_length),
+    }
+    load_seconds = {"fast": fast_load, "batched": fast_load}
+
+    start = time.perf_counter()
+    slow = load_slow_tokenizer(args.model_path)
+    if slow is not None:
+        load_seconds["slow"] = time.perf_counter() - start
+        modes = {"slow": lambda batch: [slow.encode(text, truncation=True, max_length=args.max_length)
+                                        for text in batch], **modes}
+    else:
+        print("transformers is not installed, skipping the slow tokenizer")
+
+    print(f"{len(texts)} texts, best of {args.repeats} runs\n")
+    print(f"{'mode':<10}{'load (s)':>10}{'texts/s':>14}{'speedup':>10}")
+    reference_ids, baseline = None, None
+    for mode, encode in modes.items():
+        rate, ids = throughput(encode, texts, args.repeats)
+        if reference_ids is None:
+            reference_ids, baseline = ids, rate
+        elif ids != reference_ids:
+            print(f"Warning: {mode} tokenization differs from {next(iter(modes))}")
+        print(f"{mode:<10}{load_seconds[mode]:>10.3f}{rate:>14,.0f}{rate / baseline:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
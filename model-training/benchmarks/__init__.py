@@ -0,0 +1,13 @@
+"""
+Reproducible latency and throughput benchmarks for the intent classifier
+
+Run from model-training/:
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.compare baseline.json bench.json
+
+run.py measures every artifact variant (variants.py) over batches drawn
+from the training commands, each variant and thread count in a fresh
+process, and writes the results as JSON. compare.py diffs two of those
+files and fails when a variant got slower.
+"""
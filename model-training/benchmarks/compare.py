@@ -0,0 +1,74 @@
+"""
+Diff two benchmark result files from benchmarks/run.py
+
+    python -m benchmarks.compare baseline.json candidate.json --max-regression 10
+
+Prints, for every variant, thread count and batch size found in both
+files, how p50/p95 latency and throughput changed. Exits with status 1
+when any p50 latency grew by more than --max-regression percent.
+"""
+
+import sys
+import json
+import argparse
+
+
+def load_results(path):
+    """Result entries keyed by (variant, threads, batch_size)"""
+    with open(path, 'r') as f:
+        report = json.load(f)
+    entries = {}
+    for result in report["results"]:
+        for batch in result.get("batches", []):
+            entries[(result["variant"], result["threads"], batch["batch_size"])] = batch
+    return report, entries
+
+
+def change(before, after):
+    """Percent change from before to after"""
+    return (after - before) / before * 100.0 if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="Largest p50 latency increase in percent before failing")
+    args = parser.parse_args()
+
+    baseline_report, baseline = load_results(args.baseline)
+    candidate_report, candidate = load_results(args.candidate)
+    for label, report in (("baseline", baseline_report), ("candidate", candidate_report)):
+        env = report["environment"]
+        print(f"{label:<10} {env.get('git_commit') or 'unknown commit'}  "
+              f"{env['processor']}, {env['cores']} cores, {env['timestamp']}")
+
+    print(f"\n{'variant':<11}{'threads':>8}{'batch':>7}{'p50 ms':>18}{'p95 ms':>18}"
+          f"{'texts/s':>20}")
+    regressions = []
+    for key in sorted(baseline.keys() & candidate.keys()):
+        before, after = baseline[key], candidate[key]
+        p50 = change(before["p50_ms"], after["p50_ms"])
+        p95 = change(before["p95_ms"], after["p95_ms"])
+        rate = change(before["throughput_per_s"], after["throughput_per_s"])
+        variant, threads, batch_size = key
+        print(f"{variant:<11}{threads:>8}{batch_size:>7}"
+              f"{after['p50_ms']:>10.2f}{p50:>+7.1f}%{after['p95_ms']:>10.2f}{p95:>+7.1f}%"
+              f"{after['throughput_per_s']:>12,.0f}{rate:>+7.1f}%")
+        if p50 > args.max_regression:
+            regressions.append((key, p50))
+
+    for key in sorted(baseline.keys() ^ candidate.keys()):
+        side = "baseline" if key in baseline else "candidate"
+        print(f"Only in {side}: {key[0]}, {key[1]} thread(s), batch {key[2]}")
+
+    if regressions:
+        print(f"\n{len(regressions)} result(s) slower than the {args.max_regression:.0f}% limit:")
+        for (variant, threads, batch_size), p50 in regressions:
+            print(f"  {variant}, {threads} thread(s), batch {batch_size}: p50 {p50:+.1f}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Benchmark every artifact variant over realistic batches of commands
+
+Batches are drawn with a fixed seed from the commands in the dataset
+store (dataset_store.py), so their token lengths follow the real
+distribution, and classified the way the server does it (classify_batch,
+padded to length buckets). Each variant and thread count runs in its own
+process, which makes the load time and peak resident memory its own.
+After warm-up batches, every batch is timed with time.perf_counter().
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --variants int8,onnx --threads 1,4 --batch-sizes 1,8,32
+
+The JSON holds one result per variant and thread count: the startup
+breakdown, load time, peak RSS, and per batch size the warm p50/p95/p99
+latency and texts/second. Diff two runs with benchmarks/compare.py.
+
+Requirements:
+    pip install tokenizers numpy transformers torch
+    pip install onnxruntime    # for the onnx variants
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import resource
+import subprocess
+import multiprocessing
+import importlib.metadata
+from datetime import datetime, timezone
+import numpy as np
+from dataset_store import DEFAULT_STORE, load_examples
+from fast_tokenizer import load_tokenizer
+from inference_backends import resident_memory_mb
+from inference_server import classify_batch, parse_buckets, timed
+from benchmarks.variants import (
+    build_variants, import_variant_runtime, load_variant, quantize_onnx, unavailable_reason
+)
+
+# Bumped whenever the layout of the JSON output changes
+RESULTS_FORMAT = 1
+
+PACKAGES = ("numpy", "tokenizers", "torch", "transformers", "onnxruntime")
+
+
+def parse_int_list(value):
+    """Sorted, de-duplicated positive integers from a value like '1,2,4'"""
+    numbers = sorted({int(number) for number in value.split(',') if number.strip()})
+    if not numbers or numbers[0] < 1:
+        raise argparse.ArgumentTypeError("expected positive integers, e.g. 1,2,4")
+    return numbers
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def load_commands(data_path):
+    return [item['text'] for item in load_examples(data_path)]
+
+
+def percentiles_ms(seconds):
+    seconds = np.asarray(seconds) * 1000.0
+    return {
+        "mean_ms": round(float(seconds.mean()), 3),
+        "p50_ms": round(float(np.percentile(seconds, 50)), 3),
+        "p95_ms": round(float(np.percentile(seconds, 95)), 3),
+        "p99_ms": round(float(np.percentile(seconds, 99)), 3),
+    }
+
+
+def measure_batch_size(tokenizer, backend, texts, batch_size, buckets, warmup, iterations, seed):
+    """Warm p50/p95/p99 and throughput of classify_batch at one batch size"""
+    rng = random.Random(seed * 1000 + batch_size)
+    batches = [rng.choices(texts, k=batch_size) for _ in range(warmup + iterations)]
+    for batch in batches[:warmup]:
+        classify_batch(tokenizer, backend, batch, buckets)
+
+    latencies, forward = [], []
+    for batch in batches[warmup:]:
+        stage_times = {}
+        start = time.perf_counter()
+        classify_batch(tokenizer, backend, batch, buckets, stage_times)
+        latencies.append(time.perf_counter() - start)
+        forward.append(stage_times["forward"])
+
+    return {
+        "batch_size": batch_size,
+        "iterations": iterations,
+        **percentiles_ms(latencies),
+        "forward_p50_ms": round(float(np.percentile(forward, 50)) * 1000.0, 3),
+        "throughput_per_s": round(batch_size * iterations / sum(latencies), 1),
+    }
+
+
+def measure_variant(conn, variant, threads, texts, batch_sizes, buckets, warmup, iterations, seed):
+    """Entry point of a benchmark process: load one variant and time every batch size"""
+    try:
+        timings = {}
+        start = time.perf_counter()
+        timed(timings, "imports", import_variant_runtime, variant)
+        tokenizer = timed(timings, "tokenizer", load_tokenizer, variant.model_path)
+        backend = timed(timings, "weights", load_variant, variant, threads)
+        load_seconds = time.perf_counter() - start
+        loaded_rss = resident_memory_mb()
+
+        batches = [measure_batch_size(tokenizer, backend, texts, batch_size, buckets,
+                                      warmup, iterations, seed)
+                   for batch_size in batch_sizes]
+        conn.send({
+            "startup": timings,
+            "load_seconds": round(load_seconds, 3),
+            "loaded_rss_mb": round(loaded_rss, 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "batches": batches,
+        })
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_isolated(context, variant, threads, *args):
+    """Benchmark one variant and thread count in a fresh process"""
+    reader, writer = context.Pipe(duplex=False)
+    process = context.Process(target=measure_variant, args=(writer, variant, threads, *args))
+    process.start()
+    writer.close()
+    try:
+        result = reader.recv()
+    except EOFError:
+        result = {"error": f"benchmark process exited with code {process.exitcode}"}
+    process.join()
+    return result
+
+
+def environment():
+    """Where the numbers came from, so two result files can be told apart"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    packages = {}
+    for package in PACKAGES:
+        try:
+            packages[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            packages[package] = None
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cores": available_cores(),
+        "packages": packages,
+    }
+
+
+def token_length_profile(model_path, texts, max_length):
+    """Distribution of the commands' token lengths, for the report"""
+    lengths = np.array([len(ids) for ids in load_tokenizer(model_path).encode_ids(texts, max_length)])
+    return {"count": len(lengths), "mean": round(float(lengths.mean()), 1),
+            "p50": int(np.percentile(lengths, 50)), "p95": int(np.percentile(lengths, 95)),
+            "max": int(lengths.max())}
+
+
+def print_table(results):
+    print(f"\n{'variant':<11}{'threads':>8}{'batch':>7}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'texts/s':>11}{'load s':>9}{'peak MB':>9}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['variant']:<11}{result['threads']:>8}  failed: {result['error']}")
+            continue
+        for batch in result["batches"]:
+            print(f"{result['variant']:<11}{result['threads']:>8}{batch['batch_size']:>7}"
+                  f"{batch['p50_ms']:>10.2f}{batch['p95_ms']:>10.2f}{batch['p99_ms']:>10.2f}"
+                  f"{batch['throughput_per_s']:>11,.0f}{result['load_seconds']:>9.2f}"
+                  f"{result['peak_rss_mb']:>9.0f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark every model artifact variant")
+    parser.add_argument("--fp32-model", default="./models/distilbert-navigation-finetuned",
+                        help="Fine-tuned checkpoint from train_navigation_model.py")
+    parser.add_argument("--quantized-model", default="./models/distilbert-navigation-quantized",
+                        help="Output directory of quantize_model.py (FP16 weights and "
+                             "quantized_model.pt)")
+    parser.add_argument("--onnx-model", default="./models/distilbert-navigation-onnx",
+                        help="Directory with model.onnx and its tokenizer")
+    parser.add_argument("--onnx-int8-path", default=None,
+                        help="Int8 ONNX graph (default: <onnx-model>/model_int8.onnx)")
+    parser.add_argument("--quantize-onnx", action="store_true",
+                        help="Create the int8 ONNX graph from model.onnx when it is missing")
+    parser.add_argument("--variants", default=None,
+                        help="Comma separated subset of fp32,fp16,int8,onnx,onnx_int8")
+    parser.add_argument("--data", default=DEFAULT_STORE,
+                        help="Commands the batches are drawn from (dataset store or JSON list)")
+    parser.add_argument("--batch-sizes", type=parse_int_list, default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--threads", type=parse_int_list, default=None,
+                        help="Intra-op thread counts (default: 1 and every available core)")
+    parser.add_argument("--length-buckets", type=parse_buckets, default=[8, 16, 32, 64],
+                        help="Padded lengths, as in inference_server.py")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="Untimed batches per batch size")
+    parser.add_argument("--iterations", type=int, default=100,
+                        help="Timed batches per batch size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="Where to write the JSON results")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    threads = args.threads or sorted({1, available_cores()})
+    texts = load_commands(args.data)
+
+    variants = build_variants(args.fp32_model, args.quantized_model, args.onnx_model,
+                              args.onnx_int8_path)
+    if args.variants:
+        wanted = {name.strip() for name in args.variants.split(',')}
+        unknown = wanted - {variant.name for variant in variants}
+        if unknown:
+            sys.exit(f"Unknown variants: {', '.join(sorted(unknown))}")
+        variants = [variant for variant in variants if variant.name in wanted]
+
+    onnx_int8 = next((v for v in variants if v.name == 'onnx_int8'), None)
+    onnx_source = os.path.join(args.onnx_model, 'model.onnx')
+    if (args.quantize_onnx and onnx_int8 is not None and not os.path.exists(onnx_int8.artifact)
+            and os.path.exists(onnx_source)):
+        print(f"Quantizing {onnx_source} -> {onnx_int8.artifact}")
+        quantize_onnx(onnx_source, onnx_int8.artifact)
+
+    runnable, skipped = [], []
+    for variant in variants:
+        reason = unavailable_reason(variant)
+        if reason is None:
+            runnable.append(variant)
+        else:
+            print(f"Skipping {variant.name}: {reason}")
+            skipped.append({"variant": variant.name, "reason": reason})
+    if not runnable:
+        sys.exit("No variant can run, build the model artifacts first")
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for variant in runnable:
+        for thread_count in threads:
+            print(f"Benchmarking {variant.name} with {thread_count} thread(s)...", flush=True)
+            result = run_isolated(context, variant, thread_count, texts, args.batch_sizes,
+                                  args.length_buckets, args.warmup, args.iterations, args.seed)
+            results.append({"variant": variant.name, "threads": thread_count,
+                            "model_path": str(variant.model_path),
+                            "artifact": str(variant.artifact), **result})
+
+    report = {
+        "format": RESULTS_FORMAT,
+        "environment": environment(),
+        "settings": {
+            "data": args.data,
+            "batch_sizes": args.batch_sizes,
+            "threads": threads,
+            "length_buckets": args.length_buckets,
+            "warmup": args.warmup,
+            "iterations": args.iterations,
+            "seed": args.seed,
+        },
+        "token_lengths": token_length_profile(runnable[0].model_path, texts,
+                                              args.length_buckets[-1]),
+        "results": results,
+        "skipped": skipped,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print_table(results)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
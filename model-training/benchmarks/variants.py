@@ -0,0 +1,85 @@
+"""
+Artifact variants the benchmarks compare
+
+    fp32       the fine-tuned checkpoint, eager PyTorch in FP32
+    fp16       quantize_model.py's FP16 checkpoint, computed in FP16
+    int8       quantized_model.pt rebuilt with int8 dynamic quantization
+    onnx       the exported model.onnx through onnxruntime
+    onnx_int8  model.onnx with int8 weights (onnxruntime dynamic quantization)
+
+fp16 is measured as it is stored rather than upcast the way the server's
+torch backend serves it, so the table shows what FP16 compute costs on the
+CPU at hand.
+"""
+
+import importlib
+import importlib.util
+from pathlib import Path
+from collections import namedtuple
+from inference_backends import Int8Backend, OnnxBackend, TorchBackend
+
+# backend is a class from inference_backends (or Fp16Backend); artifact is
+# the file whose absence means the variant has not been built
+Variant = namedtuple('Variant', ['name', 'backend', 'model_path', 'options', 'artifact'])
+
+
+class Fp16Backend(TorchBackend):
+    """FP16 weights and FP16 compute, no upcast"""
+
+    name = 'fp16'
+
+    def load_model(self, model_path):
+        from transformers import AutoModelForSequenceClassification
+
+        return AutoModelForSequenceClassification.from_pretrained(
+            model_path, dtype=self.torch.float16
+        )
+
+
+def build_variants(fp32_model, quantized_model, onnx_model, onnx_int8_path=None):
+    """Every variant, in the order they are reported"""
+    quantized_artifact = Path(quantized_model) / 'quantized_model.pt'
+    onnx_path = Path(onnx_model) / 'model.onnx'
+    onnx_int8_path = Path(onnx_int8_path) if onnx_int8_path else Path(onnx_model) / 'model_int8.onnx'
+    return [
+        Variant('fp32', TorchBackend, fp32_model, {}, Path(fp32_model) / 'config.json'),
+        Variant('fp16', Fp16Backend, quantized_model, {}, Path(quantized_model) / 'config.json'),
+        Variant('int8', Int8Backend, quantized_model,
+                {'quantized_artifact': str(quantized_artifact)}, quantized_artifact),
+        Variant('onnx', OnnxBackend, onnx_model, {'onnx_path': str(onnx_path)}, onnx_path),
+        Variant('onnx_int8', OnnxBackend, onnx_model,
+                {'onnx_path': str(onnx_int8_path)}, onnx_int8_path),
+    ]
+
+
+def unavailable_reason(variant):
+    """Why a variant cannot run here, or None when it can"""
+    if not Path(variant.artifact).exists():
+        return f"{variant.artifact} not found"
+    for module in variant.backend.runtime_modules:
+        if importlib.util.find_spec(module) is None:
+            return f"{module} is not installed"
+    return None
+
+
+def import_variant_runtime(variant):
+    """Import the variant's heavy modules, so their cost can be timed apart"""
+    for module in variant.backend.runtime_modules:
+        importlib.import_module(module)
+
+
+def load_variant(variant, threads, inter_op_threads=1):
+    """Load a variant with threads intra-op threads (0 = runtime default)
+
+    torch only accepts an inter-op thread count before its first parallel
+    work, so pass 0 when another model already ran in this process.
+    """
+    return variant.backend(str(variant.model_path), intra_op_threads=threads,
+                           inter_op_threads=inter_op_threads, **variant.options)
+
+
+def quantize_onnx(onnx_path, output_path):
+    """Write an int8-weight copy of an ONNX graph for the onnx_int8 variant"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(onnx_path), str(output_path), weight_type=QuantType.QInt8)
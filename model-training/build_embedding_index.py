@@ -0,0 +1,94 @@
+"""
+Build the nearest-neighbour index served by inference_server.py --nn-index
+
+Embeds every example of the training data with the fine-tuned model and
+stores the unit-length [CLS] embeddings, labels and texts next to the
+model. Re-run it whenever examples are added; the model does not need to
+be retrained. It also prints, for a few thresholds, how many examples a
+leave-one-out search would answer and how often that answer is right, to
+help choose --nn-threshold.
+
+Requirements:
+    pip install transformers torch numpy tokenizers
+"""
+
+import argparse
+from pathlib import Path
+import numpy as np
+from dataset_store import DEFAULT_STORE, load_examples
+from embedding_index import EmbeddingIndex, compress_rows, index_fingerprint, normalize_rows
+from fast_tokenizer import load_tokenizer
+from inference_backends import TorchBackend
+from inference_server import model_path, pad_to_bucket
+
+REPORT_THRESHOLDS = (0.90, 0.95, 0.97, 0.99)
+
+
+def embed_texts(tokenizer, backend, texts, max_length=64, batch_size=64):
+    """Final [CLS] hidden state of every text, batch by batch"""
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        encoded = tokenizer.encode_ids(texts[start:start + batch_size], max_length)
+        inputs = pad_to_bucket(encoded, max(len(ids) for ids in encoded), tokenizer.pad_token_id)
+        embeddings.append(backend.logits_and_embeddings(inputs)[1])
+    return np.concatenate(embeddings)
+
+
+def leave_one_out_report(embeddings, labels):
+    """Coverage and accuracy of answering each example from its nearest other example"""
+    similarities = embeddings @ embeddings.T
+    np.fill_diagonal(similarities, -np.inf)
+    nearest = similarities.argmax(axis=1)
+    best = similarities[np.arange(len(labels)), nearest]
+    correct = labels[nearest] == labels
+
+    for threshold in REPORT_THRESHOLDS:
+        answered = best >= threshold
+        accuracy = correct[answered].mean() if answered.any() else 0.0
+        print(f"  threshold {threshold:.2f}: answers {answered.mean():6.1%} of examples, "
+              f"{accuracy:6.1%} correct")
+
+
+def build_index(model_dir, data_path, output_path, dtype):
+    examples = load_examples(data_path)
+
+    print(f"Loading model from {model_dir}...")
+    tokenizer = load_tokenizer(model_dir)
+    backend = TorchBackend(model_dir)
+
+    known = [item for item in examples if item['intent'] in backend.intents]
+    if len(known) < len(examples):
+        print(f"Skipping {len(examples) - len(known)} examples with intents the model does not have")
+    texts = [item['text'] for item in known]
+    labels = np.array([backend.intents.index(item['intent']) for item in known], dtype=np.int64)
+
+    print(f"Embedding {len(texts)} examples...")
+    embeddings = normalize_rows(embed_texts(tokenizer, backend, texts))
+    leave_one_out_report(embeddings, labels)
+
+    vectors, scales = compress_rows(embeddings, dtype)
+    index = EmbeddingIndex(vectors, scales, labels, texts, backend.intents, threshold=None)
+    index.save(output_path, index_fingerprint(model_dir))
+
+    size_kb = Path(output_path).stat().st_size / 1024
+    print(f"Saved {len(texts)} x {vectors.shape[1]} {dtype} index to {output_path} ({size_kb:.1f} KB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the inference server's embedding index")
+    parser.add_argument("--model-path", default=model_path,
+                        help="Fine-tuned model directory served by inference_server.py")
+    parser.add_argument("--data", default=DEFAULT_STORE,
+                        help="Training examples: dataset store or JSON list of {text, intent}")
+    parser.add_argument("--output", default=None,
+                        help="Index file to write (default: <model-path>/embedding_index.npz)")
+    parser.add_argument("--dtype", choices=["float16", "int8"], default="float16",
+                        help="Storage type of the embedding matrix")
+    args = parser.parse_args()
+
+    output_path = args.output or str(Path(args.model_path) / "embedding_index.npz")
+    build_index(args.model_path, args.data, output_path, args.dtype)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,14 @@ Requirements:
     pip install transformers torch onnx onnxruntime
 """
 
+import sys
+import importlib.util
 import torch
-from transformers import DistilBertTokenizer, DistilBertForSequenceClassification
+from transformers import DistilBertTokenizerFast, DistilBertForSequenceClassification
 from pathlib import Path
 import json
 import shutil
+from verify_compression import DEFAULT_REFERENCE, verify_artifacts
 
 def convert_to_onnx(model_path, output_path):
     """Convert the quantized model to ONNX format"""
@@ -20,7 +23,7 @@ def convert_to_onnx(model_path, output_path):
     print(f"Loading quantized model from {model_path}...")
     
     # Load the FP16 quantized model
-    tokenizer = DistilBertTokenizer.from_pretrained(model_path)
+    tokenizer = DistilBertTokenizerFast.from_pretrained(model_path)
     model = DistilBertForSequenceClassification.from_pretrained(model_path)
     model.eval()
     
@@ -100,25 +103,10 @@ def convert_to_onnx(model_path, output_path):
     print("Saving tokenizer files...")
     tokenizer.save_pretrained(output_path)
     
-    # Create config.json compatible with Transformers.js
+    # Create config.json compatible with Transformers.js; id2label and
+    # label2id come from the trained model, in its label order
     config = model.config.to_dict()
     
-    # Add id2label mapping for Transformers.js
-    id2label = {
-        "0": "navigate",
-        "1": "search", 
-        "2": "scroll",
-        "3": "go_back",
-        "4": "go_forward",
-        "5": "reload",
-        "6": "click",
-        "7": "type",
-        "8": "close_tab"
-    }
-    
-    config['id2label'] = id2label
-    config['label2id'] = {v: k for k, v in id2label.items()}
-    
     with open(output_dir / 'config.json', 'w') as f:
         json.dump(config, f, indent=2)
     
@@ -128,71 +116,16 @@ def convert_to_onnx(model_path, output_path):
         size = file.stat().st_size / (1024 * 1024)
         print(f"  - {file.name} ({size:.2f} MB)")
     
-    # Test the exported model
-    print("\n--- Testing ONNX model ---")
-    try:
-        import onnxruntime as ort
-        
-        # Create inference session
-        session = ort.InferenceSession(str(onnx_path))
-        
-        # Test with sample inputs
-        test_examples = [
-            "navigate to google",
-            "search for AI news",
-            "scroll down"
-        ]
-        
-        INTENTS = {
-            0: 'navigate',
-            1: 'search',
-            2: 'scroll',
-            3: 'go_back',
-            4: 'go_forward',
-            5: 'reload',
-            6: 'click',
-            7: 'type',
-            8: 'close_tab'
-        }
-        
-        for text in test_examples:
-            inputs = tokenizer(
-                text, 
-                return_tensors="np",
-                padding='max_length',
-                truncation=True,
-                max_length=128
-            )
-            
-            # Run inference
-            outputs = session.run(
-                None,
-                {
-                    'input_ids': inputs['input_ids'].astype('int64'),
-                    'attention_mask': inputs['attention_mask'].astype('int64')
-                }
-            )
-            
-            logits = outputs[0][0]
-            prediction = logits.argmax()
-            
-            # Softmax
-            import numpy as np
-            exp_logits = np.exp(logits - np.max(logits))
-            probs = exp_logits / exp_logits.sum()
-            
-            intent = INTENTS[prediction]
-            confidence = probs[prediction]
-            
-            print(f"  '{text}' -> {intent} ({confidence:.2f})")
-        
-        print("\n✓ ONNX model validation successful!")
-        
-    except ImportError:
+    # Every training command through the FP32 model and the exported graph
+    print("\n--- Verifying against the FP32 model ---")
+    passed = True
+    if not Path(DEFAULT_REFERENCE).exists():
+        print(f"{DEFAULT_REFERENCE} not found, skipping verification")
+    elif importlib.util.find_spec('onnxruntime') is None:
         print("\nonnxruntime not installed, skipping validation")
         print("Install with: pip3 install onnxruntime")
-    except Exception as e:
-        print(f"\nValidation error: {e}")
+    else:
+        passed = verify_artifacts(('onnx',), quantized_model=model_path, onnx_model=output_path)
     
     print("\n" + "="*60)
     print("To use this model in the browser with Transformers.js:")
@@ -205,12 +138,15 @@ def convert_to_onnx(model_path, output_path):
     print("   );")
     print("3. Use it:")
     print("   const result = await model('navigate to google');")
+    return passed
 
 def main():
     model_path = './models/distilbert-navigation-quantized'
     output_path = './models/distilbert-navigation-onnx'
     
-    convert_to_onnx(model_path, output_path)
+    if not convert_to_onnx(model_path, output_path):
+        print("\nThe ONNX graph disagrees with the FP32 model too often, see above")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
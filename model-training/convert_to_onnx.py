@@ -9,7 +9,7 @@ Requirements:
 """
 
 import torch
-from transformers import DistilBertTokenizer, DistilBertForSequenceClassification
+from transformers import DistilBertTokenizerFast, DistilBertForSequenceClassification
 from pathlib import Path
 import json
 
@@ -19,7 +19,7 @@ def convert_to_onnx(model_path, output_path):
     print(f"Loading model from {model_path}...")
     
     # Load the fine-tuned model
-    tokenizer = DistilBertTokenizer.from_pretrained(model_path)
+    tokenizer = DistilBertTokenizerFast.from_pretrained(model_path)
     model = DistilBertForSequenceClassification.from_pretrained(model_path)
     model.eval()
     
@@ -60,6 +60,8 @@ def convert_to_onnx(model_path, output_path):
             dynamo=False  # Use legacy exporter
         )
     
+    verify_onnx_matches_torch(model, tokenizer, onnx_path)
+    
     # Save tokenizer and config
     tokenizer.save_pretrained(output_path)
     model.config.save_pretrained(output_path)
@@ -74,6 +76,36 @@ def convert_to_onnx(model_path, output_path):
     print("2. Update your App.js to load this model instead:")
     print(f"   await pipeline('text-classification', 'path/to/{output_path}')")
 
+def verify_onnx_matches_torch(model, tokenizer, onnx_path, atol=1e-4):
+    """Check the exported graph gives the same logits as the PyTorch model
+    
+    inference_server.py --backend onnx serves this file, so its replies must
+    not drift from the torch backend.
+    """
+    try:
+        import numpy as np
+        import onnxruntime as ort
+    except ImportError:
+        print("onnxruntime not installed, skipping parity check")
+        return
+    
+    texts = ["navigate to google", "search for AI news", "scroll down", "go back"]
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=64)
+    with torch.no_grad():
+        torch_logits = model(**inputs).logits.float().numpy()
+    
+    session = ort.InferenceSession(str(onnx_path), providers=['CPUExecutionProvider'])
+    onnx_logits = session.run(None, {
+        'input_ids': inputs['input_ids'].numpy().astype(np.int64),
+        'attention_mask': inputs['attention_mask'].numpy().astype(np.int64)
+    })[0]
+    
+    max_diff = float(np.abs(torch_logits - onnx_logits).max())
+    same_top1 = bool((torch_logits.argmax(-1) == onnx_logits.argmax(-1)).all())
+    print(f"ONNX vs PyTorch: max logit difference {max_diff:.2e}, same top-1: {same_top1}")
+    if max_diff > atol or not same_top1:
+        print("⚠ ONNX output does not match the PyTorch model")
+
 def main():
     # Paths
     model_path = './models/distilbert-navigation-finetuned'
@@ -0,0 +1,203 @@
+"""
+Append-only store of labelled training commands
+
+The training corpus lives in a directory of JSON Lines shards, one
+{"text", "intent"} object per line, instead of one JSON list that every
+edit loads and rewrites. Commands are duplicates when their text matches
+after the prediction cache's normalization (prediction_cache.py), so the
+store never keeps two commands the server would answer from one entry.
+
+A 16-byte hash of every normalized text is kept in sorted index files next
+to the shards. Adding examples binary-searches those files for the new
+hashes instead of reading them all, and writes the new hashes as one more
+sorted file; whenever the newest file is at least as large as the one
+before it the two are merged, so there are only a logarithmic number of
+files and, on average, the cost follows the new rows, not the corpus.
+
+manifest.json records how many bytes of each shard are valid and which
+index files are current; like the training caches, the files are committed
+by that manifest (append_only.py), so a crash never leaves a broken corpus.
+
+    python dataset_store.py import training_data_expanded.json
+    python dataset_store.py stats
+    python dataset_store.py export training_data_expanded.json
+
+The scripts that take --data read the store by default; load_examples
+accepts either a store directory or a JSON list file, and export writes
+such a file for anything else.
+"""
+
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+from collections import Counter
+import numpy as np
+from append_only import AppendOnlyDir, text_key
+from prediction_cache import normalize_text
+
+DEFAULT_STORE = './training_data'
+DEFAULT_SHARD_ROWS = 10000
+
+# Keys compare as fixed-width byte strings, so sorted files can be searched
+INDEX_DTYPE = np.dtype('S16')
+
+
+class DatasetStore(AppendOnlyDir):
+    """Sharded JSON Lines commands with a persistent hash index of their texts"""
+
+    FORMAT = 2
+
+    def __init__(self, path=DEFAULT_STORE, shard_rows=DEFAULT_SHARD_ROWS):
+        super().__init__(path)
+        self.shard_rows = shard_rows
+        self.manifest = self._committed()
+
+    def _committed(self):
+        manifest = self._read_manifest()
+        if manifest is None:
+            return {'format': self.FORMAT, 'rows': 0, 'shards': [], 'index': [], 'next_index': 0}
+        if manifest.get('format') != self.FORMAT:
+            raise ValueError(f"{self.dir} has store format {manifest.get('format')}, "
+                             f"expected {self.FORMAT}")
+        return manifest
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def _index_file(self, entry):
+        return np.memmap(self._path(entry['name']), dtype=INDEX_DTYPE, mode='r',
+                         shape=(entry['rows'],))
+
+    def contains(self, keys):
+        """Which of the hashes keys the committed index holds, as a bool array"""
+        wanted = np.frombuffer(b''.join(keys), dtype=INDEX_DTYPE)
+        found = np.zeros(len(wanted), dtype=bool)
+        for entry in self.manifest['index']:
+            sorted_keys = self._index_file(entry)
+            positions = np.searchsorted(sorted_keys, wanted)
+            inside = positions < len(sorted_keys)
+            found[inside] |= sorted_keys[positions[inside]] == wanted[inside]
+        return found
+
+    def __iter__(self):
+        """Stream committed examples as {"text", "intent"} dicts, shard by shard"""
+        for shard in self.manifest['shards']:
+            with open(self._path(shard['name']), 'rb') as f:
+                remaining = shard['bytes']
+                for line in f:
+                    if remaining <= 0:
+                        break
+                    remaining -= len(line)
+                    yield json.loads(line)
+
+    def add(self, examples):
+        """Append the examples whose text is not in the store yet, returns how many"""
+        with self._locked():
+            # Another writer may have committed since this store was opened
+            self.manifest = self._committed()
+            examples = list(examples)
+            candidates = [text_key(normalize_text(example['text'])) for example in examples]
+            stored = self.contains(candidates)
+            rows, keys, seen = [], [], set()
+            for example, key, in_store in zip(examples, candidates, stored):
+                if not in_store and key not in seen:
+                    seen.add(key)
+                    keys.append(key)
+                    rows.append({'text': example['text'], 'intent': example['intent']})
+            if rows:
+                self._append(rows, keys)
+        return len(rows)
+
+    def _append(self, rows, keys):
+        """Write rows and their keys and commit them, assumes the lock is held"""
+        manifest = json.loads(json.dumps(self.manifest))
+        shards = manifest['shards']
+        start = 0
+        while start < len(rows):
+            if not shards or shards[-1]['rows'] >= self.shard_rows:
+                shards.append({'name': f"shard-{len(shards):05d}.jsonl", 'rows': 0, 'bytes': 0})
+            shard = shards[-1]
+            chunk = rows[start:start + self.shard_rows - shard['rows']]
+            data = b''.join(json.dumps(row, ensure_ascii=False).encode('utf-8') + b'\n'
+                            for row in chunk)
+            self._append_bytes(shard['name'], shard['bytes'], data)
+            shard['rows'] += len(chunk)
+            shard['bytes'] += len(data)
+            start += len(chunk)
+
+        index = manifest['index']
+        new_keys = np.sort(np.frombuffer(b''.join(keys), dtype=INDEX_DTYPE))
+        index.append(self._write_index(manifest, new_keys))
+        while len(index) > 1 and index[-2]['rows'] <= index[-1]['rows']:
+            merged = np.sort(np.concatenate([self._index_file(entry) for entry in index[-2:]]))
+            index[-2:] = [self._write_index(manifest, merged)]
+        manifest['rows'] += len(rows)
+        self.manifest = self._write_manifest(manifest)
+
+        # Index files merged away (or left by an interrupted add) are no longer read
+        current = {entry['name'] for entry in index}
+        for path in self.dir.glob('index-*.bin'):
+            if path.name not in current:
+                path.unlink(missing_ok=True)
+
+    def _write_index(self, manifest, sorted_keys):
+        """Write sorted keys as the manifest's next index file, assumes the lock is held"""
+        name = f"index-{manifest['next_index']:05d}.bin"
+        manifest['next_index'] += 1
+        self._append_bytes(name, 0, sorted_keys.tobytes())
+        return {'name': name, 'rows': len(sorted_keys)}
+
+    def import_json(self, path):
+        """Add the examples of a JSON list like training_data_expanded.json"""
+        with open(path, 'r') as f:
+            return self.add(json.load(f))
+
+    def export_json(self, path):
+        """Write every example as one JSON list, for tools that read --data files"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def load_examples(path):
+    """{"text", "intent"} examples from a store directory or a JSON list file"""
+    if Path(path).is_dir():
+        return list(DatasetStore(path))
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the append-only training command store")
+    parser.add_argument("--store", default=DEFAULT_STORE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Add the examples of JSON list files")
+    import_parser.add_argument("paths", nargs='+')
+    export_parser = commands.add_parser("export", help="Write the store as one JSON list")
+    export_parser.add_argument("path")
+    commands.add_parser("stats", help="Count examples per intent")
+    args = parser.parse_args()
+
+    store = DatasetStore(args.store)
+    if args.command == "import":
+        for path in args.paths:
+            before = len(store)
+            added = store.import_json(path)
+            print(f"{path}: {added} new examples ({before} -> {len(store)})")
+    elif args.command == "export":
+        store.export_json(args.path)
+        print(f"Wrote {len(store)} examples to {args.path}")
+    else:
+        if not len(store):
+            sys.exit(f"{args.store} is empty, import a JSON file first")
+        counts = Counter(example['intent'] for example in store)
+        print(f"{len(store)} examples in {len(store.manifest['shards'])} shard(s)")
+        for intent, count in sorted(counts.items()):
+            print(f"  {intent:12}: {count:3}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Nearest-neighbour index of training example embeddings
+
+Most commands the browser sees are a small rewording of an example in
+the training data. build_embedding_index.py stores the fine-tuned
+encoder's [CLS] embedding of every example, unit length, as a float16 or
+row-scaled int8 matrix. The inference server compares each request's
+embedding with all of them in one matrix product and answers with the
+nearest example's intent when the cosine similarity clears a threshold,
+falling back to the classifier head otherwise. Every answer from the index
+can be traced to a training example, and the index is rebuilt from new
+examples without retraining.
+"""
+
+import threading
+from pathlib import Path
+import numpy as np
+from prediction_cache import model_fingerprint
+
+INDEX_FORMAT = 1
+
+# Rows compared per matrix product, bounds the float32 copy of the matrix
+SEARCH_CHUNK_ROWS = 4096
+
+# Files whose change makes stored embeddings stale
+MODEL_WEIGHT_FILES = ('config.json', 'model.safetensors', 'pytorch_model.bin')
+
+
+def index_fingerprint(model_path):
+    """Fingerprint of the weights the embeddings were computed with"""
+    return model_fingerprint(*(Path(model_path) / name for name in MODEL_WEIGHT_FILES))
+
+
+def normalize_rows(embeddings):
+    """Scale each row to unit length so a dot product is a cosine similarity"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def compress_rows(embeddings, dtype):
+    """Store unit rows as float16, or as int8 with one scale per row"""
+    if dtype == 'float16':
+        return embeddings.astype(np.float16), None
+    if dtype == 'int8':
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        vectors = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return vectors, scales
+    raise ValueError(f"Unknown index dtype '{dtype}', expected float16 or int8")
+
+
+class EmbeddingIndex:
+    """Cosine search over compressed training embeddings, with hit counting"""
+
+    def __init__(self, vectors, scales, labels, texts, intents, threshold):
+        self.vectors = vectors
+        self.scales = scales
+        self.labels = labels
+        self.texts = texts
+        self.intents = intents
+        self.threshold = threshold
+
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    @classmethod
+    def load(cls, path, model_path, threshold):
+        """Load an index written by build_embedding_index.py for model_path"""
+        with np.load(path, allow_pickle=False) as saved:
+            if int(saved['format']) != INDEX_FORMAT:
+                raise ValueError(f"{path} has an unsupported format, rebuild it")
+            if str(saved['fingerprint']) != index_fingerprint(model_path):
+                raise ValueError(f"{path} was built for different model weights, "
+                                 "rebuild it with build_embedding_index.py")
+            scales = saved['scales'] if saved['scales'].size else None
+            return cls(saved['vectors'], scales, saved['labels'], saved['texts'].tolist(),
+                       saved['intents'].tolist(), threshold)
+
+    def save(self, path, fingerprint):
+        np.savez(
+            path,
+            format=np.int64(INDEX_FORMAT),
+            fingerprint=np.array(fingerprint),
+            vectors=self.vectors,
+            scales=self.scales if self.scales is not None else np.empty(0, dtype=np.float32),
+            labels=self.labels,
+            texts=np.array(self.texts),
+            intents=np.array(self.intents),
+        )
+
+    def search(self, embeddings):
+        """Best similarity and the row it came from for each query embedding"""
+        queries = normalize_rows(embeddings)
+        best = np.full(len(queries), -np.inf, dtype=np.float32)
+        rows = np.zeros(len(queries), dtype=np.int64)
+
+        for start in range(0, len(self.vectors), SEARCH_CHUNK_ROWS):
+            chunk = self.vectors[start:start + SEARCH_CHUNK_ROWS].astype(np.float32)
+            similarities = queries @ chunk.T
+            if self.scales is not None:
+                similarities *= self.scales[start:start + SEARCH_CHUNK_ROWS]
+            chunk_rows = similarities.argmax(axis=1)
+            chunk_best = similarities[np.arange(len(queries)), chunk_rows]
+            better = chunk_best > best
+            best[better] = chunk_best[better]
+            rows[better] = chunk_rows[better] + start
+        return best, rows
+
+    def match(self, embeddings):
+        """Intent index and similarity per query, or None where below threshold"""
+        similarities, rows = self.search(embeddings)
+        # int8 rounding can put an exact match slightly above 1
+        matches = [(int(self.labels[row]), min(float(similarity), 1.0))
+                   if similarity >= self.threshold else None
+                   for similarity, row in zip(similarities, rows)]
+        with self.lock:
+            self.lookups += len(matches)
+            self.hits += sum(match is not None for match in matches)
+        return matches
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.vectors),
+                "dtype": str(self.vectors.dtype),
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            }
@@ -1,14 +1,21 @@
 """
 Further expand training data with more diverse examples for all 9 intents
+
+The examples are appended to the dataset store (dataset_store.py), which
+skips commands it already has. On the first run the store is filled from
+training_data_expanded.json.
 """
 
-import json
+import os
+from collections import Counter
+from dataset_store import DatasetStore
 
-# Load existing data
-with open('training_data_expanded.json', 'r') as f:
-    existing_data = json.load(f)
+store = DatasetStore()
+if not len(store) and os.path.exists('training_data_expanded.json'):
+    imported = store.import_json('training_data_expanded.json')
+    print(f"Imported {imported} examples from training_data_expanded.json")
 
-print(f"Current examples: {len(existing_data)}")
+print(f"Current examples: {len(store)}")
 
 # Additional examples for each intent
 new_examples = [
@@ -114,32 +121,19 @@ new_examples = [
     {"text": "input data into field", "intent": "type"},
 ]
 
-# Combine with existing data
-all_data = existing_data + new_examples
-
-# Remove duplicates based on text (case-insensitive)
-seen_texts = set()
-unique_data = []
-for item in all_data:
-    text_lower = item['text'].lower()
-    if text_lower not in seen_texts:
-        seen_texts.add(text_lower)
-        unique_data.append(item)
-
-# Save expanded data
-with open('training_data_expanded.json', 'w') as f:
-    json.dump(unique_data, f, indent=2)
+# Append only the commands the store does not have yet (case-insensitive)
+previous = len(store)
+added = store.add(new_examples)
 
 print(f"\n✓ Training data further expanded:")
-print(f"  Previous examples: {len(existing_data)}")
-print(f"  New examples added: {len(new_examples)}")
-print(f"  Total unique examples: {len(unique_data)}")
+print(f"  Previous examples: {previous}")
+print(f"  New examples added: {added} of {len(new_examples)}")
+print(f"  Total unique examples: {len(store)}")
 
 # Show distribution
-from collections import Counter
-intent_counts = Counter(item['intent'] for item in unique_data)
+intent_counts = Counter(item['intent'] for item in store)
 print(f"\nExamples per intent:")
 for intent, count in sorted(intent_counts.items()):
     print(f"  {intent:12}: {count:3}")
 
-print(f"\n✓ Saved to: training_data_expanded.json")
+print(f"\n✓ Saved to: {store.dir}")
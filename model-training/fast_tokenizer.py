@@ -0,0 +1,83 @@
+"""
+Tokenizer loading without importing transformers
+
+Importing transformers takes seconds, longer than loading the model itself,
+while the Rust tokenizers library it is built on loads a vocabulary in
+milliseconds. load_tokenizer() reads tokenizer.json when the model
+directory has one, builds the same uncased WordPiece tokenizer from
+vocab.txt when it does not, and only falls back to AutoTokenizer for
+anything else.
+
+Requirements:
+    pip install tokenizers
+"""
+
+import json
+from pathlib import Path
+
+
+class FastTokenizer:
+    """Thin wrapper over a tokenizers.Tokenizer with batch encoding"""
+
+    def __init__(self, tokenizer, pad_token='[PAD]'):
+        self.tokenizer = tokenizer
+        self.tokenizer.no_padding()
+        self.tokenizer.no_truncation()
+        self.max_length = None
+        self.pad_token_id = tokenizer.token_to_id(pad_token) or 0
+
+    def encode_ids(self, texts, max_length):
+        """Token ids with special tokens for each text, truncated to max_length"""
+        if max_length != self.max_length:
+            # Truncation keeps room for [CLS]/[SEP] from the post-processor
+            self.tokenizer.enable_truncation(max_length)
+            self.max_length = max_length
+        return [encoding.ids for encoding in self.tokenizer.encode_batch(texts)]
+
+
+class TransformersTokenizer:
+    """Same interface over AutoTokenizer, for directories without a vocabulary file"""
+
+    def __init__(self, model_path):
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.pad_token_id = self.tokenizer.pad_token_id
+
+    def encode_ids(self, texts, max_length):
+        return self.tokenizer(texts, truncation=True, max_length=max_length)['input_ids']
+
+
+def _tokenizer_config(model_dir):
+    config_path = model_dir / 'tokenizer_config.json'
+    if not config_path.exists():
+        return {}
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+
+def load_tokenizer(model_path):
+    """Fastest available tokenizer for a saved model directory"""
+    from tokenizers import Tokenizer, BertWordPieceTokenizer
+
+    model_dir = Path(model_path)
+    config = _tokenizer_config(model_dir)
+    pad_token = config.get('pad_token', '[PAD]')
+    if isinstance(pad_token, dict):
+        pad_token = pad_token.get('content', '[PAD]')
+
+    if (model_dir / 'tokenizer.json').exists():
+        tokenizer = Tokenizer.from_file(str(model_dir / 'tokenizer.json'))
+        return FastTokenizer(tokenizer, pad_token)
+
+    if (model_dir / 'vocab.txt').exists():
+        # Matches DistilBertTokenizer for distilbert-base-uncased
+        wordpiece = BertWordPieceTokenizer(
+            str(model_dir / 'vocab.txt'),
+            lowercase=config.get('do_lower_case', True),
+            strip_accents=config.get('strip_accents'),
+            handle_chinese_chars=config.get('tokenize_chinese_chars', True),
+        )
+        return FastTokenizer(wordpiece._tokenizer, pad_token)
+
+    return TransformersTokenizer(model_path)
@@ -0,0 +1,40 @@
+"""
+On-disk cache of frozen encoder features
+
+train_navigation_model.py --head-only retrains the classification head,
+optionally with the last transformer layer, on top of an encoder whose
+weights do not change. The encoder's output for a command is therefore
+fixed, so FeatureCache keeps it in a flat float16 file next to a hash of
+the command's text, in a directory named after the frozen weights. Later
+runs memory-map the file and run the encoder only on commands the cache
+has not seen. The storage is the same as the token cache's (append_only.py).
+"""
+
+from pathlib import Path
+import numpy as np
+from append_only import RowCache
+
+FEATURE_DTYPE = np.float16
+
+
+class FeatureCache(RowCache):
+    """Append-only, memory-mapped features of one frozen encoder
+
+    name identifies the encoder weights and the kind of feature; every row
+    has row_shape, e.g. (dim,) for pooled vectors.
+    """
+
+    FORMAT = 2
+
+    def __init__(self, cache_dir, name, row_shape):
+        self.row_shape = tuple(row_shape)
+        self.computed = 0
+        super().__init__(Path(cache_dir) / name, {'features': (FEATURE_DTYPE, self.row_shape)})
+
+    def lookup(self, texts, compute):
+        """Row of every text; compute(texts) returns features for the ones not cached yet"""
+        def compute_features(missing):
+            self.computed += len(missing)
+            return {'features': compute(missing)}
+
+        return self._lookup(texts, compute_features)
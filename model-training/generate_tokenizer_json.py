@@ -1,19 +1,42 @@
 """
 Generate tokenizer.json file for Transformers.js compatibility
+
+Models saved by the training and conversion scripts already include
+tokenizer.json, since they use the fast tokenizer. This is only needed for
+older model directories that have vocab.txt alone; it builds the same
+tokenizer with the tokenizers library, without importing transformers.
 """
 
-from transformers import AutoTokenizer
-import json
+import os
+import sys
+import shutil
+from pathlib import Path
+from fast_tokenizer import FastTokenizer, load_tokenizer
+
+source_dir = Path('../models/distilbert-navigation-quantized')
+output_dir = Path('../models/intent-classifier')
+output_dir.mkdir(parents=True, exist_ok=True)
 
 # Load the tokenizer from the quantized model
-tokenizer = AutoTokenizer.from_pretrained('../models/distilbert-navigation-quantized')
+tokenizer = load_tokenizer(source_dir)
 
-# Save in the new format that includes tokenizer.json
-tokenizer.save_pretrained('../models/intent-classifier')
+# Save in the new format that includes tokenizer.json; without a vocabulary
+# file load_tokenizer falls back to transformers, which only a fast tokenizer
+# can serialize that way
+if isinstance(tokenizer, FastTokenizer):
+    backend = tokenizer.tokenizer
+else:
+    backend = getattr(tokenizer.tokenizer, 'backend_tokenizer', None)
+    if backend is None:
+        sys.exit(f"{source_dir} has neither tokenizer.json nor vocab.txt, and its "
+                 f"{type(tokenizer.tokenizer).__name__} cannot be saved as tokenizer.json")
+backend.save(str(output_dir / 'tokenizer.json'))
+for name in ('tokenizer_config.json', 'special_tokens_map.json', 'vocab.txt'):
+    if (source_dir / name).exists():
+        shutil.copy2(source_dir / name, output_dir / name)
 
-print("✓ Generated tokenizer.json in ../models/intent-classifier/")
+print(f"✓ Generated tokenizer.json in {output_dir}/")
 print("\nFiles now available:")
-import os
-for f in os.listdir('../models/intent-classifier'):
+for f in os.listdir(output_dir):
     if not f.startswith('.'):
         print(f"  - {f}")
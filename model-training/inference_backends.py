@@ -0,0 +1,213 @@
+"""
+Model backends used by the inference server
+
+Each backend loads one model artifact and turns a padded batch of numpy
+input_ids/attention_mask into a numpy array of logits, so the server can
+batch, rank and reply the same way whichever runtime is underneath.
+
+Requirements:
+    pip install transformers torch numpy
+    pip install onnxruntime          # for the onnx backend
+"""
+
+import os
+import json
+import math
+import importlib
+import resource
+from pathlib import Path
+import numpy as np
+
+# onnxruntime graph optimization levels, by command line name
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL',
+}
+
+
+def resident_memory_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # No procfs (macOS): fall back to the peak, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+
+
+def labels_from_config(config):
+    """Ordered intent labels from a model config"""
+    id2label = config.id2label
+    return [id2label[i] for i in range(len(id2label))]
+
+
+def labels_from_config_file(model_path):
+    """Ordered intent labels read from config.json without importing transformers"""
+    with open(Path(model_path) / 'config.json', 'r') as f:
+        id2label = json.load(f)['id2label']
+    return [id2label[str(i)] for i in range(len(id2label))]
+
+
+class TorchBackend:
+    """Eager PyTorch model loaded with AutoModelForSequenceClassification"""
+
+    name = 'torch'
+    runtime_modules = ('torch', 'transformers')
+
+    def __init__(self, model_path, intra_op_threads=0, inter_op_threads=0):
+        import torch
+
+        self.torch = torch
+        if intra_op_threads:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads:
+            torch.set_num_interop_threads(inter_op_threads)
+
+        self.model = self.load_model(model_path)
+        self.model.eval()
+        self.intents = labels_from_config(self.model.config)
+
+    def load_model(self, model_path):
+        from transformers import AutoModelForSequenceClassification
+
+        # The quantized directory stores FP16 weights, which run slower than
+        # FP32 on most CPUs, so always compute in FP32
+        return AutoModelForSequenceClassification.from_pretrained(
+            model_path, dtype=self.torch.float32
+        )
+
+    def logits(self, inputs):
+        tensors = {name: self.torch.from_numpy(np.asarray(value, dtype=np.int64))
+                   for name, value in inputs.items()}
+        with self.torch.no_grad():
+            outputs = self.model(**tensors)
+        return outputs.logits.float().numpy()
+
+    def logits_and_embeddings(self, inputs):
+        """Logits plus the final [CLS] hidden state the classifier head reads"""
+        tensors = {name: self.torch.from_numpy(np.asarray(value, dtype=np.int64))
+                   for name, value in inputs.items()}
+        with self.torch.no_grad():
+            outputs = self.model(**tensors, output_hidden_states=True)
+        return outputs.logits.float().numpy(), outputs.hidden_states[-1][:, 0].float().numpy()
+
+
+class Int8Backend(TorchBackend):
+    """Linear layers run as int8 matmuls through torch dynamic quantization
+
+    Weights come from the quantized_model.pt written by quantize_model.py when
+    it exists, otherwise from the regular checkpoint in model_path.
+    """
+
+    name = 'int8'
+
+    def __init__(self, model_path, quantized_artifact=None, **options):
+        artifact = Path(quantized_artifact) if quantized_artifact else Path(model_path) / 'quantized_model.pt'
+        self.artifact = artifact if artifact.exists() else None
+        super().__init__(model_path, **options)
+
+    def load_model(self, model_path):
+        torch = self.torch
+        if self.artifact is not None:
+            model = load_quantized_artifact(self.artifact)
+        else:
+            model = super().load_model(model_path)
+        model.eval()
+        return torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+
+def load_quantized_artifact(artifact_path):
+    """Rebuild an FP32 model from the uint8 weights saved by quantize_model.py"""
+    import torch
+    from transformers import AutoConfig, AutoModelForSequenceClassification
+
+    checkpoint = torch.load(artifact_path, map_location='cpu', weights_only=True)
+    model_config = dict(checkpoint['model_config'])
+    config = AutoConfig.for_model(model_config.pop('model_type'), **model_config)
+    model = AutoModelForSequenceClassification.from_config(config, dtype=torch.float32)
+
+    params = checkpoint['quantization_params']
+    state_dict = {}
+    for name, tensor in checkpoint['quantized_state_dict'].items():
+        if name in params and 'row_scales' in params[name]:
+            # Row-wise int8 from prune_vocabulary.py: w = q * scale[row]
+            row_scales = params[name]['row_scales'].float()
+            if not (torch.isfinite(row_scales).all() and (row_scales > 0).all()):
+                raise ValueError(f"{artifact_path} has unusable row scales for '{name}'")
+            tensor = tensor.float() * row_scales[:, None]
+        elif name in params:
+            # Inverse of q = round(w / scale + zero_point)
+            scale = params[name]['scale']
+            zero_point = params[name]['zero_point']
+            if not (math.isfinite(scale) and math.isfinite(zero_point) and scale > 0):
+                raise ValueError(
+                    f"{artifact_path} has no usable scale for '{name}', "
+                    "re-run quantize_model.py to regenerate it"
+                )
+            tensor = (tensor.float() - zero_point) * scale
+        state_dict[name] = tensor.float() if tensor.is_floating_point() else tensor
+
+    model.load_state_dict(state_dict)
+    return model
+
+
+class OnnxBackend:
+    """Exported model.onnx served through onnxruntime.InferenceSession"""
+
+    name = 'onnx'
+    runtime_modules = ('onnxruntime',)
+
+    def __init__(self, model_path, onnx_path=None, graph_optimization='all',
+                 intra_op_threads=0, inter_op_threads=0,
+                 enable_mem_arena=True, enable_mem_pattern=True):
+        import onnxruntime as ort
+
+        onnx_path = Path(onnx_path) if onnx_path else Path(model_path) / 'model.onnx'
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[graph_optimization]
+        )
+        # 0 lets onnxruntime pick based on the machine
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.enable_cpu_mem_arena = enable_mem_arena
+        options.enable_mem_pattern = enable_mem_pattern
+
+        self.session = ort.InferenceSession(
+            str(onnx_path), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.intents = labels_from_config_file(model_path)
+
+    def logits(self, inputs):
+        # The exporters trace with int64 ids and mask
+        feed = {name: np.asarray(inputs[name], dtype=np.int64) for name in self.input_names}
+        return self.session.run(None, feed)[0]
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    Int8Backend.name: Int8Backend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def import_runtime(name):
+    """Import the heavy modules a backend needs, so their cost can be timed apart"""
+    for module in BACKENDS[name].runtime_modules:
+        importlib.import_module(module)
+
+
+def load_backend(name, model_path, **options):
+    """Create the backend registered under name"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](model_path, **options)
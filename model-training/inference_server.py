@@ -1,59 +1,686 @@
 """
-Simple inference server for the custom intent classifier
-Runs as a subprocess and communicates via stdin/stdout
+Inference server for the custom intent classifier
+
+Answers requests like {"id": 7, "text": "go back"} with the top intents and
+the same "id", over stdin/stdout or, with --socket, as a daemon shared by
+every client of a Unix socket. Requests are micro-batched, cached by
+normalized text and classified by the --backend model, optionally in
+worker processes. The protocol and every option are described under
+"Python Inference Server" in README_TRAINING.md.
 """
 
+import time
+
+# Measured from here so the startup report includes the imports below
+PROCESS_START = time.perf_counter()
+
 import sys
 import json
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+import queue
+import signal
+import argparse
+import threading
+import functools
+import numpy as np
+from collections import namedtuple
+from collections.abc import Hashable
+from concurrent.futures import ThreadPoolExecutor
+from embedding_index import EmbeddingIndex
+from fast_tokenizer import load_tokenizer
+from inference_backends import (
+    BACKENDS, GRAPH_OPTIMIZATION_LEVELS, import_runtime, labels_from_config_file, load_backend,
+    resident_memory_mb
+)
+from prediction_cache import Prediction, PredictionCache, model_fingerprint, normalize_text
+from request_queue import RequestQueue
+from server_metrics import MetricsExporter, ServerMetrics
+from server_transport import StdioChannel, UnixSocketListener
+from speculation import SpeculativeSessions
+from worker_pool import WorkerPool
 
-# Load model and tokenizer
 model_path = "../models/distilbert-navigation-quantized"
-print(json.dumps({"status": "loading", "message": "Loading model..."}), flush=True)
-
-try:
-    tokenizer = AutoTokenizer.from_pretrained(model_path)
-    model = AutoModelForSequenceClassification.from_pretrained(model_path)
-    model.eval()
-    
-    # Get intent labels from model config
-    id2label = model.config.id2label
-    intents = [id2label[i] for i in range(len(id2label))]
-    
-    print(json.dumps({"status": "ready", "message": "Model loaded successfully", "intents": intents}), flush=True)
-    
-    # Process requests from stdin
-    for line in sys.stdin:
+TOP_K = 3
+
+# A classification waiting for the model; queued_at and deadline are
+# time.perf_counter() values, deadline None when the client waits forever.
+# Speculative requests carry their session and the submitted commands that
+# joined them.
+QueuedRequest = namedtuple('QueuedRequest',
+                           ['channel', 'request_id', 'text', 'key', 'queued_at', 'deadline',
+                            'session', 'waiters'],
+                           defaults=(None, None, None))
+
+CANCELLED = {"status": "cancelled", "message": "Superseded by a newer prefix"}
+EXPIRED = {"status": "expired", "message": "Deadline passed before inference"}
+OVERLOADED = {"status": "overloaded", "message": "Inference queue is full"}
+
+
+def parse_buckets(value):
+    """Sorted, de-duplicated bucket lengths from a value like '8,16,32,64'"""
+    buckets = sorted({int(length) for length in value.split(',') if length.strip()})
+    if not buckets or buckets[0] < 2:
+        raise argparse.ArgumentTypeError("buckets must be integers of at least 2")
+    return buckets
+
+
+def pad_to_bucket(encoded, bucket, pad_token_id):
+    """Stack token id lists into fixed (rows, bucket) id and mask arrays"""
+    input_ids = np.full((len(encoded), bucket), pad_token_id, dtype=np.int64)
+    attention_mask = np.zeros((len(encoded), bucket), dtype=np.int64)
+    for row, ids in enumerate(encoded):
+        input_ids[row, :len(ids)] = ids
+        attention_mask[row, :len(ids)] = 1
+    return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+def top_k_predictions(logits, intents):
+    """Softmax each row of logits and keep the k best intents"""
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=-1, keepdims=True)
+    k = min(TOP_K, len(intents))
+    indices = np.argsort(-probs, axis=-1, kind='stable')[:, :k]
+    scores = np.take_along_axis(probs, indices, axis=-1)
+
+    return [
+        Prediction(row_indices, row_scores, [intents[idx] for idx in row_indices])
+        for row_indices, row_scores in zip(indices.tolist(), scores.tolist())
+    ]
+
+
+def neighbour_prediction(prediction, match, intents):
+    """Put the nearest training example's intent first, then the head's runners-up"""
+    label, similarity = match
+    runners_up = [(idx, score) for idx, score in zip(prediction.indices, prediction.scores)
+                  if idx != label][:len(prediction.indices) - 1]
+    indices = [label] + [idx for idx, _ in runners_up]
+    scores = [similarity] + [score for _, score in runners_up]
+    return Prediction(indices, scores, [intents[idx] for idx in indices])
+
+
+def classify_batch(tokenizer, backend, texts, buckets, stage_times=None, index=None):
+    """Classify a batch of texts, one forward pass per length bucket
+
+    With an EmbeddingIndex, texts close enough to a training example take
+    that example's intent instead of the classifier head's. When
+    stage_times is a dict, the seconds spent in each stage are stored in it.
+    """
+    start = time.perf_counter()
+    # The largest bucket is the longest input the model was trained on
+    encoded = tokenizer.encode_ids(texts, buckets[-1])
+
+    groups = {}
+    for row, ids in enumerate(encoded):
+        bucket = next(b for b in buckets if b >= len(ids))
+        groups.setdefault(bucket, []).append(row)
+    padded = [(rows, pad_to_bucket([encoded[row] for row in rows], bucket, tokenizer.pad_token_id))
+              for bucket, rows in groups.items()]
+    tokenized = time.perf_counter()
+
+    logits = np.empty((len(texts), len(backend.intents)), dtype=np.float32)
+    embeddings = [None] * len(texts)
+    for rows, inputs in padded:
+        if index is None:
+            logits[rows] = backend.logits(inputs)
+        else:
+            logits[rows], pooled = backend.logits_and_embeddings(inputs)
+            for row, embedding in zip(rows, pooled):
+                embeddings[row] = embedding
+    forwarded = time.perf_counter()
+
+    predictions = top_k_predictions(logits, backend.intents)
+    ranked = time.perf_counter()
+    if stage_times is not None:
+        stage_times.update({
+            "tokenize": tokenized - start,
+            "forward": forwarded - tokenized,
+            "softmax_topk": ranked - forwarded,
+        })
+
+    if index is not None:
+        for row, match in enumerate(index.match(np.stack(embeddings))):
+            if match is not None:
+                predictions[row] = neighbour_prediction(predictions[row], match, backend.intents)
+        if stage_times is not None:
+            stage_times["nn_search"] = time.perf_counter() - ranked
+    return predictions
+
+
+def warm_up(tokenizer, backend, buckets, batch_size=1):
+    """Run one forward pass per bucket shape so first requests are not slow"""
+    ids = tokenizer.encode_ids(["warm up"], buckets[-1])[0]
+    for bucket in buckets:
+        backend.logits(pad_to_bucket([ids[:bucket]] * batch_size, bucket, tokenizer.pad_token_id))
+
+
+def timed(timings, phase, function, *args, **kwargs):
+    """Call function and record how long it took under timings[phase]"""
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        timings[phase] = round(time.perf_counter() - start, 3)
+
+
+def load_components(args, timings):
+    """Load the tokenizer, backend and optional embedding index, recording each startup phase"""
+    options = backend_options(args)
+    if args.fast_start:
+        # Imports, tokenizer and weights overlap; torch releases the GIL
+        # while reading weights
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            tokenizer_future = pool.submit(timed, timings, "tokenizer",
+                                           load_tokenizer, args.model_path)
+
+            def load_weights():
+                timed(timings, "imports", import_runtime, args.backend)
+                return timed(timings, "weights", load_backend,
+                             args.backend, args.model_path, **options)
+
+            backend_future = pool.submit(load_weights)
+            tokenizer, backend = tokenizer_future.result(), backend_future.result()
+        timed(timings, "warm_up", warm_up, tokenizer, backend, args.length_buckets,
+              batch_size=args.max_batch_size)
+    else:
+        timed(timings, "imports", import_runtime, args.backend)
+        tokenizer = timed(timings, "tokenizer", load_tokenizer, args.model_path)
+        backend = timed(timings, "weights", load_backend, args.backend, args.model_path, **options)
+        timed(timings, "warm_up", warm_up, tokenizer, backend, args.length_buckets)
+
+    index = None
+    if args.nn_index:
+        if not hasattr(backend, "logits_and_embeddings"):
+            raise ValueError(f"The {backend.name} backend does not expose embeddings, "
+                             "serve --nn-index with the torch or int8 backend")
+        index = timed(timings, "nn_index", EmbeddingIndex.load,
+                      args.nn_index, args.model_path, args.nn_threshold)
+    return tokenizer, backend, index
+
+
+def collect_batch(requests, max_batch_size, batch_window):
+    """Block for one request, then gather more until the window closes or the batch is full
+
+    A batch started by a submitted request gathers only submitted requests.
+    One started by a speculative request takes whatever is already queued
+    without waiting for more. Returns the batch and whether the input has
+    ended.
+    """
+    item = requests.get()
+    if item is None:
+        return [], True
+
+    batch = [item]
+    speculative = item.session is not None
+    deadline = time.monotonic() + (0 if speculative else batch_window)
+    while len(batch) < max_batch_size:
+        remaining = deadline - time.monotonic()
         try:
-            data = json.loads(line.strip())
-            text = data.get('text', '')
-            
-            if not text:
-                print(json.dumps({"error": "No text provided"}), flush=True)
+            item = requests.get(timeout=max(remaining, 0), speculative=speculative)
+        except queue.Empty:
+            break
+        if item is None:
+            return batch, True
+        batch.append(item)
+
+    return batch, False
+
+
+def deliver_speculative(cache, sessions, item, prediction=None, error=None):
+    """Answer a speculative request and the submitted commands that joined it"""
+    current, waiters = sessions.finish(item, prediction)
+    if error is not None:
+        if current:
+            item.channel.reply(item.request_id, {"status": "error", "message": error})
+        else:
+            item.channel.reply(item.request_id, dict(CANCELLED))
+        for waiter, waiter_id in waiters:
+            waiter.reply(waiter_id, {"status": "error", "message": error})
+        return len(waiters) + int(current)
+
+    cache.store(item.key, prediction)
+    if current:
+        item.channel.send_prediction(item.request_id, prediction)
+    else:
+        item.channel.reply(item.request_id, dict(CANCELLED))
+    for waiter, waiter_id in waiters:
+        waiter.send_prediction(waiter_id, prediction)
+    return 0
+
+
+def deliver(cache, sessions, metrics, batch, predictions=None, error=None, stage_times=None):
+    """Answer every request of a classified batch, or report why it failed"""
+    if stage_times:
+        metrics.observe_stages(stage_times)
+
+    start = time.perf_counter()
+    if error is not None:
+        for item in batch:
+            if item.session is not None:
+                metrics.count("errors", deliver_speculative(cache, sessions, item, error=error))
+                continue
+            waiters = [(item.channel, item.request_id)] + cache.fail(item.key)
+            for waiter, waiter_id in waiters:
+                waiter.reply(waiter_id, {"status": "error", "message": error})
+            metrics.count("errors", len(waiters))
+    else:
+        for item, prediction in zip(batch, predictions):
+            if item.session is not None:
+                deliver_speculative(cache, sessions, item, prediction)
                 continue
-            
-            # Tokenize and predict
-            inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-            
-            with torch.no_grad():
-                outputs = model(**inputs)
-                probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
-                scores, indices = torch.topk(probs[0], k=3)
-            
-            # Format results
-            results = []
-            for score, idx in zip(scores.tolist(), indices.tolist()):
-                results.append({
-                    "intent": intents[idx],
-                    "confidence": score
-                })
-            
-            print(json.dumps({"status": "success", "results": results}), flush=True)
-            
+            # Identical requests that arrived meanwhile get the same answer
+            for waiter, waiter_id in [(item.channel, item.request_id)] + cache.complete(item.key, prediction):
+                waiter.send_prediction(waiter_id, prediction)
+
+    finished = time.perf_counter()
+    metrics.observe("serialize", finished - start)
+    for item in batch:
+        metrics.observe("end_to_end", finished - item.queued_at)
+
+
+def classify_and_deliver(tokenizer, backend, index, cache, sessions, metrics, buckets, batch):
+    """Classify a batch in this process and answer it"""
+    stage_times = {}
+    try:
+        predictions = classify_batch(tokenizer, backend, [item.text for item in batch],
+                                     buckets, stage_times, index)
+    except Exception as e:
+        deliver(cache, sessions, metrics, batch, error=str(e))
+    else:
+        deliver(cache, sessions, metrics, batch, predictions, stage_times=stage_times)
+
+
+def drop_expired(cache, sessions, metrics, batch, now):
+    """Answer requests whose client has given up and return the rest
+
+    A request that other requests joined stays, they may still be waiting.
+    """
+    live = []
+    for item in batch:
+        if item.deadline is None or item.deadline > now:
+            live.append(item)
+            continue
+        if item.session is not None:
+            abandoned = sessions.abandon(item)
+        else:
+            abandoned = cache.abandon(item.key)
+        if not abandoned:
+            live.append(item)
+            continue
+        item.channel.reply(item.request_id, dict(EXPIRED))
+        metrics.count("expired")
+    return live
+
+
+def inference_worker(requests, dispatch, cache, sessions, metrics, max_batch_size, batch_window):
+    """Consume queued requests in micro-batches and hand each batch to dispatch"""
+    finished = False
+    while not finished:
+        batch, finished = collect_batch(requests, max_batch_size, batch_window)
+        started = time.perf_counter()
+        batch = drop_expired(cache, sessions, metrics, batch, started)
+        if not batch:
+            continue
+
+        for item in batch:
+            metrics.observe("queue_wait", started - item.queued_at)
+        metrics.observe_batch(len(batch))
+        dispatch(batch)
+
+
+def handle_command(channel, request_id, data, metrics):
+    """Answer a control message instead of a classification"""
+    command = data['cmd']
+    if command == "hello":
+        framing = data.get('framing', 'json')
+        if framing == "binary":
+            channel.switch_to_binary(request_id, {"status": "hello", "framing": "binary"})
+        elif framing == "json":
+            channel.reply(request_id, {"status": "hello", "framing": "json"})
+        else:
+            channel.reply(request_id, {"status": "error", "message": f"Unknown framing: {framing}"})
+    elif command == "stats":
+        channel.reply(request_id, {"status": "stats", **metrics.report()})
+    else:
+        channel.reply(request_id, {"status": "error", "message": f"Unknown command: {command}"})
+
+
+def cancel_stale(requests, session, stale):
+    """Drop superseded speculative work that has not reached the model yet"""
+    if stale is not None and requests.cancel_speculative(session, stale):
+        stale.channel.reply(stale.request_id, dict(CANCELLED))
+
+
+def request_deadline(data, received, default_timeout):
+    """perf_counter() deadline from the request's timeout_ms, or None for no deadline"""
+    timeout_ms = data.get('timeout_ms', default_timeout)
+    if timeout_ms is None:
+        return None
+    timeout_ms = float(timeout_ms)
+    return received + timeout_ms / 1000.0 if timeout_ms > 0 else None
+
+
+def queue_partial(channel, request_id, session, text, key, received, deadline,
+                  requests, cache, sessions):
+    """Speculatively classify a prefix, superseding the session's previous one"""
+    prediction = cache.peek(key)
+    if prediction is not None:
+        cancel_stale(requests, session, sessions.settle(session, key, prediction))
+        channel.send_prediction(request_id, prediction, cached=True)
+        return
+
+    item = QueuedRequest(channel, request_id, text, key, received, deadline, session, [])
+    sessions.begin(session, item)
+    replaced = requests.put_speculative(session, item)
+    if replaced is not None:
+        # Never reached the model; one that did is cancelled when it finishes
+        channel.reply(replaced.request_id, dict(CANCELLED))
+
+
+def read_requests(channel, requests, cache, sessions, metrics, default_timeout=None):
+    """Read a client's requests, answer what the cache can, and queue the rest"""
+    for data in channel.messages():
+        request_id = data.get('id') if isinstance(data, dict) else None
+        try:
+            handle_request(channel, request_id, data, requests, cache, sessions, metrics,
+                           default_timeout)
+        except Exception as e:
+            # One bad message must not take the reader, and with it the client, down
+            metrics.count("errors")
+            channel.reply(request_id, {"status": "error",
+                                       "message": f"Invalid request: {type(e).__name__}: {e}"})
+
+
+def request_error(channel, request_id, metrics, message):
+    metrics.count("errors")
+    channel.reply(request_id, {"status": "error", "message": message})
+
+
+def handle_request(channel, request_id, data, requests, cache, sessions, metrics, default_timeout):
+    """Answer or queue one decoded message"""
+    if not isinstance(data, dict):
+        request_error(channel, request_id, metrics, "Request must be a JSON object")
+        return
+    if 'cmd' in data:
+        handle_command(channel, request_id, data, metrics)
+        return
+
+    received = time.perf_counter()
+    partial = data.get('type') == 'partial'
+    metrics.count("partials" if partial else "requests")
+    text = data.get('text', '')
+    if not isinstance(text, str):
+        request_error(channel, request_id, metrics, "text must be a string")
+        return
+    if not text:
+        request_error(channel, request_id, metrics, "No text provided")
+        return
+    try:
+        deadline = request_deadline(data, received, default_timeout)
+    except (TypeError, ValueError):
+        request_error(channel, request_id, metrics, "timeout_ms must be a number")
+        return
+    session_name = data.get('session')
+    if not isinstance(session_name, Hashable):
+        request_error(channel, request_id, metrics, "session must be a string or number")
+        return
+
+    key = normalize_text(text)
+    # Sessions are per connection, so two clients can use the same name
+    session = (channel, session_name) if session_name is not None else None
+    if partial:
+        if session is None:
+            request_error(channel, request_id, metrics, "Partial requests need a session")
+        else:
+            queue_partial(channel, request_id, session, text, key, received, deadline,
+                          requests, cache, sessions)
+        return
+
+    if session is not None:
+        outcome, value, stale = sessions.claim(session, key, (channel, request_id))
+        cancel_stale(requests, session, stale)
+        if outcome == "hit":
+            channel.send_prediction(request_id, value, cached=True)
+            return
+        if outcome == "joined":
+            # The submission now waits on it, so it must not wait behind typing
+            requests.promote(session, value)
+            return
+
+    outcome, prediction = cache.lookup(key, (channel, request_id))
+    if outcome == "hit":
+        channel.send_prediction(request_id, prediction, cached=True)
+    elif outcome == "miss":
+        if not requests.put(QueuedRequest(channel, request_id, text, key, received, deadline)):
+            metrics.count("overloaded")
+            # Identical requests that joined meanwhile are turned away too
+            for waiter, waiter_id in [(channel, request_id)] + cache.fail(key):
+                waiter.reply(waiter_id, dict(OVERLOADED))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Intent classifier inference server")
+    parser.add_argument("--model-path", default=model_path,
+                        help="Model directory with config and tokenizer files")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="torch",
+                        help="Runtime used to serve the model")
+    parser.add_argument("--batch-window-ms", type=float, default=3.0,
+                        help="How long to wait for more requests before running a batch")
+    parser.add_argument("--max-batch-size", type=int, default=32,
+                        help="Largest number of requests classified in one forward pass")
+    parser.add_argument("--length-buckets", type=parse_buckets, default=[8, 16, 32, 64],
+                        help="Comma separated padded lengths; the largest is the truncation "
+                             "length and matches max_length in train_navigation_model.py")
+    parser.add_argument("--max-queue", type=int, default=256,
+                        help="Submitted requests allowed to wait; more are answered "
+                             "'overloaded' (0 = unbounded)")
+    parser.add_argument("--request-timeout-ms", type=float, default=0,
+                        help="Deadline for requests without their own timeout_ms "
+                             "(0 = wait forever)")
+    parser.add_argument("--intra-op-threads", type=int, default=0,
+                        help="Threads used inside one operator (0 = runtime default)")
+    parser.add_argument("--inter-op-threads", type=int, default=0,
+                        help="Threads used to run independent operators (0 = runtime default)")
+
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Model processes, each pinned to its own share of the cores; "
+                             "more than 1 runs the model outside this process")
+
+    parser.add_argument("--fast-start", action="store_true",
+                        help="Load tokenizer and weights in parallel, accept requests while "
+                             "loading, and warm up a full batch before ready")
+    parser.add_argument("--socket", default=None,
+                        help="Run as a shared daemon on this Unix socket instead of stdin/stdout")
+    parser.add_argument("--idle-timeout", type=float, default=0,
+                        help="Daemon exits after this many seconds without clients (0 = never)")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Most replies kept in the prediction cache (0 = no caching)")
+    parser.add_argument("--cache-ttl", type=float, default=0,
+                        help="Seconds a cached reply stays valid (0 = until evicted)")
+    parser.add_argument("--cache-file", default=None,
+                        help="Persist the prediction cache to this file across restarts")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Write Prometheus text metrics to this file every --metrics-interval")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve Prometheus text metrics at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="Seconds between rewrites of --metrics-file")
+
+    index_group = parser.add_argument_group("embedding index")
+    index_group.add_argument("--nn-index", default=None,
+                             help="embedding_index.npz from build_embedding_index.py; answers "
+                                  "commands close to a training example with its intent")
+    index_group.add_argument("--nn-threshold", type=float, default=0.95,
+                             help="Cosine similarity needed to answer from the index")
+
+    int8_group = parser.add_argument_group("int8 backend")
+    int8_group.add_argument("--int8-artifact", default=None,
+                            help="quantized_model.pt to rebuild from (default: <model-path>/quantized_model.pt, "
+                                 "falling back to the regular weights)")
+
+    onnx_group = parser.add_argument_group("onnx backend")
+    onnx_group.add_argument("--onnx-path", default=None,
+                            help="Exported graph to serve (default: <model-path>/model.onnx)")
+    onnx_group.add_argument("--graph-optimization", choices=list(GRAPH_OPTIMIZATION_LEVELS),
+                            default="all", help="onnxruntime graph optimization level")
+    onnx_group.add_argument("--no-mem-arena", action="store_true",
+                            help="Disable the onnxruntime CPU memory arena")
+    onnx_group.add_argument("--no-mem-pattern", action="store_true",
+                            help="Disable onnxruntime memory pattern planning")
+    return parser.parse_args()
+
+
+def backend_options(args):
+    """Keyword arguments for the backend selected on the command line"""
+    options = {
+        "intra_op_threads": args.intra_op_threads,
+        "inter_op_threads": args.inter_op_threads,
+    }
+    if args.backend == "int8":
+        options["quantized_artifact"] = args.int8_artifact
+    elif args.backend == "onnx":
+        options.update({
+            "onnx_path": args.onnx_path,
+            "graph_optimization": args.graph_optimization,
+            "enable_mem_arena": not args.no_mem_arena,
+            "enable_mem_pattern": not args.no_mem_pattern,
+        })
+    return options
+
+
+def main():
+    args = parse_args()
+    status = {"status": "loading", "message": "Loading model...", "accepting": args.fast_start}
+    try:
+        # Cache hits can be answered while loading, as binary frames that index these
+        status["intents"] = labels_from_config_file(args.model_path)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Key the persisted cache to every file the backend may have loaded
+    fingerprint = model_fingerprint(
+        args.model_path, args.onnx_path, args.int8_artifact, args.nn_index,
+        exclude=[args.cache_file]
+    )
+    if args.nn_index:
+        fingerprint += f":nn{args.nn_threshold}"
+    cache = PredictionCache(args.cache_size, args.cache_ttl, args.cache_file,
+                            f"{args.backend}:{fingerprint}")
+    requests = RequestQueue(args.max_queue)
+    sessions = SpeculativeSessions()
+    metrics = ServerMetrics()
+    metrics.sources["cache"] = cache.stats
+    metrics.sources["speculation"] = sessions.stats
+    metrics.sources["queue"] = requests.stats
+    metrics.gauges["queue_depth"] = requests.depth
+    default_timeout = args.request_timeout_ms or None
+    exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_port, args.metrics_interval)
+    exporter.start()
+
+    if args.socket:
+        def serve_client(channel):
+            # Every client starts with the current loading/ready message
+            channel.send(dict(status))
+            read_requests(channel, requests, cache, sessions, metrics, default_timeout)
+
+        listener = UnixSocketListener(args.socket, serve_client, args.idle_timeout)
+        stdio = None
+
+        def announce(message):
+            print(json.dumps(message), flush=True)
+            listener.broadcast(message)
+
+        try:
+            listener.start()
         except Exception as e:
-            print(json.dumps({"status": "error", "message": str(e)}), flush=True)
-            
-except Exception as e:
-    print(json.dumps({"status": "error", "message": f"Failed to load model: {str(e)}"}), flush=True)
-    sys.exit(1)
+            # Nobody can connect yet; the daemon's stderr is the client's only clue
+            message = {"status": "error", "message": f"Failed to listen on {args.socket}: {e}"}
+            print(json.dumps(message), file=sys.stderr, flush=True)
+            exporter.close()
+            sys.exit(1)
+    else:
+        listener = None
+        stdio = StdioChannel()
+        announce = stdio.send
+    announce(status)
+
+    # Set when stdin closes or on SIGTERM (how the app stops its private
+    # server), so both paths drain the queue and save the cache
+    shutdown = threading.Event()
+
+    def handle_sigterm(signum, frame):
+        shutdown.set()
+        if listener is not None:
+            listener.stopped.set()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    def read_until_eof():
+        read_requests(stdio, requests, cache, sessions, metrics, default_timeout)
+        shutdown.set()
+
+    reader = threading.Thread(target=read_until_eof, daemon=True)
+    if stdio is not None and args.fast_start:
+        # Requests sent while loading wait in the queue for the worker
+        reader.start()
+
+    timings = {}
+    pool = None
+    try:
+        if args.workers > 1:
+            pool = WorkerPool(args, args.workers, functools.partial(deliver, cache, sessions, metrics))
+            pool.start(timings)
+            metrics.sources["workers"] = pool.stats
+            if args.nn_index:
+                metrics.sources["nn_index"] = pool.index_stats
+            intents, backend_name, dispatch = pool.intents, args.backend, pool.submit
+        else:
+            tokenizer, backend, index = load_components(args, timings)
+            intents, backend_name = backend.intents, backend.name
+            dispatch = functools.partial(classify_and_deliver, tokenizer, backend, index, cache,
+                                         sessions, metrics, args.length_buckets)
+            if index is not None:
+                metrics.sources["nn_index"] = index.stats
+    except Exception as e:
+        announce({"status": "error", "message": f"Failed to load model: {str(e)}"})
+        if listener is not None:
+            listener.close()
+        exporter.close()
+        sys.exit(1)
+    timings["total"] = round(time.perf_counter() - PROCESS_START, 3)
+
+    status = {"status": "ready", "message": "Model loaded successfully",
+              "intents": intents, "backend": backend_name, "workers": args.workers,
+              "length_buckets": args.length_buckets, "startup": timings,
+              "load_seconds": timings["total"], "rss_mb": round(resident_memory_mb(), 1)}
+    announce(status)
+
+    # Only after ready: binary prediction frames index the intents it carries
+    worker = threading.Thread(
+        target=inference_worker,
+        args=(requests, dispatch, cache, sessions, metrics, args.max_batch_size,
+              args.batch_window_ms / 1000.0),
+        daemon=True
+    )
+    worker.start()
+
+    if listener is not None:
+        listener.wait_until_idle()
+        listener.close()
+    else:
+        if not args.fast_start and not shutdown.is_set():
+            reader.start()
+        while not shutdown.wait(1.0):
+            pass
+
+    # No more input, let the worker drain what is left and stop
+    requests.close()
+    worker.join()
+    if pool is not None:
+        pool.drain()
+        pool.stop()
+    cache.save()
+    exporter.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Prediction cache for the inference server
+
+Commands like "go back" or "scroll down" repeat constantly, so predictions
+are kept in an LRU keyed on normalized text. Identical requests that arrive
+while the first one is still being computed join it instead of queueing a
+second forward pass. The cache can be saved to disk and is tied to a
+fingerprint of the model artifact, so a retrained model never serves
+stale answers.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict, namedtuple
+
+# Bumped whenever the saved entry layout changes
+CACHE_FORMAT = 2
+
+# Top-k answer for one text: intent indices, their probabilities and names
+Prediction = namedtuple('Prediction', ['indices', 'scores', 'intents'])
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s.,!?;:]+$')
+
+
+def normalize_text(text):
+    """Cache key for a command: lower case, single spaces, no trailing punctuation"""
+    text = _WHITESPACE.sub(' ', text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub('', text)
+
+
+def model_fingerprint(*paths, exclude=()):
+    """Hash of the name, size and modification time of every model file
+
+    Directories are walked, missing paths are skipped, so the same call
+    works for any backend's set of artifacts. Files in exclude (such as the
+    cache file itself) are left out.
+    """
+    excluded = {Path(p).resolve() for p in exclude if p}
+    digest = hashlib.sha256()
+    for path in paths:
+        if path is None:
+            continue
+        path = Path(path)
+        files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+        for file in files:
+            if not file.exists() or file.resolve() in excluded:
+                continue
+            stat = file.stat()
+            digest.update(f"{file.resolve()}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def prediction_results(prediction):
+    """JSON reply form of a prediction: [{"intent", "confidence"}, ...]"""
+    return [{"intent": intent, "confidence": score}
+            for intent, score in zip(prediction.intents, prediction.scores)]
+
+
+class PredictionCache:
+    """Thread-safe LRU of Predictions with optional TTL and single-flight joining"""
+
+    def __init__(self, max_entries=1024, ttl_seconds=0, persist_path=None, fingerprint=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = Path(persist_path) if persist_path else None
+        self.fingerprint = fingerprint
+
+        self.entries = OrderedDict()   # key -> (stored_at, prediction)
+        self.in_flight = {}            # key -> waiters joined to the leader
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+        self.expired = 0
+
+        if self.persist_path is not None:
+            self.load()
+
+    def lookup(self, key, waiter):
+        """Find a prediction for key
+
+        Returns ("hit", prediction) when cached, ("joined", None) when an
+        identical request is already running and waiter will be handed back
+        by complete() or fail(), or ("miss", None) when the caller must
+        compute it and later call one of them.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                stored_at, prediction = entry
+                if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                    del self.entries[key]
+                    self.expired += 1
+                else:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return "hit", prediction
+
+            if key in self.in_flight:
+                self.in_flight[key].append(waiter)
+                self.joined += 1
+                return "joined", None
+
+            self.misses += 1
+            self.in_flight[key] = []
+            return "miss", None
+
+    def peek(self, key):
+        """Cached prediction for key or None, without counting a lookup or joining"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored_at, prediction = entry
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                return None
+            self.entries.move_to_end(key)
+            return prediction
+
+    def _store(self, key, prediction):
+        """Insert an entry and evict the oldest, assumes self.lock is held"""
+        if self.max_entries > 0:
+            self.entries[key] = (time.time(), prediction)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def store(self, key, prediction):
+        """Cache a prediction computed outside lookup(), e.g. a speculative one"""
+        with self.lock:
+            self._store(key, prediction)
+
+    def complete(self, key, prediction):
+        """Store the computed prediction and return the waiters that joined it"""
+        with self.lock:
+            waiters = self.in_flight.pop(key, [])
+            self._store(key, prediction)
+            return waiters
+
+    def fail(self, key):
+        """Forget a failed computation and return the waiters that joined it"""
+        with self.lock:
+            return self.in_flight.pop(key, [])
+
+    def abandon(self, key):
+        """Give up a computation nobody joined; returns False when someone did"""
+        with self.lock:
+            if self.in_flight.get(key):
+                return False
+            self.in_flight.pop(key, None)
+            return True
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.joined
+            return {
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "joined": self.joined,
+                "expired": self.expired,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def load(self):
+        """Restore entries saved by a previous run of the same model"""
+        try:
+            with open(self.persist_path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if saved.get('format') != CACHE_FORMAT or self.max_entries <= 0:
+            return
+        if saved.get('fingerprint') != self.fingerprint:
+            # Model artifact changed since the cache was written
+            return
+
+        now = time.time()
+        for key, stored_at, prediction in saved.get('entries', [])[-self.max_entries:]:
+            if self.ttl_seconds and now - stored_at > self.ttl_seconds:
+                continue
+            self.entries[key] = (stored_at, Prediction(*prediction))
+
+    def save(self):
+        """Write entries to disk, replacing the previous file atomically"""
+        if self.persist_path is None:
+            return
+
+        with self.lock:
+            saved = {
+                'format': CACHE_FORMAT,
+                'fingerprint': self.fingerprint,
+                'entries': [[key, stored_at, list(prediction)]
+                            for key, (stored_at, prediction) in self.entries.items()],
+            }
+
+        self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.persist_path.with_name(self.persist_path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.persist_path)
@@ -0,0 +1,250 @@
+"""
+Shrink the model's vocabulary to the tokens browser commands use
+
+distilbert-base-uncased carries 30,522 WordPiece tokens, and its word
+embedding matrix is about a third of the model, yet navigation commands
+touch a few hundred of them. This tool tokenizes the training data (plus
+any extra corpus files), keeps the tokens that appear, the special tokens,
+every single-character piece so unseen words still tokenize without [UNK],
+and the most common words of the original vocabulary as a margin. It then
+writes a model directory with the embedding rows cut down to match and a
+remapped vocab.txt / tokenizer.json.
+
+Tokens are kept in their original order, so WordPiece's longest-match
+splits every word of the measured corpus exactly as before; the tool checks
+this, and that the pruned model returns the same logits.
+
+With --int8-embeddings the quantized_model.pt artifact served by
+inference_server.py --backend int8 stores the word embeddings as int8 with
+one scale per row.
+
+Requirements:
+    pip install transformers torch tokenizers
+"""
+
+import copy
+import json
+import shutil
+import argparse
+from pathlib import Path
+from collections import Counter
+import torch
+from transformers import AutoModelForSequenceClassification
+from dataset_store import DEFAULT_STORE, DatasetStore
+from fast_tokenizer import load_tokenizer
+
+WORD_EMBEDDINGS = 'distilbert.embeddings.word_embeddings.weight'
+
+
+def read_corpus(paths):
+    """Texts from dataset stores, JSON lists (of strings or {"text": ...}) or plain text files"""
+    texts = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            texts.extend(item['text'] for item in DatasetStore(path))
+        elif path.suffix == '.json':
+            with open(path, 'r') as f:
+                items = json.load(f)
+            texts.extend(item['text'] if isinstance(item, dict) else item for item in items)
+        else:
+            with open(path, 'r') as f:
+                texts.extend(line.strip() for line in f if line.strip())
+    return texts
+
+
+def read_vocab(model_dir):
+    """Tokens in id order, from vocab.txt or the WordPiece model in tokenizer.json"""
+    if (model_dir / 'vocab.txt').exists():
+        with open(model_dir / 'vocab.txt', 'r', encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f]
+    with open(model_dir / 'tokenizer.json', 'r', encoding='utf-8') as f:
+        vocab = json.load(f)['model']['vocab']
+    return sorted(vocab, key=vocab.get)
+
+
+def select_tokens(vocab, token_counts, margin, special_tokens):
+    """Ids to keep: used, special and single-character tokens plus a margin of common words"""
+    keep = set(token_counts) | {vocab.index(token) for token in special_tokens if token in vocab}
+    for token_id, token in enumerate(vocab):
+        piece = token[2:] if token.startswith('##') else token
+        if len(piece) == 1:
+            keep.add(token_id)
+
+    # Outside [unusedN] and ## pieces, the original vocabulary is roughly
+    # ordered by frequency, so the lowest ids are the most common words
+    added = 0
+    for token_id, token in enumerate(vocab):
+        if added >= margin:
+            break
+        if token_id in keep or token.startswith('##') or token.startswith('[unused'):
+            continue
+        keep.add(token_id)
+        added += 1
+    return sorted(keep)
+
+
+def remap_tokenizer_json(source, destination, new_vocab):
+    """Rewrite every token id in tokenizer.json for the pruned vocabulary"""
+    with open(source, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    new_ids = {token: token_id for token_id, token in enumerate(new_vocab)}
+
+    data['model']['vocab'] = new_ids
+    for added in data.get('added_tokens', []):
+        added['id'] = new_ids[added['content']]
+
+    processor = data.get('post_processor') or {}
+    if processor.get('type') == 'TemplateProcessing':
+        for special in processor['special_tokens'].values():
+            special['ids'] = [new_ids[token] for token in special['tokens']]
+    elif processor.get('type') == 'BertProcessing':
+        for field in ('sep', 'cls'):
+            processor[field] = [processor[field][0], new_ids[processor[field][0]]]
+
+    if data.get('padding'):
+        data['padding']['pad_id'] = new_ids[data['padding']['pad_token']]
+
+    with open(destination, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def quantize_rows(weight):
+    """Symmetric int8 per row: weight ~= q * scale[:, None]"""
+    weight = weight.float()
+    scales = weight.abs().amax(dim=1).clamp(min=1e-8) / 127.0
+    quantized = torch.clamp(torch.round(weight / scales[:, None]), -127, 127).to(torch.int8)
+    return quantized, scales
+
+
+def prune_artifact(source, destination, keep_ids, int8_embeddings, model):
+    """Cut the word embedding rows of quantized_model.pt, optionally to row-wise int8
+
+    Without a source artifact, one is created from model with only the word
+    embeddings quantized and everything else in FP16.
+    """
+    if source.exists():
+        checkpoint = torch.load(source, map_location='cpu', weights_only=True)
+        checkpoint['quantized_state_dict'][WORD_EMBEDDINGS] = \
+            checkpoint['quantized_state_dict'][WORD_EMBEDDINGS][keep_ids]
+    elif int8_embeddings:
+        checkpoint = {
+            'quantized_state_dict': {name: tensor.half() if tensor.is_floating_point() else tensor
+                                     for name, tensor in model.state_dict().items()},
+            'quantization_params': {},
+        }
+    else:
+        return None
+    checkpoint['model_config'] = model.config.to_dict()
+
+    if int8_embeddings:
+        # Rebuild from the float rows rather than stacking two quantizations
+        quantized, scales = quantize_rows(model.state_dict()[WORD_EMBEDDINGS])
+        checkpoint['quantized_state_dict'][WORD_EMBEDDINGS] = quantized
+        checkpoint['quantization_params'][WORD_EMBEDDINGS] = {'row_scales': scales, 'dtype': 'int8'}
+
+    torch.save(checkpoint, destination)
+    return destination
+
+
+def directory_mb(path):
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file()) / (1024 * 1024)
+
+
+def prune_vocabulary(model_path, output_path, texts, margin, int8_embeddings):
+    model_dir, output_dir = Path(model_path), Path(output_path)
+    tokenizer = load_tokenizer(model_dir)
+    vocab = read_vocab(model_dir)
+
+    encoded = tokenizer.encode_ids(texts, 512)
+    token_counts = Counter(token_id for ids in encoded for token_id in ids)
+    special_tokens = [token for token in vocab if token in ('[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]')]
+    keep_ids = select_tokens(vocab, token_counts, margin, special_tokens)
+    new_vocab = [vocab[token_id] for token_id in keep_ids]
+    print(f"{len(texts)} texts use {len(token_counts)} of {len(vocab)} tokens; "
+          f"keeping {len(new_vocab)} with the margin")
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir, dtype="auto")
+    model.eval()
+    keep = torch.tensor(keep_ids, dtype=torch.long)
+    old_embeddings = model.get_input_embeddings()
+    new_embeddings = torch.nn.Embedding(len(keep_ids), old_embeddings.embedding_dim,
+                                        padding_idx=new_vocab.index('[PAD]') if '[PAD]' in new_vocab else None,
+                                        dtype=old_embeddings.weight.dtype)
+    with torch.no_grad():
+        new_embeddings.weight.copy_(old_embeddings.weight[keep])
+
+    pruned = copy.deepcopy(model)
+    pruned.set_input_embeddings(new_embeddings)
+    pruned.config.vocab_size = len(new_vocab)
+    if '[PAD]' in new_vocab:
+        pruned.config.pad_token_id = new_vocab.index('[PAD]')
+    pruned.eval()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    pruned.save_pretrained(output_dir)
+    for name in ('tokenizer_config.json', 'special_tokens_map.json'):
+        if (model_dir / name).exists():
+            shutil.copy(model_dir / name, output_dir / name)
+    with open(output_dir / 'vocab.txt', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(new_vocab) + '\n')
+    if (model_dir / 'tokenizer.json').exists():
+        remap_tokenizer_json(model_dir / 'tokenizer.json', output_dir / 'tokenizer.json', new_vocab)
+
+    artifact = prune_artifact(model_dir / 'quantized_model.pt', output_dir / 'quantized_model.pt',
+                              keep, int8_embeddings, pruned)
+    if artifact is not None:
+        print(f"Wrote {artifact}")
+
+    # The pruned tokenizer must give the same tokens, just renumbered
+    new_index = {old_id: new_id for new_id, old_id in enumerate(keep_ids)}
+    new_encoded = load_tokenizer(output_dir).encode_ids(texts, 512)
+    mismatched = sum(new_ids != [new_index[i] for i in ids] for ids, new_ids in zip(encoded, new_encoded))
+    if mismatched:
+        raise RuntimeError(f"{mismatched} texts tokenize differently after pruning")
+
+    sample = [ids[:64] for ids in encoded[:256]]
+    sample_new = [ids[:64] for ids in new_encoded[:256]]
+    width = max(len(ids) for ids in sample)
+
+    def logits(model, rows):
+        input_ids = torch.zeros((len(rows), width), dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+        for row, ids in enumerate(rows):
+            input_ids[row, :len(ids)] = torch.tensor(ids)
+            attention_mask[row, :len(ids)] = 1
+        with torch.no_grad():
+            return model(input_ids=input_ids, attention_mask=attention_mask).logits.float()
+
+    max_diff = (logits(model, sample) - logits(pruned, sample_new)).abs().max().item()
+    print(f"Max logit difference on {len(sample)} texts: {max_diff:.2e}")
+
+    embedding_before = old_embeddings.weight.numel() / 1e6
+    embedding_after = new_embeddings.weight.numel() / 1e6
+    print(f"Word embeddings: {embedding_before:.2f}M -> {embedding_after:.2f}M parameters")
+    print(f"Model directory: {directory_mb(model_dir):.1f} MB -> {directory_mb(output_dir):.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune the vocabulary and embedding matrix to used tokens")
+    parser.add_argument("--model-path", default="../models/distilbert-navigation-quantized",
+                        help="Model directory to prune")
+    parser.add_argument("--output", default=None,
+                        help="Where to write the pruned model (default: <model-path>-pruned)")
+    parser.add_argument("--data", default=DEFAULT_STORE,
+                        help="Training examples whose tokens must be kept (dataset store or JSON)")
+    parser.add_argument("--corpus", nargs="*", default=[],
+                        help="Extra .json or .txt files of commands to measure token usage on")
+    parser.add_argument("--margin", type=int, default=2000,
+                        help="Most common words of the original vocabulary kept beyond those used")
+    parser.add_argument("--int8-embeddings", action="store_true",
+                        help="Store word embeddings row-wise int8 in quantized_model.pt")
+    args = parser.parse_args()
+
+    texts = read_corpus([args.data] + args.corpus)
+    output_path = args.output or args.model_path.rstrip('/') + '-pruned'
+    prune_vocabulary(args.model_path, output_path, texts, args.margin, args.int8_embeddings)
+
+
+if __name__ == "__main__":
+    main()
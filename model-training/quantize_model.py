@@ -8,10 +8,13 @@ Requirements:
     pip install transformers torch
 """
 
+import sys
+import multiprocessing
 import torch
-from transformers import DistilBertTokenizer, DistilBertForSequenceClassification
+from transformers import DistilBertTokenizerFast, DistilBertForSequenceClassification
 from pathlib import Path
 import time
+from verify_compression import verify_artifacts
 
 def quantize_model(model_path, output_path):
     """Apply simple weight quantization to the model"""
@@ -19,7 +22,7 @@ def quantize_model(model_path, output_path):
     print(f"Loading model from {model_path}...")
     
     # Load the fine-tuned model
-    tokenizer = DistilBertTokenizer.from_pretrained(model_path)
+    tokenizer = DistilBertTokenizerFast.from_pretrained(model_path)
     model = DistilBertForSequenceClassification.from_pretrained(model_path)
     model.eval()
     
@@ -34,7 +37,9 @@ def quantize_model(model_path, output_path):
     quantization_params = {}
     
     for name, param in original_state_dict.items():
-        if param.dtype == torch.float32 and 'weight' in name:
+        # Constant tensors (e.g. untouched LayerNorm weights) have no range
+        # to quantize over and would get a zero scale, keep them as they are
+        if param.dtype == torch.float32 and 'weight' in name and param.max() > param.min():
             # Quantize to int8
             min_val = param.min()
             max_val = param.max()
@@ -92,84 +97,92 @@ def quantize_model(model_path, output_path):
     
     print(f"\nQuantized models saved to {output_path}")
     
-    # Test inference speed
-    print("\n--- Testing inference speed ---")
-    test_text = "navigate to google"
-    inputs = tokenizer(test_text, return_tensors="pt", truncation=True, padding=True)
+    compare_int8_serving(output_dir / "quantized_model.pt", model_path)
     
-    # Test original model (fp32)
-    with torch.no_grad():
-        start = time.time()
-        for _ in range(100):
-            _ = model(**inputs)
-        original_time = (time.time() - start) / 100
-    
-    # Test FP16 model
-    inputs_fp16 = {k: v for k, v in inputs.items()}
-    with torch.no_grad():
-        start = time.time()
-        for _ in range(100):
-            _ = model_fp16(**inputs_fp16)
-        fp16_time = (time.time() - start) / 100
-    
-    print(f"Original FP32 model: {original_time*1000:.2f} ms per inference")
-    print(f"FP16 model: {fp16_time*1000:.2f} ms per inference")
-    if fp16_time < original_time:
-        print(f"Speed improvement: {((original_time - fp16_time) / original_time * 100):.1f}%")
-    
-    # Test predictions to verify accuracy is maintained
-    print("\n--- Testing predictions ---")
-    test_examples = [
-        "navigate to google",
-        "search for AI news",
-        "scroll to top",
-        "go back",
-        "reload page"
-    ]
-    
-    INTENTS = {
-        'navigate': 0,
-        'search': 1,
-        'scroll': 2,
-        'go_back': 3,
-        'go_forward': 4,
-        'reload': 5,
-        'click': 6,
-        'type': 7,
-        'close_tab': 8
-    }
-    
-    print("\nFP32 Model:")
-    for text in test_examples:
-        inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
-        with torch.no_grad():
-            outputs = model(**inputs)
-            prediction = torch.argmax(outputs.logits, dim=-1).item()
-            intent = [k for k, v in INTENTS.items() if v == prediction][0]
-            confidence = torch.softmax(outputs.logits, dim=-1)[0][prediction].item()
-            print(f"  '{text}' -> {intent} ({confidence:.2f})")
-    
-    print("\nFP16 Model:")
-    for text in test_examples:
-        inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
-        with torch.no_grad():
-            outputs = model_fp16(**inputs)
-            prediction = torch.argmax(outputs.logits, dim=-1).item()
-            intent = [k for k, v in INTENTS.items() if v == prediction][0]
-            confidence = torch.softmax(outputs.logits, dim=-1)[0][prediction].item()
-            print(f"  '{text}' -> {intent} ({confidence:.2f})")
+    # Every training command through FP32, FP16 and int8, compared top-1
+    print("\n--- Verifying against the FP32 model ---")
+    passed = verify_artifacts(('fp16', 'int8'), reference=model_path, quantized_model=output_path)
     
     print("\n✓ Quantization complete!")
-    print(f"\nTo use the FP16 model (recommended):")
+    print(f"\nTo serve the int8 model (fastest on CPU):")
+    print(f"   python inference_server.py --backend int8 --model-path {output_path}")
+    print(f"\nTo use the FP16 model:")
     print(f"1. Load with: model = DistilBertForSequenceClassification.from_pretrained('{output_path}')")
     print(f"2. The FP16 model is 2x smaller")
     print(f"3. Use it the same way as the original model")
+    print(f"\nTo compare latency and memory of every variant on this machine:")
+    print(f"   python -m benchmarks.run --output bench.json")
+    return passed
+
+def time_inference(model, inputs, iterations=100):
+    """Average seconds per forward pass, after a short warm-up"""
+    with torch.no_grad():
+        for _ in range(10):
+            _ = model(**inputs)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            _ = model(**inputs)
+    return (time.perf_counter() - start) / iterations
+
+def measure_serving(conn, artifact_path, tokenizer_path, int8):
+    """Entry point of a fresh process: load quantized_model.pt as FP32 or int8
+    the way inference_server.py does, then report its memory and latency"""
+    from inference_backends import load_quantized_artifact, resident_memory_mb
+    
+    try:
+        rss_before = resident_memory_mb()
+        model = load_quantized_artifact(artifact_path)
+        if int8:
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        model.eval()
+        rss = resident_memory_mb() - rss_before
+        tokenizer = DistilBertTokenizerFast.from_pretrained(tokenizer_path)
+        inputs = tokenizer("navigate to google", return_tensors="pt", truncation=True, padding=True)
+        conn.send({"rss_mb": rss, "seconds": time_inference(model, inputs)})
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+def compare_int8_serving(artifact_path, tokenizer_path):
+    """Compare memory and latency of the FP32 and int8 serving paths
+    (inference_server.py --backend int8), each in a fresh process so one
+    variant's freed memory does not count towards the other"""
+    print("\n--- Int8 serving path (inference_server.py --backend int8) ---")
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name, int8 in (("FP32", False), ("Int8", True)):
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(target=measure_serving,
+                                  args=(writer, str(artifact_path), tokenizer_path, int8))
+        process.start()
+        writer.close()
+        try:
+            results[name] = reader.recv()
+        except EOFError:
+            results[name] = {"error": f"process exited with code {process.exitcode}"}
+        process.join()
+        if "error" in results[name]:
+            print(f"{name} model could not be measured: {results[name]['error']}")
+            return
+    
+    fp32_time, int8_time = results["FP32"]["seconds"], results["Int8"]["seconds"]
+    print(f"Resident memory: FP32 {results['FP32']['rss_mb']:.1f} MB, "
+          f"int8 {results['Int8']['rss_mb']:.1f} MB (fresh process each)")
+    print(f"FP32 model: {fp32_time*1000:.2f} ms per inference")
+    print(f"Int8 model: {int8_time*1000:.2f} ms per inference")
+    if int8_time < fp32_time:
+        print(f"Speed improvement: {((fp32_time - int8_time) / fp32_time * 100):.1f}%")
 
 def main():
     model_path = './models/distilbert-navigation-finetuned'
     output_path = './models/distilbert-navigation-quantized'
     
-    quantize_model(model_path, output_path)
+    if not quantize_model(model_path, output_path):
+        print("\nA quantized variant disagrees with the FP32 model too often, see above")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,106 @@
+"""
+Request queue for the inference server
+
+Submitted commands wait in arrival order. Speculative as-you-type requests
+(see speculation.py) wait apart from them, at most one per session: a newer
+prefix replaces the one still queued, and the worker only takes speculative
+work when no submitted command is waiting, so typing never delays a real
+request.
+
+The submitted lane can be bounded: put() refuses a request once max_size
+are waiting, so the server can answer "overloaded" straight away instead
+of letting the client time out behind a backlog.
+"""
+
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+
+
+class RequestQueue:
+    """Submitted requests in arrival order, plus the latest speculative request per session"""
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self.condition = threading.Condition()
+        self.requests = deque()
+        self.speculative = OrderedDict()   # session -> queued request
+        self.closed = False
+        self.rejected = 0
+
+    def put(self, item):
+        """Queue a submitted request; returns False when the queue is full"""
+        with self.condition:
+            if self.max_size and len(self.requests) >= self.max_size:
+                self.rejected += 1
+                return False
+            self.requests.append(item)
+            self.condition.notify()
+            return True
+
+    def put_speculative(self, session, item):
+        """Queue item for session and return the request it replaced, if any"""
+        with self.condition:
+            replaced = self.speculative.pop(session, None)
+            self.speculative[session] = item
+            self.condition.notify()
+            return replaced
+
+    def cancel_speculative(self, session, item):
+        """Take item back out of the queue; returns False once the worker has it"""
+        with self.condition:
+            if self.speculative.get(session) is not item:
+                return False
+            del self.speculative[session]
+            return True
+
+    def promote(self, session, item):
+        """Move a still queued speculative request behind the submitted ones"""
+        with self.condition:
+            if self.speculative.get(session) is item:
+                del self.speculative[session]
+                self.requests.append(item)
+                self.condition.notify()
+
+    def close(self):
+        """Let get() return None once the submitted requests are drained"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def depth(self):
+        with self.condition:
+            return len(self.requests)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "depth": len(self.requests),
+                "speculative": len(self.speculative),
+                "max_size": self.max_size,
+                "rejected": self.rejected,
+            }
+
+    def get(self, timeout=None, speculative=True):
+        """Next request, submitted ones first
+
+        Returns None once closed and empty, and raises queue.Empty when
+        timeout seconds pass with nothing to return.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.requests:
+                    return self.requests.popleft()
+                if speculative and self.speculative:
+                    return self.speculative.popitem(last=False)[1]
+                if self.closed:
+                    return None
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise queue.Empty
+                self.condition.wait(remaining)
@@ -0,0 +1,231 @@
+"""
+Latency histograms and counters for the inference server
+
+Every classified batch is timed stage by stage (queue wait, tokenize,
+forward, softmax/top-k, serialize) into fixed-bucket histograms, so
+recording a sample is a bisect and an increment and the percentiles stay
+cheap to compute however long the server runs. {"cmd": "stats"} reports
+p50/p95/p99 per stage; the same numbers can be written as Prometheus text
+to a file or served on a local HTTP port for scraping.
+"""
+
+import os
+import time
+import bisect
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stages in the order a request passes through them
+STAGES = ("queue_wait", "tokenize", "forward", "softmax_topk", "nn_search", "serialize",
+          "end_to_end")
+
+# Upper bounds in seconds, four buckets per doubling from 25us to ~5.5s
+LATENCY_BOUNDS = tuple(25e-6 * 2 ** (i / 4) for i in range(72))
+
+# Batch sizes, one bucket per power of two up to 1024
+BATCH_SIZE_BOUNDS = tuple(2 ** i for i in range(11))
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Counts of samples per bucket plus their running sum"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last bucket holds samples above the largest bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """Estimate the q-th quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.bounds[-1]
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(estimate, self.max)
+            seen += count
+        return self.max
+
+    def summary(self, scale=1.0):
+        mean = self.sum / self.count if self.count else 0.0
+        report = {"count": self.count, "mean": round(mean * scale, 3)}
+        for q in PERCENTILES:
+            report[f"p{round(q * 100)}"] = round(self.percentile(q) * scale, 3)
+        report["max"] = round(self.max * scale, 3)
+        return report
+
+
+class ServerMetrics:
+    """Thread-safe stage histograms and counters shared by the server threads
+
+    Other components register a callable under sources to have their own
+    numbers (cache, workers) included in report(), and a callable returning
+    a number under gauges for values that go up and down (queue depth).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {stage: Histogram(LATENCY_BOUNDS) for stage in STAGES}
+        self.batch_sizes = Histogram(BATCH_SIZE_BOUNDS)
+        self.counters = {"requests": 0, "errors": 0, "batches": 0}
+        self.sources = {}
+        self.gauges = {}
+        self.started = time.monotonic()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.stages[stage].observe(seconds)
+
+    def observe_stages(self, stage_times):
+        """Record several stages at once, e.g. the times from classify_batch"""
+        with self.lock:
+            for stage, seconds in stage_times.items():
+                self.stages[stage].observe(seconds)
+
+    def observe_batch(self, size):
+        with self.lock:
+            self.batch_sizes.observe(size)
+            self.counters["batches"] += 1
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self):
+        """Percentiles in milliseconds, counters and the registered sources"""
+        with self.lock:
+            report = {
+                "uptime_seconds": round(time.monotonic() - self.started, 1),
+                "counters": dict(self.counters),
+                "latency_ms": {stage: histogram.summary(scale=1000.0)
+                               for stage, histogram in self.stages.items()},
+                "batch_size": self.batch_sizes.summary(),
+            }
+        report["gauges"] = {name: gauge() for name, gauge in self.gauges.items()}
+        for name, source in self.sources.items():
+            report[name] = source()
+        return report
+
+    def prometheus_text(self, prefix="intent_server"):
+        """Prometheus text exposition of the histograms, counters and gauges"""
+        lines = []
+        gauges = {name: gauge() for name, gauge in self.gauges.items()}
+
+        def label_set(*labels):
+            labels = ",".join(label for label in labels if label)
+            return f"{{{labels}}}" if labels else ""
+
+        def histogram_lines(name, histogram, label=""):
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                le = f'le="{bound:.6g}"'
+                lines.append(f'{name}_bucket{label_set(label, le)} {cumulative}')
+            inf = 'le="+Inf"'
+            lines.append(f'{name}_bucket{label_set(label, inf)} {histogram.count}')
+            lines.append(f'{name}_sum{label_set(label)} {histogram.sum:.9g}')
+            lines.append(f'{name}_count{label_set(label)} {histogram.count}')
+
+        with self.lock:
+            name = f"{prefix}_stage_seconds"
+            lines.append(f"# HELP {name} Time spent per request or batch in each server stage")
+            lines.append(f"# TYPE {name} histogram")
+            for stage, histogram in self.stages.items():
+                histogram_lines(name, histogram, f'stage="{stage}"')
+
+            name = f"{prefix}_batch_size"
+            lines.append(f"# HELP {name} Requests classified per forward batch")
+            lines.append(f"# TYPE {name} histogram")
+            histogram_lines(name, self.batch_sizes)
+
+            for counter, value in sorted(self.counters.items()):
+                name = f"{prefix}_{counter}_total"
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {value}")
+
+        for gauge, value in sorted(gauges.items()):
+            name = f"{prefix}_{gauge}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Publish ServerMetrics as Prometheus text
+
+    With path set the text is rewritten atomically every interval seconds
+    (for a node_exporter textfile collector or a sidecar); with port set it
+    is served at http://127.0.0.1:<port>/metrics.
+    """
+
+    def __init__(self, metrics, path=None, port=None, interval=10.0):
+        self.metrics = metrics
+        self.path = Path(path) if path else None
+        self.port = port
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.server = None
+
+    def start(self):
+        if self.path is not None:
+            threading.Thread(target=self._write_loop, daemon=True).start()
+        if self.port:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.rstrip('/') not in ('', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = metrics.prometheus_text().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    # stdout carries the protocol, keep it clean
+                    pass
+
+            self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(self.metrics.prometheus_text())
+        os.replace(tmp_path, self.path)
+
+    def _write_loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+        if self.path is not None:
+            try:
+                self.write()
+            except OSError:
+                pass
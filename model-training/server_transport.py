@@ -0,0 +1,309 @@
+"""
+Client connections for the inference server
+
+A channel is one client stream: the server reads requests from it and
+writes replies back to it. The stdio channel serves the process that
+spawned the server; the Unix socket listener turns every accepted
+connection into its own channel, so many clients can share one loaded
+model.
+
+Channels start with one JSON object per line. A client can send
+{"cmd": "hello", "framing": "binary"}; the JSON acknowledgement is the last
+line, and from then on both directions use length-prefixed frames: a
+big-endian uint32 payload length, then a payload whose first byte is its
+type.
+
+    client -> server
+        CLASSIFY_FRAME  uint32 id, UTF-8 text
+        JSON_FRAME      any JSON request (commands, non-integer ids)
+    server -> client
+        PREDICTION_FRAME  uint32 id, uint8 flags (1 = cached), uint8 k,
+                          k x uint16 intent index, k x float32 score
+        JSON_FRAME        any other reply (errors, stats, status)
+
+Intent indices refer to the "intents" list of the loading and ready messages,
+both sent before the first prediction frame.
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import stat
+import socket
+import threading
+from prediction_cache import prediction_results
+
+FRAME_HEADER = struct.Struct('>I')
+REQUEST_HEADER = struct.Struct('>BI')
+PREDICTION_HEADER = struct.Struct('>BIBB')
+
+CLASSIFY_FRAME = 1
+JSON_FRAME = 2
+PREDICTION_FRAME = 3
+
+# Far above any command, guards against reading garbage as a length
+MAX_FRAME_BYTES = 1 << 20
+
+
+class Channel:
+    """Requests in and replies out over a pair of binary streams"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # Replies come from the reader and worker threads, keep writes whole
+        self.lock = threading.Lock()
+        self.closed = False
+        self.binary = False
+
+    def _write(self, data):
+        """Write bytes, assumes self.lock is held"""
+        if self.closed:
+            return
+        try:
+            self.writer.write(data)
+            self.writer.flush()
+        except (OSError, ValueError):
+            self.closed = True
+
+    def _encode_json(self, message):
+        payload = json.dumps(message).encode('utf-8')
+        if self.binary:
+            return FRAME_HEADER.pack(len(payload) + 1) + bytes([JSON_FRAME]) + payload
+        return payload + b"\n"
+
+    def send(self, message):
+        """Write one message, dropping it if the client has gone away"""
+        with self.lock:
+            self._write(self._encode_json(message))
+
+    def reply(self, request_id, message):
+        """Send a reply tagged with the id of the request it answers"""
+        if request_id is not None:
+            message["id"] = request_id
+        self.send(message)
+
+    def send_prediction(self, request_id, prediction, cached=False):
+        """Reply with a Prediction, packed when the channel is binary"""
+        if self.binary and isinstance(request_id, int) and 0 <= request_id < 2 ** 32:
+            k = len(prediction.indices)
+            payload = (PREDICTION_HEADER.pack(PREDICTION_FRAME, request_id, int(cached), k)
+                       + struct.pack(f'>{k}H{k}f', *prediction.indices, *prediction.scores))
+            with self.lock:
+                self._write(FRAME_HEADER.pack(len(payload)) + payload)
+            return
+
+        message = {"status": "success", "results": prediction_results(prediction)}
+        if cached:
+            message["cached"] = True
+        self.reply(request_id, message)
+
+    def switch_to_binary(self, request_id, message):
+        """Acknowledge the hello as a JSON line, then frame everything after it"""
+        if request_id is not None:
+            message["id"] = request_id
+        with self.lock:
+            self._write(self._encode_json(message))
+            self.binary = True
+
+    def _read_frame(self):
+        header = self.reader.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return None
+        (length,) = FRAME_HEADER.unpack(header)
+        if not 0 < length <= MAX_FRAME_BYTES:
+            raise ValueError(f"Bad frame length {length}")
+        payload = self.reader.read(length)
+        if len(payload) < length:
+            return None
+        return payload
+
+    def _decode_frame(self, payload):
+        if payload[0] == CLASSIFY_FRAME:
+            _, request_id = REQUEST_HEADER.unpack_from(payload)
+            return {"id": request_id, "text": payload[REQUEST_HEADER.size:].decode('utf-8')}
+        if payload[0] == JSON_FRAME:
+            return json.loads(payload[1:].decode('utf-8'))
+        raise ValueError(f"Unknown frame type {payload[0]}")
+
+    def messages(self):
+        """Yield each request as a dict until the client closes its side"""
+        while True:
+            if self.binary:
+                try:
+                    payload = self._read_frame()
+                except ValueError as e:
+                    # The stream is out of sync, nothing after this can be trusted
+                    self.send({"status": "error", "message": str(e)})
+                    return
+                if payload is None:
+                    return
+                try:
+                    yield self._decode_frame(payload)
+                except (ValueError, struct.error) as e:
+                    self.send({"status": "error", "message": f"Invalid request: {e}"})
+                continue
+
+            line = self.reader.readline()
+            if not line:
+                return
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                self.send({"status": "error", "message": f"Invalid request: {e}"})
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+
+class StdioChannel(Channel):
+    """The parent process talking over stdin/stdout"""
+
+    def __init__(self):
+        super().__init__(sys.stdin.buffer, sys.stdout.buffer)
+
+
+class SocketChannel(Channel):
+    """One accepted Unix socket connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        super().__init__(connection.makefile('rb'), connection.makefile('wb'))
+
+    def close(self):
+        super().close()
+        for stream in (self.reader, self.writer):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        try:
+            self.connection.close()
+        except OSError:
+            pass
+
+
+class UnixSocketListener:
+    """Accept clients on a Unix domain socket and serve each on its own thread
+
+    serve_client(channel) is called once per connection and should return
+    when the client is done. With idle_timeout set, wait_until_idle()
+    returns once no client has been connected for that many seconds.
+    """
+
+    def __init__(self, path, serve_client, idle_timeout=0):
+        self.path = path
+        self.serve_client = serve_client
+        self.idle_timeout = idle_timeout
+        self.clients = set()
+        self.clients_lock = threading.Lock()
+        self.last_activity = time.monotonic()
+        self.stopped = threading.Event()
+        self.sock = None
+
+    def start(self):
+        # The socket belongs in a directory only this user can enter
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._remove_stale_socket()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the user running the browser may connect
+        old_umask = os.umask(0o177)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self.sock.listen()
+        self.sock.settimeout(1.0)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _remove_stale_socket(self):
+        try:
+            info = os.lstat(self.path)
+        except FileNotFoundError:
+            return
+        # Never reuse or remove a path another user or program put there
+        if info.st_uid != os.getuid():
+            raise RuntimeError(f"{self.path} belongs to another user")
+        if not stat.S_ISSOCK(info.st_mode):
+            raise RuntimeError(f"{self.path} exists and is not a socket")
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            # Left behind by a daemon that did not shut down cleanly
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                raise RuntimeError(f"Cannot remove stale socket {self.path}: {e}") from e
+        else:
+            raise RuntimeError(f"Another inference daemon is already listening on {self.path}")
+        finally:
+            probe.close()
+
+    def _accept_loop(self):
+        while not self.stopped.is_set():
+            try:
+                connection, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            connection.settimeout(None)
+            channel = SocketChannel(connection)
+            with self.clients_lock:
+                self.clients.add(channel)
+            threading.Thread(target=self._serve, args=(channel,), daemon=True).start()
+
+    def _serve(self, channel):
+        try:
+            self.serve_client(channel)
+        except OSError:
+            pass
+        finally:
+            channel.close()
+            with self.clients_lock:
+                self.clients.discard(channel)
+                self.last_activity = time.monotonic()
+
+    def broadcast(self, message):
+        with self.clients_lock:
+            clients = list(self.clients)
+        for channel in clients:
+            channel.send(dict(message))
+
+    def client_count(self):
+        with self.clients_lock:
+            return len(self.clients)
+
+    def wait_until_idle(self):
+        """Block until the idle timeout passes with no client connected"""
+        while not self.stopped.wait(1.0):
+            if not self.idle_timeout:
+                continue
+            with self.clients_lock:
+                idle_for = time.monotonic() - self.last_activity
+                if not self.clients and idle_for >= self.idle_timeout:
+                    return
+
+    def close(self):
+        self.stopped.set()
+        if self.sock is not None:
+            self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        with self.clients_lock:
+            clients = list(self.clients)
+        for channel in clients:
+            channel.close()
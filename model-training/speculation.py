@@ -0,0 +1,142 @@
+"""
+Speculative as-you-type classification for the inference server
+
+While the user types, the client sends each prefix as
+{"type": "partial", "session": "...", "text": "..."}. Only the newest prefix
+of a session matters: it replaces the one still queued, and a prefix that
+was already being classified when a newer one arrived is answered with
+{"status": "cancelled"}. The result for the newest prefix stays in the
+session's slot. When the command is submitted with the same session and its
+text matches the slot, the reply is immediate; when it matches the prefix
+still being classified, the submission joins it instead of running again.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class SessionSlot:
+    """The prefix being classified for one session and the last finished one"""
+
+    __slots__ = ('pending', 'key', 'prediction')
+
+    def __init__(self):
+        self.pending = None      # queued or running speculative request
+        self.key = None
+        self.prediction = None
+
+
+class SpeculativeSessions:
+    """Thread-safe session slots, least recently used dropped beyond max_sessions"""
+
+    def __init__(self, max_sessions=256):
+        self.max_sessions = max_sessions
+        self.slots = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.partials = 0
+        self.superseded = 0
+        self.hits = 0
+        self.joined = 0
+        self.misses = 0
+
+    def _slot(self, session):
+        """The session's slot, created on first use, assumes self.lock is held"""
+        slot = self.slots.get(session)
+        if slot is None:
+            slot = self.slots[session] = SessionSlot()
+            while len(self.slots) > self.max_sessions:
+                self.slots.popitem(last=False)
+        self.slots.move_to_end(session)
+        return slot
+
+    def begin(self, session, item):
+        """Make item the session's newest prefix and return the one it supersedes"""
+        with self.lock:
+            self.partials += 1
+            slot = self._slot(session)
+            stale, slot.pending = slot.pending, item
+            if stale is not None:
+                self.superseded += 1
+            return stale
+
+    def settle(self, session, key, prediction):
+        """Record a prefix answered without the model and return the one it supersedes"""
+        with self.lock:
+            self.partials += 1
+            slot = self._slot(session)
+            stale, slot.pending = slot.pending, None
+            if stale is not None:
+                self.superseded += 1
+            slot.key, slot.prediction = key, prediction
+            return stale
+
+    def claim(self, session, key, waiter):
+        """Match a submitted command against the session's speculation
+
+        Returns ("hit", prediction, stale) when the last finished prefix is
+        the same text, ("joined", item, None) when the running prefix is
+        and waiter was added to it, or ("miss", None, stale) otherwise.
+        stale is speculative work the submission made useless.
+        """
+        with self.lock:
+            slot = self.slots.get(session)
+            if slot is None:
+                self.misses += 1
+                return "miss", None, None
+            pending = slot.pending
+            if pending is not None and pending.key == key:
+                pending.waiters.append(waiter)
+                self.joined += 1
+                return "joined", pending, None
+
+            slot.pending = None
+            if pending is not None:
+                self.superseded += 1
+            if slot.key == key and slot.prediction is not None:
+                self.hits += 1
+                return "hit", slot.prediction, pending
+            self.misses += 1
+            return "miss", None, pending
+
+    def finish(self, item, prediction=None):
+        """Close a classified prefix
+
+        Returns whether it is still the session's newest prefix and the
+        submitted commands that joined it. A failed prefix (prediction None)
+        clears the slot.
+        """
+        with self.lock:
+            waiters = list(item.waiters)
+            # Nothing can join once the slot no longer points at item
+            item.waiters.clear()
+            slot = self.slots.get(item.session)
+            current = slot is not None and slot.pending is item
+            if current:
+                slot.pending = None
+                slot.key = item.key if prediction is not None else None
+                slot.prediction = prediction
+            return current, waiters
+
+    def abandon(self, item):
+        """Drop a prefix nobody submitted yet; returns False when a command joined it"""
+        with self.lock:
+            if item.waiters:
+                return False
+            slot = self.slots.get(item.session)
+            if slot is not None and slot.pending is item:
+                slot.pending = None
+            return True
+
+    def stats(self):
+        with self.lock:
+            submitted = self.hits + self.joined + self.misses
+            return {
+                "sessions": len(self.slots),
+                "partials": self.partials,
+                "superseded": self.superseded,
+                "hits": self.hits,
+                "joined": self.joined,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.joined) / submitted if submitted else 0.0,
+            }
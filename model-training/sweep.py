@@ -0,0 +1,322 @@
+"""
+Hyperparameter sweep for the navigation intent classifier
+
+Runs trials of train_navigation_model.py's fine-tune over a grid of
+learning rates, batch sizes, warmup steps, weight decays and epoch counts,
+or a seeded random sample of that grid, in parallel CPU worker processes.
+Each worker is limited to --threads-per-worker torch threads so the
+workers do not oversubscribe the cores. The commands are tokenized once
+into the shared token cache (token_cache.py) before the workers start, and
+every worker memory-maps the same files.
+
+Trials stop on their own via EarlyStoppingCallback, and are pruned when
+their validation F1 after an epoch is below the median of the trials that
+already reached that epoch (after --prune-after epochs). Every finished
+trial reports its best F1, training wall time and the single-command CPU
+latency of its model:
+
+    python sweep.py --workers 4 --learning-rates 2e-5,5e-5,1e-4 --batch-sizes 8,16
+    python sweep.py --search random --trials 12 --output sweep_results.json
+
+Latency is measured inside the worker with its thread count while other
+trials are still running, so use it to rank trials rather than as an
+absolute figure; benchmarks/run.py measures a kept model in isolation.
+
+Requirements:
+    pip install transformers datasets torch sklearn
+"""
+
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+BASE_MODEL = "distilbert-base-uncased"
+
+# Validation F1 of every trial per epoch, shared by the workers
+_scores = _lock = None
+
+
+def parse_list(cast):
+    def parse(value):
+        values = [cast(item) for item in value.split(',') if item.strip()]
+        if not values:
+            raise argparse.ArgumentTypeError("expected a comma separated list")
+        return values
+    return parse
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def build_trials(args):
+    """Hyperparameters of every trial, in the order they are submitted"""
+    grid = [
+        {"learning_rate": lr, "batch_size": batch_size, "warmup_steps": warmup,
+         "weight_decay": decay, "epochs": epochs}
+        for lr, batch_size, warmup, decay, epochs in itertools.product(
+            args.learning_rates, args.batch_sizes, args.warmup_steps,
+            args.weight_decays, args.epochs
+        )
+    ]
+    if args.search == "random" and args.trials < len(grid):
+        grid = random.Random(args.seed).sample(grid, args.trials)
+    return grid
+
+
+def init_worker(threads, scores, lock):
+    """Bound torch's thread pools before anything else in the worker imports torch"""
+    global _scores, _lock
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    _scores, _lock = scores, lock
+
+
+def run_trial(trial_id, params, settings):
+    """Entry point of a worker: fine-tune with params and report how it went"""
+    import numpy as np
+    import train_navigation_model as training
+    from transformers import (
+        DataCollatorWithPadding,
+        DistilBertForSequenceClassification,
+        DistilBertTokenizerFast,
+        EarlyStoppingCallback,
+        Trainer,
+        TrainerCallback,
+        TrainingArguments,
+    )
+
+    class PruningCallback(TrainerCallback):
+        """Stops a trial whose F1 trails the median of other trials at the same epoch"""
+
+        def __init__(self):
+            self.pruned_at = None
+            self.epochs = set()
+
+        def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+            epoch = round(state.epoch)
+            # The evaluation after training repeats the last epoch
+            if epoch in self.epochs:
+                return
+            self.epochs.add(epoch)
+            f1 = metrics["eval_f1"]
+            with _lock:
+                others = list(_scores.get(epoch, []))
+                _scores[epoch] = others + [f1]
+            if (epoch >= settings["prune_after"] and len(others) >= settings["prune_min_trials"]
+                    and f1 < float(np.median(others))):
+                self.pruned_at = epoch
+                control.should_training_stop = True
+
+    output_dir = os.path.join(settings["output_dir"], f"trial-{trial_id:03d}")
+    tokenizer = DistilBertTokenizerFast.from_pretrained(settings["base_model"])
+    model = DistilBertForSequenceClassification.from_pretrained(
+        settings["base_model"],
+        num_labels=len(training.INTENTS),
+        id2label={v: k for k, v in training.INTENTS.items()},
+        label2id=training.INTENTS,
+    )
+    # The parent already filled the token cache, so this only memory-maps it
+    train_dataset, val_dataset = training.prepare_dataset(training.training_data, tokenizer,
+                                                          cache_dir=settings["token_cache_dir"])
+
+    pruning = PruningCallback()
+    trainer = Trainer(
+        model=model,
+        args=TrainingArguments(
+            output_dir=output_dir,
+            num_train_epochs=params["epochs"],
+            per_device_train_batch_size=params["batch_size"],
+            per_device_eval_batch_size=params["batch_size"],
+            learning_rate=params["learning_rate"],
+            warmup_steps=params["warmup_steps"],
+            weight_decay=params["weight_decay"],
+            eval_strategy="epoch",
+            save_strategy="epoch",
+            save_total_limit=1,
+            load_best_model_at_end=True,
+            metric_for_best_model="f1",
+            greater_is_better=True,
+            group_by_length=True,
+            seed=settings["seed"],
+            use_cpu=True,
+            report_to=[],
+            disable_tqdm=True,
+            logging_strategy="no",
+        ),
+        train_dataset=train_dataset,
+        eval_dataset=val_dataset,
+        compute_metrics=training.compute_metrics,
+        data_collator=DataCollatorWithPadding(tokenizer),
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=settings["patience"]), pruning],
+    )
+
+    start = time.perf_counter()
+    trainer.train()
+    wall_seconds = time.perf_counter() - start
+    metrics = trainer.evaluate()
+    latency = training.cpu_latency_ms(trainer.model.cpu(), tokenizer)
+
+    model_path = None
+    if settings["keep_models"]:
+        model_path = os.path.join(output_dir, "model")
+        trainer.save_model(model_path)
+        tokenizer.save_pretrained(model_path)
+    for entry in os.listdir(output_dir):
+        if entry.startswith("checkpoint-"):
+            shutil.rmtree(os.path.join(output_dir, entry), ignore_errors=True)
+
+    return {
+        "trial": trial_id,
+        "params": params,
+        "f1": round(metrics["eval_f1"], 5),
+        "accuracy": round(metrics["eval_accuracy"], 5),
+        "epochs_run": round(trainer.state.epoch, 2),
+        "pruned_at_epoch": pruning.pruned_at,
+        "wall_seconds": round(wall_seconds, 1),
+        "latency_ms": round(latency, 3),
+        "model_path": model_path,
+    }
+
+
+def pareto_front(results):
+    """Trials no other trial beats on F1, wall time and latency at once"""
+    def scores(result):
+        return (result["f1"], -result["wall_seconds"], -result["latency_ms"])
+
+    front = set()
+    for result in results:
+        dominated = any(
+            scores(other) != scores(result)
+            and all(theirs >= ours for theirs, ours in zip(scores(other), scores(result)))
+            for other in results
+        )
+        if not dominated:
+            front.add(result["trial"])
+    return front
+
+
+def print_leaderboard(results, failures):
+    front = pareto_front(results)
+    print(f"\n{'trial':>6}{'f1':>8}{'acc':>8}{'wall s':>9}{'ms/cmd':>8}{'epochs':>8}"
+          f"  {'lr':<9}{'batch':>6}{'warmup':>7}{'decay':>7}  status")
+    for result in results:
+        params = result["params"]
+        status = f"pruned at epoch {result['pruned_at_epoch']}" if result["pruned_at_epoch"] else ""
+        marker = "*" if result["trial"] in front else " "
+        print(f"{marker}{result['trial']:>5}{result['f1']:>8.4f}{result['accuracy']:>8.4f}"
+              f"{result['wall_seconds']:>9.1f}{result['latency_ms']:>8.2f}{result['epochs_run']:>8.1f}"
+              f"  {params['learning_rate']:<9.1e}{params['batch_size']:>6}{params['warmup_steps']:>7}"
+              f"{params['weight_decay']:>7}  {status}")
+    for failure in failures:
+        print(f"{failure['trial']:>6}  failed: {failure['error']}")
+    print("\n* no other trial is at least as good on F1, wall time and latency at once")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep on the CPU")
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument("--trials", type=int, default=8,
+                        help="Trials sampled from the grid with --search random")
+    parser.add_argument("--learning-rates", type=parse_list(float), default=[2e-5, 5e-5, 1e-4])
+    parser.add_argument("--batch-sizes", type=parse_list(int), default=[8, 16, 32])
+    parser.add_argument("--warmup-steps", type=parse_list(int), default=[0, 50])
+    parser.add_argument("--weight-decays", type=parse_list(float), default=[0.01])
+    parser.add_argument("--epochs", type=parse_list(int), default=[10])
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Concurrent trials (default: cores / 4)")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Torch threads per trial (default: cores / workers)")
+    parser.add_argument("--patience", type=int, default=3,
+                        help="EarlyStoppingCallback patience in epochs")
+    parser.add_argument("--prune-after", type=int, default=2,
+                        help="First epoch at which a trial can be pruned")
+    parser.add_argument("--prune-min-trials", type=int, default=2,
+                        help="Trials that must have reached an epoch before pruning on it")
+    parser.add_argument("--base-model", default=BASE_MODEL)
+    parser.add_argument("--token-cache-dir", default='./cache/tokenized')
+    parser.add_argument("--output-dir", default='./models/sweep',
+                        help="Trial checkpoints, removed after each trial")
+    parser.add_argument("--keep-models", action="store_true",
+                        help="Save every trial's best model under its trial directory")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="sweep_results.json",
+                        help="Where to write the leaderboard as JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    trials = build_trials(args)
+    cores = available_cores()
+    workers = min(args.workers or max(1, cores // 4), len(trials))
+    threads = args.threads_per_worker or max(1, cores // workers)
+    print(f"{len(trials)} trials ({args.search}), {workers} workers x {threads} threads "
+          f"on {cores} cores")
+
+    # Tokenize once here so the workers only memory-map the cache
+    import train_navigation_model as training
+    from transformers import DistilBertTokenizerFast
+
+    training.prepare_dataset(training.training_data,
+                             DistilBertTokenizerFast.from_pretrained(args.base_model),
+                             cache_dir=args.token_cache_dir)
+
+    settings = {
+        "base_model": args.base_model,
+        "token_cache_dir": args.token_cache_dir,
+        "output_dir": args.output_dir,
+        "keep_models": args.keep_models,
+        "patience": args.patience,
+        "prune_after": args.prune_after,
+        "prune_min_trials": args.prune_min_trials,
+        "seed": args.seed,
+    }
+    context = multiprocessing.get_context('spawn')
+    manager = context.Manager()
+    scores, lock = manager.dict(), manager.Lock()
+
+    results, failures = [], []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                             initargs=(threads, scores, lock)) as executor:
+        futures = {executor.submit(run_trial, trial_id, params, settings): (trial_id, params)
+                   for trial_id, params in enumerate(trials)}
+        for future in as_completed(futures):
+            trial_id, params = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures.append({"trial": trial_id, "params": params,
+                                 "error": f"{type(e).__name__}: {e}"})
+                print(f"Trial {trial_id} failed: {type(e).__name__}: {e}", flush=True)
+                continue
+            results.append(result)
+            print(f"Trial {trial_id} done: f1 {result['f1']:.4f} in {result['wall_seconds']:.0f} s",
+                  flush=True)
+    manager.shutdown()
+
+    results.sort(key=lambda result: (-result["f1"], result["wall_seconds"]))
+    with open(args.output, 'w') as f:
+        json.dump({"settings": {**settings, "search": args.search, "workers": workers,
+                                "threads_per_worker": threads},
+                   "sweep_seconds": round(time.perf_counter() - start, 1),
+                   "results": results, "failures": failures}, f, indent=2)
+
+    print_leaderboard(results, failures)
+    print(f"\nLeaderboard written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
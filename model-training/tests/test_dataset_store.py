@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from dataset_store import DatasetStore, load_examples
+
+
+def example(text, intent="scroll_down"):
+    return {"text": text, "intent": intent}
+
+
+def test_add_skips_duplicates_after_normalization(tmp_path):
+    store = DatasetStore(tmp_path / "store")
+    added = store.add([example("Scroll down"), example("scroll   DOWN!"), example("go back", "back")])
+    assert added == 2
+    assert store.add([example("scroll down."), example("Go back?", "back")]) == 0
+    assert store.add([example("scroll down a bit")]) == 1
+    assert [row["text"] for row in store] == ["Scroll down", "go back", "scroll down a bit"]
+
+
+def test_rows_roll_over_into_new_shards(tmp_path):
+    store = DatasetStore(tmp_path / "store", shard_rows=2)
+    store.add([example(f"command {i}") for i in range(5)])
+    assert len(store) == 5
+    assert [shard["rows"] for shard in store.manifest["shards"]] == [2, 2, 1]
+    assert [row["text"] for row in DatasetStore(tmp_path / "store")] == [f"command {i}" for i in range(5)]
+
+
+def test_lookups_survive_index_merges(tmp_path):
+    store = DatasetStore(tmp_path / "store")
+    for i in range(20):
+        store.add([example(f"command {i}")])
+    # Merging keeps the number of index files logarithmic in the rows
+    assert len(store.manifest["index"]) <= 5
+    assert sum(entry["rows"] for entry in store.manifest["index"]) == 20
+    assert store.add([example(f"command {i}") for i in range(25)]) == 5
+    assert sorted(path.name for path in store.dir.glob("index-*.bin")) == \
+        sorted(entry["name"] for entry in store.manifest["index"])
+
+
+def test_interrupted_append_is_ignored_and_truncated(tmp_path):
+    store = DatasetStore(tmp_path / "store")
+    store.add([example("scroll down"), example("go back", "back")])
+    committed = (store.dir / "shard-00000.jsonl").stat().st_size
+
+    # A writer that died after writing data but before committing the manifest
+    with open(store.dir / "shard-00000.jsonl", "ab") as f:
+        f.write(b'{"text": "half a ro')
+    (store.dir / f"index-{store.manifest['next_index']:05d}.bin").write_bytes(b"\0" * 7)
+    (store.dir / "manifest.json.tmp").write_text("{")
+
+    reopened = DatasetStore(tmp_path / "store")
+    assert [row["text"] for row in reopened] == ["scroll down", "go back"]
+
+    assert reopened.add([example("reload the page", "reload")]) == 1
+    shard = (store.dir / "shard-00000.jsonl").read_bytes()
+    assert len(shard) > committed
+    assert b"half a ro" not in shard
+    assert [row["text"] for row in DatasetStore(tmp_path / "store")] == \
+        ["scroll down", "go back", "reload the page"]
+    assert len(list(store.dir.glob("index-*.bin"))) == len(reopened.manifest["index"])
+
+
+def test_writers_see_each_others_commits(tmp_path):
+    first = DatasetStore(tmp_path / "store")
+    second = DatasetStore(tmp_path / "store")
+    assert first.add([example("scroll down")]) == 1
+    assert second.add([example("Scroll down"), example("go back", "back")]) == 1
+    assert len(second) == 2
+
+
+def test_other_store_formats_are_refused(tmp_path):
+    store = DatasetStore(tmp_path / "store")
+    store.add([example("scroll down")])
+    manifest = json.loads((store.dir / "manifest.json").read_text())
+    manifest["format"] = store.FORMAT + 1
+    (store.dir / "manifest.json").write_text(json.dumps(manifest))
+    with pytest.raises(ValueError):
+        DatasetStore(tmp_path / "store")
+
+
+def test_load_examples_reads_stores_and_json_lists(tmp_path):
+    store = DatasetStore(tmp_path / "store")
+    store.add([example("scroll down"), example("go back", "back")])
+    store.export_json(tmp_path / "examples.json")
+    assert load_examples(tmp_path / "store") == load_examples(tmp_path / "examples.json")
@@ -0,0 +1,90 @@
+import io
+import json
+import struct
+
+from prediction_cache import Prediction
+from server_transport import CLASSIFY_FRAME, JSON_FRAME, PREDICTION_FRAME, Channel
+
+
+def binary_channel(incoming=b""):
+    channel = Channel(io.BytesIO(incoming), io.BytesIO())
+    channel.binary = True
+    return channel
+
+
+def split_frames(data):
+    frames = []
+    while data:
+        (length,) = struct.unpack_from(">I", data)
+        frames.append(data[4:4 + length])
+        data = data[4 + length:]
+    return frames
+
+
+def decode_prediction(payload, intents):
+    """Reads a prediction frame at the offsets src/main.js uses"""
+    request_id = struct.unpack_from(">I", payload, 1)[0]
+    k = payload[6]
+    return request_id, [
+        (intents[struct.unpack_from(">H", payload, 7 + 2 * i)[0]],
+         struct.unpack_from(">f", payload, 7 + 2 * k + 4 * i)[0])
+        for i in range(k)
+    ]
+
+
+def test_prediction_frame_layout():
+    intents = ["navigate", "scroll_down", "go_back"]
+    channel = binary_channel()
+    prediction = Prediction(indices=[2, 0], scores=[0.75, 0.125], intents=["go_back", "navigate"])
+    channel.send_prediction(70000, prediction, cached=True)
+
+    (payload,) = split_frames(channel.writer.getvalue())
+    assert payload[0] == PREDICTION_FRAME
+    assert payload[5] == 1  # cached flag
+    assert len(payload) == 7 + 2 * 2 + 4 * 2
+    assert decode_prediction(payload, intents) == (70000, [("go_back", 0.75), ("navigate", 0.125)])
+
+
+def test_non_integer_ids_fall_back_to_json_frames():
+    channel = binary_channel()
+    prediction = Prediction(indices=[1], scores=[0.5], intents=["scroll_down"])
+    channel.send_prediction("abc", prediction)
+
+    (payload,) = split_frames(channel.writer.getvalue())
+    assert payload[0] == JSON_FRAME
+    assert json.loads(payload[1:]) == {
+        "status": "success", "id": "abc",
+        "results": [{"intent": "scroll_down", "confidence": 0.5}],
+    }
+
+
+def test_requests_encoded_like_main_js_are_decoded():
+    text = "scroll down ünicode".encode("utf-8")
+    classify = struct.pack(">IBI", 5 + len(text), CLASSIFY_FRAME, 12) + text
+    request = json.dumps({"id": 13, "text": "go", "type": "partial", "session": "w1"}).encode("utf-8")
+    partial = struct.pack(">IB", 1 + len(request), JSON_FRAME) + request
+
+    channel = binary_channel(classify + partial)
+    assert list(channel.messages()) == [
+        {"id": 12, "text": "scroll down ünicode"},
+        {"id": 13, "text": "go", "type": "partial", "session": "w1"},
+    ]
+
+
+def test_hello_acknowledgement_is_the_last_json_line():
+    channel = Channel(io.BytesIO(), io.BytesIO())
+    channel.switch_to_binary(1, {"status": "ok", "framing": "binary"})
+    channel.send({"status": "ready"})
+
+    data = channel.writer.getvalue()
+    line, rest = data.split(b"\n", 1)
+    assert json.loads(line) == {"status": "ok", "framing": "binary", "id": 1}
+    (payload,) = split_frames(rest)
+    assert payload[0] == JSON_FRAME and json.loads(payload[1:]) == {"status": "ready"}
+
+
+def test_bad_frame_length_stops_the_stream():
+    channel = binary_channel(struct.pack(">I", 0) + b"junk")
+    assert list(channel.messages()) == []
+    (payload,) = split_frames(channel.writer.getvalue())
+    assert json.loads(payload[1:])["status"] == "error"
@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+
+from token_cache import TokenCache, tokenizer_fingerprint
+
+
+class FakeBackend:
+    def __init__(self):
+        self.truncation = None
+
+    def to_str(self):
+        return json.dumps({"truncation": self.truncation, "padding": None,
+                           "model": {"vocab": {"[PAD]": 0, "a": 1}}})
+
+
+class FakeTokenizer:
+    """Encodes a text as its length, like a tokenizer that mutates its truncation state"""
+
+    def __init__(self):
+        self.backend_tokenizer = FakeBackend()
+        self.calls = 0
+
+    def __call__(self, texts, truncation, padding, max_length):
+        self.calls += 1
+        self.backend_tokenizer.truncation = {"max_length": max_length}
+        lengths = [min(len(text), max_length) for text in texts]
+        return {
+            "input_ids": [[len(text)] + [0] * (max_length - 1) for text in texts],
+            "attention_mask": [[1] * length + [0] * (max_length - length) for length in lengths],
+        }
+
+
+def test_fingerprint_ignores_truncation_state():
+    tokenizer = FakeTokenizer()
+    before = tokenizer_fingerprint(tokenizer)
+    tokenizer(["a"], truncation=True, padding="max_length", max_length=8)
+    assert tokenizer_fingerprint(tokenizer) == before
+
+
+def test_rows_are_reused_across_runs(tmp_path):
+    tokenizer = FakeTokenizer()
+    cache = TokenCache(tmp_path, tokenizer, max_length=8)
+    rows = cache.lookup(["go back", "scroll", "go back"])
+    assert rows.tolist() == [0, 1, 0]
+    assert cache.tokenized == 2
+    assert cache.lengths(rows).tolist() == [7, 6, 7]
+
+    reopened = TokenCache(tmp_path, tokenizer, max_length=8)
+    assert reopened.lookup(["scroll", "reload"]).tolist() == [1, 2]
+    assert reopened.tokenized == 1
+    assert reopened.input_ids[2, 0] == len("reload")
+
+
+def test_interrupted_append_is_cut_off(tmp_path):
+    cache = TokenCache(tmp_path, FakeTokenizer(), max_length=4)
+    cache.lookup(["go back"])
+    with open(cache.dir / "input_ids.bin", "ab") as f:
+        f.write(b"\xff" * 5)
+
+    reopened = TokenCache(tmp_path, FakeTokenizer(), max_length=4)
+    assert reopened.rows == 1
+    assert reopened.lookup(["scroll"]).tolist() == [1]
+    assert (cache.dir / "input_ids.bin").stat().st_size == 2 * 4 * reopened.input_ids.itemsize
+    assert reopened.input_ids[1, 0] == len("scroll")
+
+
+def test_unused_views_are_pruned_when_the_cache_grows(tmp_path):
+    cache = TokenCache(tmp_path, FakeTokenizer(), max_length=4)
+    cache.lookup(["a"])
+    cache.lookup(["b"])
+    # The view of ["a"] has not been used since the cache grew for ["b"]
+    grown = (cache.dir / "manifest.json").stat().st_mtime
+    stale = cache.dir / "views" / f"{hashlib.sha256(b'a').hexdigest()}.npy"
+    os.utime(stale, (grown - 100, grown - 100))
+
+    cache.lookup(["c"])
+    remaining = list((cache.dir / "views").glob("*.npy"))
+    assert len(remaining) == 2 and stale not in remaining
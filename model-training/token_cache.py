@@ -0,0 +1,98 @@
+"""
+On-disk cache of tokenized training commands
+
+Every training run used to tokenize the whole dataset again. TokenCache
+keeps input_ids and attention_mask, padded to max_length, in flat binary
+files next to a 16-byte hash of each command's text, in a directory named
+after the tokenizer and max_length. Later runs memory-map the files, look
+commands up by hash and only tokenize the ones the cache has not seen, so
+a growing dataset costs only its new rows. The row list for an exact set
+of commands is saved too, so rerunning on an unchanged dataset skips even
+the hashing; row lists nobody used since the cache last grew are removed
+when it grows again.
+
+The files are append-only and committed by a manifest (append_only.py),
+so parallel training jobs can share one cache.
+"""
+
+import os
+import json
+import hashlib
+import contextlib
+from pathlib import Path
+import numpy as np
+from append_only import RowCache
+
+ID_DTYPE = np.int32
+MASK_DTYPE = np.int8
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Hash of the serialized fast tokenizer: vocabulary, normalizer and special tokens
+
+    Truncation and padding are left out: calling the tokenizer changes them,
+    but not the ids it produces for a given max_length.
+    """
+    config = json.loads(tokenizer.backend_tokenizer.to_str())
+    config.pop('truncation', None)
+    config.pop('padding', None)
+    serialized = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:16]
+
+
+class TokenCache(RowCache):
+    """Append-only, memory-mapped token ids for one tokenizer and max_length"""
+
+    FORMAT = 2
+
+    def __init__(self, cache_dir, tokenizer, max_length=64):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.tokenized = 0
+        path = Path(cache_dir) / f"{tokenizer_fingerprint(tokenizer)}-len{max_length}"
+        (path / 'views').mkdir(parents=True, exist_ok=True)
+        super().__init__(path, {'input_ids': (ID_DTYPE, (max_length,)),
+                                'attention_mask': (MASK_DTYPE, (max_length,))})
+
+    def _tokenize(self, texts):
+        encodings = self.tokenizer(texts, truncation=True, padding='max_length',
+                                   max_length=self.max_length)
+        self.tokenized += len(texts)
+        return {'input_ids': encodings['input_ids'], 'attention_mask': encodings['attention_mask']}
+
+    def _append(self, arrays, keys):
+        self._prune_views()
+        super()._append(arrays, keys)
+
+    def _prune_views(self):
+        """Drop the row lists nobody has looked up since the cache last grew"""
+        try:
+            last_change = self._path('manifest.json').stat().st_mtime
+        except FileNotFoundError:
+            return
+        for view_path in self._path('views').glob('*.npy'):
+            with contextlib.suppress(FileNotFoundError):
+                if view_path.stat().st_mtime < last_change:
+                    view_path.unlink()
+
+    def lookup(self, texts):
+        """Row of every text, tokenizing and appending the ones not cached yet"""
+        digest = hashlib.sha256('\n'.join(texts).encode('utf-8')).hexdigest()
+        view_path = self._path('views') / f'{digest}.npy'
+        if view_path.exists():
+            rows = np.load(view_path, mmap_mode='r')
+            if len(rows) == len(texts) and (not len(rows) or rows.max() < self.rows):
+                # Views in use survive the next pruning
+                with contextlib.suppress(OSError):
+                    os.utime(view_path)
+                return np.asarray(rows)
+
+        rows = self._lookup(texts, self._tokenize)
+        tmp_path = view_path.with_name(f'{digest}.{os.getpid()}.tmp.npy')
+        np.save(tmp_path, rows)
+        os.replace(tmp_path, view_path)
+        return rows
+
+    def lengths(self, rows):
+        """Unpadded token count of each row"""
+        return self.attention_mask[rows].sum(axis=1, dtype=np.int64)
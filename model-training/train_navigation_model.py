@@ -4,28 +4,82 @@ Fine-tune DistilBERT for Browser Navigation Intent Classification
 This script fine-tunes DistilBERT to better recognize navigation intents
 in natural language commands for the AI browser.
 
+With --distill it instead trains a much smaller student (2 layers and a
+narrower hidden size by default) to match the fine-tuned model's softened
+predictions on the training commands plus noisy variants of them. The
+student is saved in the same format, so inference_server.py and the ONNX
+exporters can load it like the full model.
+
+Tokenized commands are kept in an on-disk cache (token_cache.py,
+--token-cache-dir), so reruns memory-map them and only commands added since
+the last run are tokenized.
+
+Batches are padded only to their own longest command (a padding collator),
+and the training batches are drawn from groups of similar length, shuffled
+with --seed, so little compute goes to pad tokens. --padding longest
+restores padding every command to the longest of its split, to compare the
+examples/second reported at the end of training.
+
+With --head-only the encoder of an already fine-tuned model stays frozen.
+Its features for every command are cached on disk (feature_cache.py,
+--feature-cache-dir), so later runs only encode commands added since, and
+just the classification head, or with --train-last-layer the head and the
+last transformer layer, is retrained from the cache in seconds. The result
+is saved to its own directory (--head-output) in the same format as a full
+fine-tune; the source model is left untouched as the reference.
+
+--cpu trains on the CPU even when an accelerator is present, with explicit
+intra-op and inter-op thread counts (--threads, --inter-op-threads) and
+bf16 autocast when the CPU has native bf16 instructions (--bf16 auto),
+falling back to fp32 otherwise. --batch-size, --gradient-accumulation-steps
+and --dataloader-workers apply to any device. Samples/second and wall-clock
+time are printed for every epoch.
+
+Training commands are streamed from the append-only dataset store
+(dataset_store.py, ./training_data) when it has any, otherwise from
+training_data_expanded.json.
+
 Requirements:
     pip install transformers datasets torch sklearn
 """
 
 import torch
+import torch.nn.functional as F
 from transformers import (
-    DistilBertTokenizer,
+    DataCollatorWithPadding,
+    DistilBertConfig,
+    DistilBertTokenizerFast,
     DistilBertForSequenceClassification,
     Trainer,
     TrainingArguments,
-    EarlyStoppingCallback
+    EarlyStoppingCallback,
+    TrainerCallback
 )
+from transformers.trainer_pt_utils import LengthGroupedSampler
 from datasets import Dataset
 from sklearn.model_selection import train_test_split
 import numpy as np
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 import json
 import os
+import time
+import hashlib
+import random
+import argparse
+from token_cache import TokenCache
+from feature_cache import FeatureCache
+from dataset_store import DEFAULT_STORE, DatasetStore
+
+MAX_LENGTH = 64
 
-# Check if expanded data exists
+# Prefer the dataset store, then the expanded JSON, then the built-in examples
+store = DatasetStore(DEFAULT_STORE)
 expanded_data_path = './training_data_expanded.json'
-if os.path.exists(expanded_data_path):
+if len(store):
+    print(f"Streaming training data from {store.dir}...")
+    training_data = [(item['text'], item['intent']) for item in store]
+    print(f"Loaded {len(training_data)} examples from the dataset store")
+elif os.path.exists(expanded_data_path):
     print(f"Loading expanded training data from {expanded_data_path}...")
     with open(expanded_data_path, 'r') as f:
         data_loaded = json.load(f)
@@ -140,34 +194,134 @@ for text, intent in training_data:
 
 print(f"Detected {len(INTENTS)} intents: {list(INTENTS.keys())}")
 
-def prepare_dataset(data, tokenizer, test_size=0.2):
-    """Prepare training and validation datasets"""
+class CachedTokenDataset(torch.utils.data.Dataset):
+    """Rows of a TokenCache with their labels
+
+    Each row is cut to its own length for a padding collator, or with
+    pad_to_longest padded to the longest row of the split.
+    """
+
+    def __init__(self, cache, rows, labels, pad_to_longest=False):
+        self.input_ids = cache.input_ids
+        self.attention_mask = cache.attention_mask
+        self.rows = np.asarray(rows)
+        self.labels = list(labels)
+        self.lengths = cache.lengths(self.rows)
+        self.longest = int(self.lengths.max()) if len(self.rows) else 1
+        self.pad_to_longest = pad_to_longest
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        # Copies one row out of the memory map; the cache itself stays on disk
+        row = self.rows[i]
+        length = self.longest if self.pad_to_longest else int(self.lengths[i])
+        return {
+            'input_ids': torch.tensor(self.input_ids[row, :length], dtype=torch.long),
+            'attention_mask': torch.tensor(self.attention_mask[row, :length], dtype=torch.long),
+            'labels': torch.tensor(self.labels[i], dtype=torch.long),
+        }
+
+
+def padding_share(lengths, batches, padded_length=None):
+    """Share of the tokens in batches that are padding
+
+    Batches are padded to their own longest row unless padded_length is given.
+    """
+    real = padded = 0
+    for batch in batches:
+        batch_lengths = lengths[batch]
+        real += int(batch_lengths.sum())
+        padded += (padded_length or int(batch_lengths.max())) * len(batch)
+    return 1 - real / padded if padded else 0.0
+
+
+def report_padding(dataset, batch_size, seed):
+    """Print how much of an epoch is pad tokens with and without length grouping"""
+    lengths = dataset.lengths
+    order = np.random.default_rng(seed).permutation(len(lengths))
+    random_batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    grouped = list(LengthGroupedSampler(batch_size, lengths=lengths.tolist(),
+                                        generator=torch.Generator().manual_seed(seed)))
+    grouped_batches = [grouped[i:i + batch_size] for i in range(0, len(grouped), batch_size)]
+    print(f"Pad tokens per epoch: {padding_share(lengths, random_batches, dataset.longest):.0%} "
+          f"padded to the longest command, {padding_share(lengths, random_batches):.0%} "
+          f"padded per random batch, {padding_share(lengths, grouped_batches):.0%} "
+          f"padded per length-grouped batch")
+
+
+def cpu_supports_bf16():
+    """True when the CPU has native bf16 instructions (AVX512-BF16 or AMX)"""
+    for probe in ('_is_avx512_bf16_supported', '_is_amx_tile_supported'):
+        check = getattr(torch.cpu, probe, None)
+        if check is not None and check():
+            return True
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read().split()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def configure_cpu_threads(threads, inter_op_threads):
+    """Set torch's thread pools, before any parallel work has started"""
+    if threads:
+        torch.set_num_threads(threads)
+    if inter_op_threads:
+        torch.set_num_interop_threads(inter_op_threads)
+    print(f"CPU threads: {torch.get_num_threads()} intra-op, "
+          f"{torch.get_num_interop_threads()} inter-op")
+
+
+def use_bf16(mode, cpu):
+    """Whether to train under bf16 autocast for --bf16 auto/on/off"""
+    if mode == 'off' or not cpu:
+        return False
+    if cpu_supports_bf16():
+        return True
+    if mode == 'on':
+        print("Warning: this CPU has no native bf16 instructions, training in fp32")
+    return False
+
+
+class EpochThroughputCallback(TrainerCallback):
+    """Prints samples/second and wall-clock time of every training epoch"""
+
+    def __init__(self, samples_per_epoch):
+        self.samples_per_epoch = samples_per_epoch
+        self.epoch_start = None
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        # Evaluation runs after this, so the time is training alone
+        seconds = time.perf_counter() - self.epoch_start
+        print(f"Epoch {state.epoch:.0f}: {self.samples_per_epoch} samples in {seconds:.1f} s "
+              f"({self.samples_per_epoch / seconds:.1f} samples/s)")
+
+
+def prepare_dataset(data, tokenizer, test_size=0.2, cache_dir='./cache/tokenized',
+                    pad_to_longest=False):
+    """Prepare training and validation datasets from the token cache"""
     texts = [item[0] for item in data]
     labels = [INTENTS[item[1]] for item in data]
     
+    # Tokenize what the cache has not seen yet
+    cache = TokenCache(cache_dir, tokenizer, max_length=MAX_LENGTH)
+    rows = cache.lookup(texts)
+    print(f"Token cache {cache.dir}: {len(texts) - cache.tokenized} commands reused, "
+          f"{cache.tokenized} tokenized")
+    
     # Split data
-    train_texts, val_texts, train_labels, val_labels = train_test_split(
-        texts, labels, test_size=test_size, random_state=42, stratify=labels
+    train_rows, val_rows, train_labels, val_labels = train_test_split(
+        rows, labels, test_size=test_size, random_state=42, stratify=labels
     )
     
-    # Tokenize
-    train_encodings = tokenizer(train_texts, truncation=True, padding=True, max_length=64)
-    val_encodings = tokenizer(val_texts, truncation=True, padding=True, max_length=64)
-    
-    # Create datasets
-    train_dataset = Dataset.from_dict({
-        'input_ids': train_encodings['input_ids'],
-        'attention_mask': train_encodings['attention_mask'],
-        'labels': train_labels
-    })
-    
-    val_dataset = Dataset.from_dict({
-        'input_ids': val_encodings['input_ids'],
-        'attention_mask': val_encodings['attention_mask'],
-        'labels': val_labels
-    })
-    
-    return train_dataset, val_dataset
+    return (CachedTokenDataset(cache, train_rows, train_labels, pad_to_longest),
+            CachedTokenDataset(cache, val_rows, val_labels, pad_to_longest))
 
 def compute_metrics(eval_pred):
     """Compute accuracy and F1 score"""
@@ -186,12 +340,511 @@ def compute_metrics(eval_pred):
         'recall': recall
     }
 
+# Filler words people put around browser commands
+AUGMENT_PREFIXES = ["please", "can you", "could you", "hey", "now", "quickly", "i want to"]
+AUGMENT_SUFFIXES = ["please", "now", "for me", "thanks", "right now"]
+
+
+def augment_text(text, rng):
+    """A noisy variant of a command: filler words, a dropped or swapped word, a typo"""
+    words = text.split()
+    choice = rng.random()
+    if choice < 0.25:
+        words = rng.choice(AUGMENT_PREFIXES).split() + words
+    elif choice < 0.45:
+        words = words + rng.choice(AUGMENT_SUFFIXES).split()
+    elif choice < 0.6 and len(words) > 2:
+        del words[rng.randrange(len(words))]
+    elif choice < 0.75 and len(words) > 1:
+        i = rng.randrange(len(words) - 1)
+        words[i], words[i + 1] = words[i + 1], words[i]
+    else:
+        # Drop or double one character of a longer word
+        candidates = [i for i, word in enumerate(words) if len(word) > 3]
+        if candidates:
+            i = rng.choice(candidates)
+            j = rng.randrange(1, len(words[i]) - 1)
+            word = words[i]
+            words[i] = word[:j] + word[j + 1:] if rng.random() < 0.5 else word[:j] + word[j] + word[j:]
+    if rng.random() < 0.2:
+        words = [word.upper() if rng.random() < 0.5 else word.capitalize() for word in words]
+    return " ".join(words)
+
+
+def teacher_logits(teacher, tokenizer, texts, batch_size=64):
+    """Logits of the fine-tuned teacher for every text"""
+    teacher.eval()
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, len(texts), batch_size):
+            inputs = tokenizer(texts[start:start + batch_size], truncation=True,
+                               padding=True, max_length=64, return_tensors="pt")
+            outputs.append(teacher(**inputs).logits.float())
+    return torch.cat(outputs)
+
+
+def build_student(teacher, layers, dim, hidden_dim=None, heads=None):
+    """Small DistilBERT with the teacher's vocabulary and labels
+
+    Word and position embeddings start as the teacher's projected onto
+    their top principal directions, or as the teacher's own at its width.
+    Evenly spaced teacher layers are copied only when the width, feed-forward
+    size and head count all match; at the teacher's width hidden_dim and
+    heads default to the teacher's, elsewhere to 1024 and 4.
+    """
+    teacher_config = teacher.config
+    same_width = dim == teacher_config.dim
+    if hidden_dim is None:
+        hidden_dim = teacher_config.hidden_dim if same_width else 1024
+    if heads is None:
+        heads = teacher_config.n_heads if same_width else 4
+    copy_layers = same_width and (hidden_dim, heads) == (teacher_config.hidden_dim,
+                                                         teacher_config.n_heads)
+    config = DistilBertConfig(
+        vocab_size=teacher_config.vocab_size,
+        max_position_embeddings=teacher_config.max_position_embeddings,
+        n_layers=layers, dim=dim, hidden_dim=hidden_dim, n_heads=heads,
+        num_labels=teacher_config.num_labels,
+        id2label=teacher_config.id2label, label2id=teacher_config.label2id,
+        pad_token_id=teacher_config.pad_token_id,
+    )
+    student = DistilBertForSequenceClassification(config)
+
+    teacher_embeddings = teacher.distilbert.embeddings
+    student_embeddings = student.distilbert.embeddings
+    with torch.no_grad():
+        if same_width:
+            student_embeddings.load_state_dict(teacher_embeddings.state_dict())
+            if copy_layers:
+                chosen = np.linspace(0, teacher_config.n_layers - 1, layers).round().astype(int)
+                for student_layer, teacher_index in zip(student.distilbert.transformer.layer, chosen):
+                    student_layer.load_state_dict(teacher.distilbert.transformer.layer[teacher_index].state_dict())
+        else:
+            words = teacher_embeddings.word_embeddings.weight
+            mean = words.mean(dim=0, keepdim=True)
+            _, _, components = torch.linalg.svd(words - mean, full_matrices=False)
+            projection = components[:dim].T
+            student_embeddings.word_embeddings.weight.copy_((words - mean) @ projection)
+            student_embeddings.position_embeddings.weight.copy_(
+                teacher_embeddings.position_embeddings.weight @ projection
+            )
+    return student
+
+
+class DistillationTrainer(Trainer):
+    """Trainer whose loss mixes the hard labels with the teacher's softened logits"""
+
+    def __init__(self, *args, temperature=2.0, alpha=0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        soft_targets = inputs.pop("teacher_logits", None)
+        outputs = model(**inputs)
+        loss = outputs.loss
+        if soft_targets is not None:
+            t = self.temperature
+            distill_loss = F.kl_div(
+                F.log_softmax(outputs.logits / t, dim=-1),
+                F.softmax(soft_targets / t, dim=-1),
+                reduction="batchmean",
+            ) * t * t
+            loss = self.alpha * loss + (1 - self.alpha) * distill_loss
+        return (loss, outputs) if return_outputs else loss
+
+
+def cpu_latency_ms(model, tokenizer, text="scroll down a bit", iterations=200):
+    """Median single-command forward latency on CPU"""
+    model.eval()
+    inputs = tokenizer(text, return_tensors="pt")
+    timings = []
+    with torch.no_grad():
+        for i in range(iterations + 20):
+            start = time.perf_counter()
+            model(**inputs)
+            if i >= 20:
+                timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+
+def distill(args):
+    print(f"Distilling {args.teacher_path} into a {args.student_layers}-layer student...")
+    rng = random.Random(args.seed)
+    torch.manual_seed(args.seed)
+
+    tokenizer = DistilBertTokenizerFast.from_pretrained(args.teacher_path)
+    teacher = DistilBertForSequenceClassification.from_pretrained(args.teacher_path)
+    teacher.eval()
+    # Hard labels must index the same logits as the teacher's soft targets
+    teacher_labels = teacher.config.label2id
+    unknown = sorted(set(INTENTS) - set(teacher_labels))
+    if unknown:
+        raise ValueError(f"The teacher was not trained on intents {unknown}; fine-tune it on "
+                         f"the current data (or retrain its head with --head-only) first")
+
+    texts = [item[0] for item in training_data]
+    labels = [teacher_labels[item[1]] for item in training_data]
+    train_texts, val_texts, train_labels, val_labels = train_test_split(
+        texts, labels, test_size=0.2, random_state=42, stratify=labels
+    )
+
+    # Noisy copies only widen the training side; validation stays real commands
+    augmented_texts, augmented_labels = list(train_texts), list(train_labels)
+    for text, label in zip(train_texts, train_labels):
+        for _ in range(args.augment_copies):
+            augmented_texts.append(augment_text(text, rng))
+            augmented_labels.append(label)
+    print(f"Training on {len(augmented_texts)} commands ({len(train_texts)} original)")
+
+    soft_labels = teacher_logits(teacher, tokenizer, augmented_texts)
+    train_encodings = tokenizer(augmented_texts, truncation=True, padding=True, max_length=64)
+    val_encodings = tokenizer(val_texts, truncation=True, padding=True, max_length=64)
+    train_dataset = Dataset.from_dict({
+        'input_ids': train_encodings['input_ids'],
+        'attention_mask': train_encodings['attention_mask'],
+        'labels': augmented_labels,
+        'teacher_logits': soft_labels.tolist(),
+    })
+    val_dataset = Dataset.from_dict({
+        'input_ids': val_encodings['input_ids'],
+        'attention_mask': val_encodings['attention_mask'],
+        'labels': val_labels
+    })
+
+    student = build_student(teacher, args.student_layers, args.student_dim,
+                            args.student_hidden_dim, args.student_heads)
+    teacher_params = sum(p.numel() for p in teacher.parameters())
+    student_params = sum(p.numel() for p in student.parameters())
+    print(f"Teacher: {teacher_params / 1e6:.1f}M parameters, student: {student_params / 1e6:.1f}M")
+    bf16 = use_bf16(args.bf16, args.cpu)
+    if args.cpu:
+        print(f"Training on the CPU in {'bf16 autocast' if bf16 else 'fp32'}")
+
+    training_args = TrainingArguments(
+        output_dir='./models/distilbert-navigation-student-checkpoints',
+        num_train_epochs=args.epochs,
+        per_device_train_batch_size=args.batch_size,
+        per_device_eval_batch_size=args.batch_size,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        dataloader_num_workers=args.dataloader_workers,
+        dataloader_persistent_workers=args.dataloader_workers > 0,
+        use_cpu=args.cpu,
+        bf16=bf16,
+        learning_rate=args.learning_rate,
+        warmup_steps=50,
+        weight_decay=0.01,
+        logging_steps=10,
+        eval_strategy="epoch",
+        save_strategy="epoch",
+        load_best_model_at_end=True,
+        metric_for_best_model="f1",
+        greater_is_better=True,
+        # teacher_logits is not a model input, keep it for compute_loss
+        remove_unused_columns=False,
+    )
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=train_dataset,
+        eval_dataset=val_dataset,
+        compute_metrics=compute_metrics,
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=5)],
+        temperature=args.temperature,
+        alpha=args.alpha,
+    )
+    trainer.train()
+
+    print("\nEvaluating student...")
+    eval_results = trainer.evaluate()
+    print(f"Evaluation results: {eval_results}")
+
+    student = trainer.model.cpu()
+    student_logits = teacher_logits(student, tokenizer, val_texts)
+    agreement = (student_logits.argmax(-1) == teacher_logits(teacher, tokenizer, val_texts).argmax(-1))
+    print(f"Agreement with the teacher on validation: {agreement.float().mean().item():.1%}")
+    print(f"CPU latency per command: teacher {cpu_latency_ms(teacher, tokenizer):.2f} ms, "
+          f"student {cpu_latency_ms(student, tokenizer):.2f} ms")
+
+    trainer.save_model(args.output)
+    tokenizer.save_pretrained(args.output)
+    print(f"\nStudent saved to {args.output}")
+    print(f"Serve it with: python inference_server.py --model-path {args.output}")
+
+
+def encoder_fingerprint(model, trained_layers):
+    """Hash of the encoder weights that stay frozen when the last trained_layers are retrained"""
+    frozen_layers = len(model.distilbert.transformer.layer) - trained_layers
+    digest = hashlib.sha256()
+    for name, tensor in model.distilbert.state_dict().items():
+        parts = name.split('.')
+        if parts[:2] == ['transformer', 'layer'] and int(parts[2]) >= frozen_layers:
+            continue
+        digest.update(name.encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def encoder_features(model, token_cache, rows, trained_layers, batch_size=64):
+    """What the trained part of the model sees for each token cache row
+
+    The [CLS] vector after the last layer, or with trained_layers=1 the
+    hidden states entering the last layer, padded to the cache's max_length.
+    """
+    features = []
+    with torch.no_grad():
+        for start in range(0, len(rows), batch_size):
+            batch = np.asarray(rows[start:start + batch_size])
+            length = int(token_cache.lengths(batch).max())
+            hidden_states = model.distilbert(
+                input_ids=torch.tensor(token_cache.input_ids[batch, :length], dtype=torch.long),
+                attention_mask=torch.tensor(token_cache.attention_mask[batch, :length], dtype=torch.long),
+                output_hidden_states=True,
+            ).hidden_states
+            if trained_layers:
+                padded = np.zeros((len(batch), token_cache.max_length, hidden_states[-2].shape[-1]),
+                                  dtype=np.float32)
+                padded[:, :length] = hidden_states[-2].numpy()
+                features.append(padded)
+            else:
+                features.append(hidden_states[-1][:, 0].numpy())
+    return np.concatenate(features)
+
+
+def top_logits(model, features, attention_mask=None):
+    """Logits from cached features through the retrained part of the model
+
+    Mirrors DistilBertForSequenceClassification.forward after the encoder;
+    with attention_mask the features are hidden states for the last layer.
+    """
+    if attention_mask is not None:
+        output = model.distilbert.transformer.layer[-1](features, attention_mask)
+        features = (output[0] if isinstance(output, tuple) else output)[:, 0]
+    pooled = torch.relu(model.pre_classifier(features))
+    return model.classifier(model.dropout(pooled))
+
+
+def match_labels(model, intents):
+    """Point the classifier at intents, keeping the trained rows of known labels"""
+    if model.config.label2id == intents:
+        return
+    old_classifier = model.classifier
+    old_labels = model.config.label2id
+    classifier = torch.nn.Linear(old_classifier.in_features, len(intents))
+    with torch.no_grad():
+        for label, index in intents.items():
+            if label in old_labels:
+                classifier.weight[index] = old_classifier.weight[old_labels[label]]
+                classifier.bias[index] = old_classifier.bias[old_labels[label]]
+    added = [label for label in intents if label not in old_labels]
+    if added:
+        print(f"New intents with an untrained classifier row: {', '.join(added)}")
+    model.classifier = classifier
+    model.num_labels = len(intents)
+    model.config.num_labels = len(intents)
+    model.config.id2label = {index: label for label, index in intents.items()}
+    model.config.label2id = dict(intents)
+
+
+def retrain_head(args):
+    trained_layers = 1 if args.train_last_layer else 0
+    part = "head and last layer" if trained_layers else "head"
+    print(f"Retraining the {part} of {args.head_from} on cached encoder features...")
+    torch.manual_seed(args.seed)
+
+    tokenizer = DistilBertTokenizerFast.from_pretrained(args.head_from)
+    # Eager attention takes the 2D padding mask when the last layer runs on its own
+    model = DistilBertForSequenceClassification.from_pretrained(args.head_from,
+                                                                attn_implementation="eager")
+    model.eval()
+
+    texts = [item[0] for item in training_data]
+    labels = [INTENTS[item[1]] for item in training_data]
+    token_cache = TokenCache(args.token_cache_dir, tokenizer, MAX_LENGTH)
+    token_rows = token_cache.lookup(texts)
+    row_of_text = dict(zip(texts, token_rows))
+
+    dim = model.config.dim
+    row_shape = (MAX_LENGTH, dim) if trained_layers else (dim,)
+    kind = f"layer{len(model.distilbert.transformer.layer) - 1}-len{MAX_LENGTH}" if trained_layers else "pooled"
+    feature_cache = FeatureCache(args.feature_cache_dir,
+                                 f"{encoder_fingerprint(model, trained_layers)}-{kind}", row_shape)
+    start = time.perf_counter()
+    feature_rows = feature_cache.lookup(texts, lambda missing: encoder_features(
+        model, token_cache, [row_of_text[text] for text in missing], trained_layers
+    ))
+    print(f"Encoder features: {feature_cache.computed} computed, "
+          f"{len(set(texts)) - feature_cache.computed} from {feature_cache.dir} "
+          f"({time.perf_counter() - start:.1f} s)")
+
+    # Same split as the full fine-tune, so validation scores are comparable
+    train_index, val_index = train_test_split(
+        np.arange(len(texts)), test_size=0.2, random_state=42, stratify=labels
+    )
+    features = np.asarray(feature_cache.features[feature_rows], dtype=np.float32)
+    masks = None
+    if trained_layers:
+        longest = int(token_cache.lengths(token_rows).max())
+        features = features[:, :longest]
+        masks = torch.tensor(token_cache.attention_mask[token_rows, :longest], dtype=torch.long)
+    features = torch.from_numpy(features)
+    labels = torch.tensor(labels, dtype=torch.long)
+
+    match_labels(model, INTENTS)
+    for parameter in model.parameters():
+        parameter.requires_grad = False
+    groups = [{'params': [*model.pre_classifier.parameters(), *model.classifier.parameters()],
+               'lr': args.head_learning_rate}]
+    if trained_layers:
+        groups.append({'params': list(model.distilbert.transformer.layer[-1].parameters()),
+                       'lr': args.layer_learning_rate})
+    for group in groups:
+        for parameter in group['params']:
+            parameter.requires_grad = True
+    # Only these change, so they are all a best epoch needs to remember
+    trainable = {name: parameter for name, parameter in model.named_parameters()
+                 if parameter.requires_grad}
+    optimizer = torch.optim.AdamW(groups, weight_decay=0.01)
+
+    def batch_masks(index):
+        return masks[index] if masks is not None else None
+
+    def evaluate():
+        model.eval()
+        with torch.no_grad():
+            logits = top_logits(model, features[val_index], batch_masks(val_index))
+        return compute_metrics((logits.numpy(), labels[val_index].numpy()))
+
+    best = {'f1': -1.0}
+    best_state = None
+    stale_epochs = 0
+    start = time.perf_counter()
+    generator = torch.Generator().manual_seed(args.seed)
+    for epoch in range(args.head_epochs):
+        model.train()
+        order = torch.from_numpy(train_index)[torch.randperm(len(train_index), generator=generator)]
+        for batch_start in range(0, len(order), args.head_batch_size):
+            index = order[batch_start:batch_start + args.head_batch_size]
+            loss = F.cross_entropy(top_logits(model, features[index], batch_masks(index)), labels[index])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+        metrics = evaluate()
+        if metrics['f1'] > best['f1']:
+            best = {**metrics, 'epoch': epoch + 1}
+            best_state = {name: parameter.detach().clone() for name, parameter in trainable.items()}
+            stale_epochs = 0
+        else:
+            stale_epochs += 1
+            if stale_epochs >= args.head_patience:
+                break
+    with torch.no_grad():
+        for name, value in best_state.items():
+            trainable[name].copy_(value)
+    print(f"Trained {epoch + 1} epochs in {time.perf_counter() - start:.1f} s, best at epoch "
+          f"{best['epoch']}: accuracy {best['accuracy']:.4f}, f1 {best['f1']:.4f}")
+
+    model.save_pretrained(args.head_output)
+    tokenizer.save_pretrained(args.head_output)
+    print(f"\nModel saved to {args.head_output}")
+    print(f"Serve it with: python inference_server.py --model-path {args.head_output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the navigation intent classifier")
+    parser.add_argument("--distill", action="store_true",
+                        help="Train a small student from the fine-tuned model instead")
+    parser.add_argument("--head-only", action="store_true",
+                        help="Retrain only the classification head on cached encoder features")
+    parser.add_argument("--token-cache-dir", default='./cache/tokenized',
+                        help="Where tokenized commands are kept between runs")
+    parser.add_argument("--padding", choices=["dynamic", "longest"], default="dynamic",
+                        help="Pad each batch to its longest command and group training batches "
+                             "by length, or pad every command to the longest of its split")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seed for shuffling, length grouping and augmentation")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Per-device batch size (default: 8, or 32 with --distill)")
+    parser.add_argument("--gradient-accumulation-steps", type=int, default=1,
+                        help="Batches per optimizer step; the effective batch size is "
+                             "batch size x accumulation steps")
+    parser.add_argument("--dataloader-workers", type=int, default=0,
+                        help="Worker processes preparing batches (0 = in the training process)")
+    cpu_group = parser.add_argument_group("CPU training")
+    cpu_group.add_argument("--cpu", action="store_true",
+                           help="Train on the CPU even when an accelerator is available")
+    cpu_group.add_argument("--threads", type=int, default=0,
+                           help="Intra-op threads (0 = torch default, one per core)")
+    cpu_group.add_argument("--inter-op-threads", type=int, default=0,
+                           help="Inter-op threads (0 = torch default)")
+    cpu_group.add_argument("--bf16", choices=["auto", "on", "off"], default="auto",
+                           help="bf16 autocast on the CPU; auto uses it only when the CPU "
+                                "has native bf16 instructions")
+    distill_group = parser.add_argument_group("distillation")
+    distill_group.add_argument("--teacher-path", default='./models/distilbert-navigation-finetuned',
+                               help="Fine-tuned model used as the teacher")
+    distill_group.add_argument("--output", default='./models/distilbert-navigation-student',
+                               help="Where to save the student model")
+    distill_group.add_argument("--student-layers", type=int, default=2)
+    distill_group.add_argument("--student-dim", type=int, default=256,
+                               help="Hidden size of the student; the teacher's (768) copies "
+                                    "teacher layers unless the feed-forward size or heads differ")
+    distill_group.add_argument("--student-hidden-dim", type=int, default=None,
+                               help="Feed-forward size of the student "
+                                    "(default: the teacher's at its width, else 1024)")
+    distill_group.add_argument("--student-heads", type=int, default=None,
+                               help="Attention heads of the student "
+                                    "(default: the teacher's at its width, else 4)")
+    distill_group.add_argument("--temperature", type=float, default=2.0,
+                               help="Softmax temperature applied to teacher and student logits")
+    distill_group.add_argument("--alpha", type=float, default=0.5,
+                               help="Weight of the hard-label loss; the rest goes to the teacher")
+    distill_group.add_argument("--augment-copies", type=int, default=4,
+                               help="Noisy variants generated per training command")
+    distill_group.add_argument("--epochs", type=int, default=30)
+    distill_group.add_argument("--learning-rate", type=float, default=1e-4)
+    head_group = parser.add_argument_group("head retraining")
+    head_group.add_argument("--head-from", default='./models/distilbert-navigation-finetuned',
+                            help="Model whose encoder is kept frozen")
+    head_group.add_argument("--head-output", default='./models/distilbert-navigation-head',
+                            help="Where to save the retrained model; --head-from is left as it is")
+    head_group.add_argument("--train-last-layer", action="store_true",
+                            help="Also retrain the last transformer layer")
+    head_group.add_argument("--feature-cache-dir", default='./cache/features',
+                            help="Where encoder features are kept between runs")
+    head_group.add_argument("--head-epochs", type=int, default=200)
+    head_group.add_argument("--head-patience", type=int, default=20,
+                            help="Epochs without a better validation F1 before stopping")
+    head_group.add_argument("--head-batch-size", type=int, default=64)
+    head_group.add_argument("--head-learning-rate", type=float, default=1e-3)
+    head_group.add_argument("--layer-learning-rate", type=float, default=5e-5,
+                            help="Learning rate of the last layer with --train-last-layer")
+    args = parser.parse_args()
+    if args.head_only and os.path.abspath(args.head_output) == os.path.abspath(args.head_from):
+        parser.error("--head-output must differ from --head-from, which is kept as the reference")
+    if args.head_epochs < 1:
+        parser.error("--head-epochs must be at least 1")
+    if args.batch_size is None:
+        args.batch_size = 32 if args.distill else 8
+    return args
+
+
 def main():
+    args = parse_args()
+    configure_cpu_threads(args.threads, args.inter_op_threads)
+    if args.distill:
+        distill(args)
+        return
+    if args.head_only:
+        retrain_head(args)
+        return
+
     print("Starting DistilBERT fine-tuning for navigation intents...")
     
     # Load tokenizer and model
     model_name = "distilbert-base-uncased"
-    tokenizer = DistilBertTokenizer.from_pretrained(model_name)
+    tokenizer = DistilBertTokenizerFast.from_pretrained(model_name)
     # Create label mappings
     id2label = {v: k for k, v in INTENTS.items()}
     label2id = INTENTS
@@ -208,16 +861,28 @@ def main():
     print(f"Training examples: {len(training_data)}")
     
     # Prepare datasets
-    train_dataset, val_dataset = prepare_dataset(training_data, tokenizer)
+    dynamic = args.padding == "dynamic"
+    train_dataset, val_dataset = prepare_dataset(training_data, tokenizer,
+                                                 cache_dir=args.token_cache_dir,
+                                                 pad_to_longest=not dynamic)
     print(f"Training set size: {len(train_dataset)}")
     print(f"Validation set size: {len(val_dataset)}")
+    report_padding(train_dataset, args.batch_size, args.seed)
+    bf16 = use_bf16(args.bf16, args.cpu)
+    if args.cpu:
+        print(f"Training on the CPU in {'bf16 autocast' if bf16 else 'fp32'}")
     
     # Training arguments
     training_args = TrainingArguments(
         output_dir='./models/distilbert-navigation',
         num_train_epochs=10,
-        per_device_train_batch_size=8,
-        per_device_eval_batch_size=8,
+        per_device_train_batch_size=args.batch_size,
+        per_device_eval_batch_size=args.batch_size,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        dataloader_num_workers=args.dataloader_workers,
+        dataloader_persistent_workers=args.dataloader_workers > 0,
+        use_cpu=args.cpu,
+        bf16=bf16,
         warmup_steps=50,
         weight_decay=0.01,
         logging_dir='./logs',
@@ -227,6 +892,9 @@ def main():
         load_best_model_at_end=True,
         metric_for_best_model="f1",
         greater_is_better=True,
+        # Batches of similar-length commands, reshuffled every epoch from seed
+        group_by_length=dynamic,
+        seed=args.seed,
     )
     
     # Initialize trainer
@@ -236,12 +904,17 @@ def main():
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
         compute_metrics=compute_metrics,
-        callbacks=[EarlyStoppingCallback(early_stopping_patience=3)]
+        data_collator=DataCollatorWithPadding(tokenizer) if dynamic else None,
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=3),
+                   EpochThroughputCallback(len(train_dataset))]
     )
     
     # Train
     print("\nStarting training...")
-    trainer.train()
+    train_result = trainer.train()
+    print(f"Training throughput: {train_result.metrics['train_samples_per_second']:.1f} "
+          f"examples/s with {args.padding} padding "
+          f"({train_result.metrics['train_runtime']:.0f} s)")
     
     # Evaluate
     print("\nEvaluating model...")
@@ -265,7 +938,7 @@ def main():
     ]
     
     # Reload the model from saved checkpoint to avoid device issues
-    device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+    device = torch.device("mps" if torch.backends.mps.is_available() and not args.cpu else "cpu")
     test_model = DistilBertForSequenceClassification.from_pretrained('./models/distilbert-navigation-finetuned')
     test_model.to(device)
     test_model.eval()
@@ -0,0 +1,274 @@
+"""
+Check that compressed artifacts still answer like the FP32 model
+
+Runs the fine-tuned FP32 checkpoint and each compressed variant from
+benchmarks/variants.py (fp16, int8, onnx, onnx_int8) over every command in
+the dataset and any held-out files, in length-sorted batches. For each
+variant it reports top-1 agreement with the FP32 model per file, accuracy
+against the labels, which reference intents flipped and to what, the
+largest and mean logit deviation, and the forward time per command next to
+the reference's. Exits with status 1 when any variant's agreement falls
+below --min-agreement, so a compression setting can be gated on it:
+
+    python verify_compression.py --min-agreement 0.99
+    python verify_compression.py --variants int8,onnx_int8 --heldout heldout.json --json report.json
+
+quantize_model.py and convert_quantized_to_onnx.py run the same check on
+the artifacts they have just written.
+
+Requirements:
+    pip install tokenizers numpy transformers torch
+    pip install onnxruntime    # for the onnx variants
+"""
+
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+import numpy as np
+from fast_tokenizer import load_tokenizer
+from inference_backends import TorchBackend
+from inference_server import pad_to_bucket
+from benchmarks.variants import build_variants, load_variant, unavailable_reason
+from dataset_store import DEFAULT_STORE, load_examples
+
+DEFAULT_REFERENCE = './models/distilbert-navigation-finetuned'
+DEFAULT_QUANTIZED = './models/distilbert-navigation-quantized'
+DEFAULT_ONNX = './models/distilbert-navigation-onnx'
+DEFAULT_DATA = DEFAULT_STORE
+DEFAULT_MIN_AGREEMENT = 0.99
+
+
+def load_labelled(path):
+    """(text, intent) pairs from the dataset store or a JSON list like training_data_expanded.json"""
+    return [(item['text'], item.get('intent')) for item in load_examples(path)]
+
+
+def dataset_logits(backend, tokenizer, texts, batch_size, max_length):
+    """Logits for every text and the seconds spent in forward passes
+
+    Texts are sorted by token length so each batch is padded only to its
+    own longest command.
+    """
+    encoded = tokenizer.encode_ids(texts, max_length)
+    order = np.argsort([len(ids) for ids in encoded], kind='stable')
+    batches = []
+    for start in range(0, len(order), batch_size):
+        rows = order[start:start + batch_size]
+        length = max(len(encoded[row]) for row in rows)
+        batches.append((rows, pad_to_bucket([encoded[row] for row in rows], length,
+                                            tokenizer.pad_token_id)))
+
+    # One untimed pass so lazy initialisation is not charged to the first batch
+    backend.logits(batches[0][1])
+
+    logits = np.empty((len(texts), len(backend.intents)), dtype=np.float32)
+    forward = 0.0
+    for rows, inputs in batches:
+        start = time.perf_counter()
+        logits[rows] = backend.logits(inputs)
+        forward += time.perf_counter() - start
+    return logits, forward
+
+
+def align_columns(logits, intents, reference_intents):
+    """Reorder a variant's logit columns into the reference's intent order"""
+    if list(intents) == list(reference_intents):
+        return logits
+    if sorted(intents) != sorted(reference_intents):
+        raise ValueError(f"intents {intents} do not match the reference {reference_intents}")
+    return logits[:, [intents.index(intent) for intent in reference_intents]]
+
+
+def compare(reference, candidate, intents, labels, sources):
+    """Agreement, accuracy, flips and logit deviation of candidate against reference logits"""
+    reference_top = reference.argmax(axis=-1)
+    candidate_top = candidate.argmax(axis=-1)
+    agree = reference_top == candidate_top
+    deviation = np.abs(candidate - reference)
+
+    flips = {}
+    for index, intent in enumerate(intents):
+        mask = (reference_top == index) & ~agree
+        if mask.any():
+            targets = Counter(intents[top] for top in candidate_top[mask])
+            flips[intent] = {"count": int(mask.sum()),
+                             "of": int((reference_top == index).sum()),
+                             "to": dict(targets.most_common())}
+
+    by_source = {}
+    for source in dict.fromkeys(sources):
+        mask = np.array([s == source for s in sources])
+        by_source[source] = round(float(agree[mask].mean()), 5)
+
+    label_ids = np.array([intents.index(label) if label in intents else -1 for label in labels])
+    labelled = label_ids >= 0
+    accuracy = {}
+    if labelled.any():
+        accuracy = {
+            "reference": round(float((reference_top[labelled] == label_ids[labelled]).mean()), 5),
+            "variant": round(float((candidate_top[labelled] == label_ids[labelled]).mean()), 5),
+        }
+
+    return {
+        "agreement": round(float(agree.mean()), 5),
+        "agreement_by_file": by_source,
+        "disagreements": int((~agree).sum()),
+        "accuracy": accuracy,
+        "flips": flips,
+        "max_logit_deviation": round(float(deviation.max()), 5),
+        "mean_logit_deviation": round(float(deviation.mean()), 5),
+    }
+
+
+def verify_variants(reference_path, variants, data_paths, batch_size=64, max_length=64, threads=0):
+    """Run the reference and every variant over data_paths and compare them
+
+    Returns one report per variant; a variant that cannot run gets a
+    "skipped" or "error" entry instead of measurements.
+    """
+    texts, labels, sources = [], [], []
+    for path in data_paths:
+        for text, label in load_labelled(path):
+            texts.append(text)
+            labels.append(label)
+            sources.append(str(path))
+    print(f"Verifying on {len(texts)} commands from {', '.join(map(str, data_paths))}")
+
+    reference = TorchBackend(reference_path, intra_op_threads=threads)
+    reference_logits, reference_seconds = dataset_logits(
+        reference, load_tokenizer(reference_path), texts, batch_size, max_length
+    )
+    intents = reference.intents
+    del reference
+
+    reports = []
+    for variant in variants:
+        report = {"variant": variant.name, "artifact": str(variant.artifact)}
+        reason = unavailable_reason(variant)
+        if reason is not None:
+            reports.append({**report, "skipped": reason})
+            continue
+        try:
+            # The reference already started torch's thread pools
+            backend = load_variant(variant, threads, inter_op_threads=0)
+            logits, seconds = dataset_logits(backend, load_tokenizer(variant.model_path),
+                                             texts, batch_size, max_length)
+            logits = align_columns(logits, backend.intents, intents)
+        except Exception as e:
+            reports.append({**report, "error": f"{type(e).__name__}: {e}"})
+            continue
+        del backend
+
+        report.update(compare(reference_logits, logits, intents, labels, sources))
+        report["ms_per_command"] = round(seconds / len(texts) * 1000, 4)
+        report["reference_ms_per_command"] = round(reference_seconds / len(texts) * 1000, 4)
+        report["speedup"] = round(reference_seconds / seconds, 2) if seconds else None
+        reports.append(report)
+    return reports
+
+
+def print_reports(reports, min_agreement):
+    print(f"\n{'variant':<11}{'agreement':>11}{'accuracy':>10}{'max dev':>10}{'mean dev':>10}"
+          f"{'ms/cmd':>9}{'speedup':>9}")
+    for report in reports:
+        name = report["variant"]
+        if "skipped" in report:
+            print(f"{name:<11}  skipped: {report['skipped']}")
+            continue
+        if "error" in report:
+            print(f"{name:<11}  failed: {report['error']}")
+            continue
+        accuracy = report["accuracy"].get("variant")
+        accuracy = f"{accuracy:.2%}" if accuracy is not None else "-"
+        flag = "" if report["agreement"] >= min_agreement else "  BELOW THRESHOLD"
+        print(f"{name:<11}{report['agreement']:>11.2%}{accuracy:>10}"
+              f"{report['max_logit_deviation']:>10.4f}{report['mean_logit_deviation']:>10.4f}"
+              f"{report['ms_per_command']:>9.3f}{report['speedup'] or 0:>8.2f}x{flag}")
+
+    for report in reports:
+        if len(report.get("agreement_by_file", {})) > 1:
+            by_file = ", ".join(f"{path} {agreement:.2%}"
+                                for path, agreement in report["agreement_by_file"].items())
+            print(f"\n{report['variant']} agreement per file: {by_file}")
+        for intent, flip in report.get("flips", {}).items():
+            targets = ", ".join(f"{target} x{count}" for target, count in flip["to"].items())
+            print(f"  {report['variant']}: {intent} flipped {flip['count']}/{flip['of']} -> {targets}")
+
+    reference = next((r["accuracy"].get("reference") for r in reports if r.get("accuracy")), None)
+    if reference is not None:
+        print(f"\nFP32 reference accuracy: {reference:.2%}")
+
+
+def passes(reports, min_agreement):
+    """True when every verified variant agrees often enough and at least one was verified"""
+    verified = [report for report in reports if "agreement" in report]
+    failed = [report for report in reports if "error" in report]
+    return bool(verified) and not failed and all(
+        report["agreement"] >= min_agreement for report in verified
+    )
+
+
+def verify_artifacts(names, reference=DEFAULT_REFERENCE, quantized_model=DEFAULT_QUANTIZED,
+                     onnx_model=DEFAULT_ONNX, data_path=DEFAULT_DATA,
+                     min_agreement=DEFAULT_MIN_AGREEMENT):
+    """Verify the named variants over data_path, print the reports and return whether they pass"""
+    variants = [variant for variant in build_variants(reference, quantized_model, onnx_model)
+                if variant.name in names]
+    reports = verify_variants(reference, variants, [data_path])
+    print_reports(reports, min_agreement)
+    return passes(reports, min_agreement)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Gate compressed artifacts on agreement with FP32")
+    parser.add_argument("--reference", default=DEFAULT_REFERENCE,
+                        help="FP32 checkpoint the variants are compared with")
+    parser.add_argument("--quantized-model", default=DEFAULT_QUANTIZED)
+    parser.add_argument("--onnx-model", default=DEFAULT_ONNX)
+    parser.add_argument("--onnx-int8-path", default=None)
+    parser.add_argument("--variants", default="fp16,int8,onnx,onnx_int8",
+                        help="Comma separated variants to verify")
+    parser.add_argument("--data", default=DEFAULT_DATA,
+                        help="Dataset store directory or JSON list of {text, intent}")
+    parser.add_argument("--heldout", nargs='*', default=[],
+                        help="Extra labelled JSON files, reported separately")
+    parser.add_argument("--min-agreement", type=float, default=DEFAULT_MIN_AGREEMENT,
+                        help="Lowest top-1 agreement with the reference that passes")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-length", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Intra-op threads per model (0 = runtime default)")
+    parser.add_argument("--json", default=None, help="Also write the reports to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    wanted = [name.strip() for name in args.variants.split(',') if name.strip()]
+    variants = {variant.name: variant for variant in build_variants(
+        args.reference, args.quantized_model, args.onnx_model, args.onnx_int8_path
+    )}
+    unknown = [name for name in wanted if name not in variants or name == 'fp32']
+    if unknown:
+        sys.exit(f"Unknown variants: {', '.join(unknown)}")
+
+    reports = verify_variants(args.reference, [variants[name] for name in wanted],
+                              [args.data, *args.heldout], args.batch_size, args.max_length,
+                              args.threads)
+    print_reports(reports, args.min_agreement)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"reference": args.reference, "min_agreement": args.min_agreement,
+                       "reports": reports}, f, indent=2)
+
+    if not passes(reports, args.min_agreement):
+        print(f"\nVerification failed: agreement below {args.min_agreement:.2%} "
+              "or a variant could not be verified")
+        sys.exit(1)
+    print(f"\nAll verified variants agree with the reference at least {args.min_agreement:.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+Multi-process worker pool for the inference server
+
+One PyTorch process spends most of its time on small requests in Python
+overhead and cannot keep a many-core machine busy. With --workers N the
+server process keeps the protocol, cache and batching, and hands each batch
+to one of N worker processes. Each worker loads its own copy of the model,
+is pinned to its own slice of cores and runs as many intra-op threads as it
+has cores. Batches go to the worker with the fewest texts in flight, and a
+worker that dies is restarted with its unfinished batches sent again. A
+worker that does not come back after a few attempts fails its batches, and
+once every worker is gone new batches are answered with an error instead
+of waiting.
+"""
+
+import os
+import time
+import itertools
+import threading
+import multiprocessing
+
+# A batch that has taken down this many workers is answered with an error
+MAX_BATCH_ATTEMPTS = 2
+
+# Seconds to wait before each attempt to restart a crashed worker
+RESTART_DELAYS = (0, 1, 5)
+
+
+def core_slices(workers):
+    """Split the cores this process may use into one contiguous slice per worker"""
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+
+    if workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(workers)]
+
+    size, extra = divmod(len(cores), workers)
+    slices, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def worker_main(conn, args, cores):
+    """Entry point of a worker process: load the model, then classify batches"""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+    from inference_server import classify_batch, load_components
+
+    try:
+        timings = {}
+        tokenizer, backend, index = load_components(args, timings)
+    except Exception as e:
+        conn.send(("error", str(e)))
+        return
+    conn.send(("ready", backend.intents, timings))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        batch_id, texts = message
+        stage_times = {}
+        try:
+            predictions = classify_batch(tokenizer, backend, texts, args.length_buckets,
+                                         stage_times, index)
+        except Exception as e:
+            conn.send((batch_id, None, str(e), None, None))
+        else:
+            index_stats = index.stats() if index is not None else None
+            conn.send((batch_id, predictions, None, stage_times, index_stats))
+
+
+class PoolWorker:
+    """Handle on one worker process and the batches it is working on"""
+
+    def __init__(self, index, args, cores, context):
+        self.index = index
+        self.args = args
+        self.cores = cores
+        self.context = context
+        self.process = None
+        self.conn = None
+        self.pending = {}   # batch_id -> (batch, attempts)
+        self.available = False
+        # Set once the process could not be restarted
+        self.failed = False
+        self.send_lock = threading.Lock()
+        self.restarts = 0
+        # Latest embedding index counters reported by the process
+        self.index_stats = None
+        self.index_baseline = {"lookups": 0, "hits": 0}
+
+    @property
+    def load(self):
+        return sum(len(batch) for batch, _ in self.pending.values())
+
+    def start(self):
+        """Spawn the process and wait until its model is loaded"""
+        if self.conn is not None:
+            # Left over from a process that crashed
+            self.conn.close()
+            self.process.join(timeout=1)
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=worker_main, args=(child_conn, self.args, self.cores), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+        try:
+            message = self.conn.recv()
+        except EOFError:
+            message = ("error", f"worker exited with code {self.process.exitcode}")
+        if message[0] != "ready":
+            raise RuntimeError(f"Worker {self.index} failed to load: {message[1]}")
+        return message[1], message[2]
+
+    def stop(self):
+        try:
+            with self.send_lock:
+                self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class WorkerPool:
+    """Route batches to the least loaded of N model worker processes
+
+    deliver(batch, predictions, error, stage_times) is called from a
+    receiver thread once a batch has been classified or has failed.
+    """
+
+    def __init__(self, args, workers, deliver):
+        # Each worker gets its slice of cores as its intra-op thread count
+        self.slices = core_slices(workers)
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = []
+        for index, cores in enumerate(self.slices):
+            worker_args = type(args)(**vars(args))
+            worker_args.intra_op_threads = args.intra_op_threads or len(cores)
+            worker_args.inter_op_threads = args.inter_op_threads or 1
+            worker_args.fast_start = False
+            self.workers.append(PoolWorker(index, worker_args, cores, self.context))
+
+        self.deliver = deliver
+        self.batch_ids = itertools.count()
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.intents = None
+        self.name = args.backend
+
+    def start(self, timings):
+        """Start every worker in parallel and record how long the slowest took"""
+        start = time.perf_counter()
+        results = [None] * len(self.workers)
+        errors = []
+
+        def start_worker(worker):
+            try:
+                results[worker.index] = worker.start()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=start_worker, args=(worker,)) for worker in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            self.stop()
+            raise errors[0]
+
+        self.intents, timings["worker"] = results[0]
+        timings["workers"] = round(time.perf_counter() - start, 3)
+        for worker in self.workers:
+            worker.available = True
+            threading.Thread(target=self._receive, args=(worker,), daemon=True).start()
+
+    def submit(self, batch, attempts=1):
+        """Send a batch to the least loaded worker that is up"""
+        texts = [item.text for item in batch]
+        with self.condition:
+            while True:
+                candidates = [w for w in self.workers if w.available]
+                if candidates or all(w.failed for w in self.workers):
+                    break
+                self.condition.wait()
+            if candidates:
+                worker = min(candidates, key=lambda w: w.load)
+                batch_id = next(self.batch_ids)
+                worker.pending[batch_id] = (batch, attempts)
+                conn = worker.conn
+        if not candidates:
+            self.deliver(batch, None, "No inference worker is running")
+            return
+
+        # Not under the condition: when the pipe is full, send blocks until the
+        # receiver thread, which takes the condition, has read some replies
+        try:
+            with worker.send_lock:
+                conn.send((batch_id, texts))
+        except (OSError, ValueError):
+            # The process died since the last reply; its receiver thread sees
+            # the closed pipe and _restart resends this batch with the others
+            with self.condition:
+                if worker.conn is conn:
+                    worker.available = False
+
+    def _receive(self, worker):
+        while True:
+            try:
+                batch_id, predictions, error, stage_times, index_stats = worker.conn.recv()
+            except (EOFError, OSError):
+                if not self._restart(worker):
+                    return
+                continue
+
+            with self.condition:
+                batch, _ = worker.pending.pop(batch_id)
+                if index_stats is not None:
+                    worker.index_stats = index_stats
+                self.condition.notify_all()
+            self.deliver(batch, predictions, error, stage_times)
+
+    def _restart(self, worker):
+        """Bring a crashed worker back and resend what it was working on
+
+        Returns False when the pool is shutting down instead.
+        """
+        with self.condition:
+            worker.available = False
+            orphans = list(worker.pending.values())
+            worker.pending = {}
+            if worker.index_stats is not None:
+                # The new process counts from zero
+                for name in worker.index_baseline:
+                    worker.index_baseline[name] += worker.index_stats[name]
+                worker.index_stats = None
+            stopping = self.stopping
+            self.condition.notify_all()
+
+        if stopping:
+            for batch, _ in orphans:
+                self.deliver(batch, None, "Inference server is shutting down")
+            return False
+
+        error = self._start_again(worker)
+        if error is not None:
+            with self.condition:
+                worker.failed = True
+                self.condition.notify_all()
+            for batch, _ in orphans:
+                self.deliver(batch, None, error)
+            return False
+
+        with self.condition:
+            worker.available = True
+            self.condition.notify_all()
+
+        for batch, attempts in orphans:
+            if attempts >= MAX_BATCH_ATTEMPTS:
+                self.deliver(batch, None, "Inference worker crashed while classifying")
+            else:
+                self.submit(batch, attempts + 1)
+        return True
+
+    def _start_again(self, worker):
+        """Restart a crashed worker, backing off between attempts
+
+        Returns None once it is up, otherwise why the batches it had failed.
+        """
+        error = "Inference server is shutting down"
+        for delay in RESTART_DELAYS:
+            time.sleep(delay)
+            if self.stopping:
+                return "Inference server is shutting down"
+            worker.restarts += 1
+            try:
+                worker.start()
+                return None
+            except Exception as e:
+                error = f"Inference worker could not be restarted: {e}"
+        return error
+
+    def stats(self):
+        with self.condition:
+            return [{"cores": worker.cores, "in_flight": worker.load,
+                     "restarts": worker.restarts, "available": worker.available,
+                     "failed": worker.failed}
+                    for worker in self.workers]
+
+    def index_stats(self):
+        """Embedding index counters summed over every worker process"""
+        with self.condition:
+            reports = [(w.index_stats, w.index_baseline) for w in self.workers]
+        lookups = sum(baseline["lookups"] + (report or {}).get("lookups", 0)
+                      for report, baseline in reports)
+        hits = sum(baseline["hits"] + (report or {}).get("hits", 0)
+                   for report, baseline in reports)
+        return {"lookups": lookups, "hits": hits,
+                "hit_rate": hits / lookups if lookups else 0.0}
+
+    def drain(self):
+        """Wait until every submitted batch has been answered"""
+        with self.condition:
+            while any(worker.pending for worker in self.workers):
+                self.condition.wait()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.stop()
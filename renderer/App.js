@@ -907,6 +907,18 @@ chatInput.addEventListener('keypress', (e) => {
   }
 });
 
+// Classify while typing so the submitted command is usually answered already;
+// the server drops prefixes that a newer one has replaced
+function speculateIntent(input) {
+  const text = input.value.trim();
+  if (text && window.electronAPI && window.electronAPI.speculateIntent) {
+    window.electronAPI.speculateIntent(text).catch(() => {});
+  }
+}
+
+chatInput.addEventListener('input', () => speculateIntent(chatInput));
+homeInput.addEventListener('input', () => speculateIntent(homeInput));
+
 // ========== FUNCTION CALLING INTEGRATION ==========
 // Helper function to ensure webview is ready
 function waitForWebviewReady(webview) {
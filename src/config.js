@@ -1,6 +1,17 @@
 // Configuration for AI Browser
 // Centralized configuration to avoid hardcoded values
 
+const path = require('path');
+const { app } = require('electron');
+
+// Per-user directory for the daemon socket; the runtime dir is private to
+// the user on Linux, userData everywhere else
+function runtimeDir() {
+  return process.env.XDG_RUNTIME_DIR
+    ? path.join(process.env.XDG_RUNTIME_DIR, 'ai-browser')
+    : app.getPath('userData');
+}
+
 const config = {
   // Model Server Configuration
   modelServer: {
@@ -22,6 +33,28 @@ const config = {
     }
   },
 
+  // Python inference server (model-training/inference_server.py)
+  inferenceServer: {
+    // Parallel load, early request queueing and a warm-up batch before ready
+    args: ['--fast-start'],
+    // Also sent to the server, which drops requests queued for longer and
+    // answers "overloaded" when its queue is full so we fall back at once
+    requestTimeoutMs: 5000,
+    // Length-prefixed binary frames instead of JSON lines
+    binaryFraming: true,
+    // Classify while the user types so submitting can reuse the result
+    speculative: true,
+    // Shared daemon socket used by every app instance of this user; null
+    // spawns a private server over stdin/stdout instead
+    socketPath: process.platform === 'win32'
+      ? null
+      : path.join(runtimeDir(), 'intent.sock'),
+    // Daemon exits once no app has been connected for this long
+    idleTimeoutSeconds: 600,
+    connectRetries: 120,
+    connectRetryMs: 250
+  },
+
   // Transformers.js Environment
   transformers: {
     allowLocalModels: true,
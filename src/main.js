@@ -6,6 +6,8 @@ const path = require('path');
 const cors = require('cors');
 const config = require('./config');
 const { spawn } = require('child_process');
+const net = require('net');
+const fs = require('fs');
 
 // Initialize function orchestrator
 const orchestrator = new FunctionOrchestrator(functionRegistry);
@@ -13,40 +15,173 @@ const orchestrator = new FunctionOrchestrator(functionRegistry);
 let mainWindow = null;
 let modelServer = null;
 let pythonProcess = null;
+// Where requests are written: stdin of the spawned server or the daemon socket
+let serverConnection = null;
+let shuttingDown = false;
 let modelReady = false;
+// Set when a --fast-start server queues requests before the model is ready
+let serverAccepting = false;
 
-// Start Python inference server for custom model
-function startPythonInferenceServer() {
+// In-flight classification requests, keyed by the id echoed in each reply
+const pendingRequests = new Map();
+let nextRequestId = 1;
+let outputBuffer = Buffer.alloc(0);
+
+// Windows with a partial sent since their last submission; only those
+// submissions need the session, the rest go as compact classify frames
+const speculatedSessions = new Set();
+
+// Framing of each direction: requests switch as soon as hello is written,
+// replies once the server acknowledges it (see server_transport.py)
+let requestFraming = 'json';
+let replyFraming = 'json';
+let serverIntents = [];
+
+const FRAME_CLASSIFY = 1;
+const FRAME_JSON = 2;
+const FRAME_PREDICTION = 3;
+
+// Server arguments shared by the private server and the daemon; the server
+// drops requests this client has already given up on
+function inferenceServerArgs() {
+  return [
+    ...config.inferenceServer.args,
+    '--request-timeout-ms', String(config.inferenceServer.requestTimeoutMs)
+  ];
+}
+
+function inferenceScriptPath() {
   const isDev = !app.isPackaged;
-  const scriptPath = isDev
+  return isDev
     ? path.join(__dirname, '..', 'model-training', 'inference_server.py')
     : path.join(process.resourcesPath, 'model-training', 'inference_server.py');
+}
+
+// Start Python inference server for custom model
+function startPythonInferenceServer() {
+  if (config.inferenceServer.socketPath) {
+    connectToDaemon(true);
+  } else {
+    spawnStdioServer();
+  }
+}
+
+// Split server output into messages and handle each one
+function handleServerOutput(data) {
+  // Chunks do not line up with messages, keep the trailing partial one
+  outputBuffer = outputBuffer.length ? Buffer.concat([outputBuffer, data]) : data;
   
-  console.log('Starting Python inference server...');
-  pythonProcess = spawn('python3', [scriptPath], {
-    cwd: path.dirname(scriptPath)
-  });
-  
-  pythonProcess.stdout.on('data', (data) => {
-    const lines = data.toString().split('\n');
-    lines.forEach(line => {
+  while (true) {
+    if (replyFraming === 'binary') {
+      if (outputBuffer.length < 4) break;
+      const length = outputBuffer.readUInt32BE(0);
+      if (outputBuffer.length < 4 + length) break;
+      const payload = outputBuffer.subarray(4, 4 + length);
+      outputBuffer = outputBuffer.subarray(4 + length);
+      handleServerFrame(payload);
+    } else {
+      const newline = outputBuffer.indexOf(0x0a);
+      if (newline === -1) break;
+      const line = outputBuffer.subarray(0, newline).toString('utf8');
+      outputBuffer = outputBuffer.subarray(newline + 1);
       if (line.trim()) {
         try {
-          const message = JSON.parse(line);
-          if (message.status === 'ready') {
-            modelReady = true;
-            console.log('✓ Custom intent classifier model loaded');
-          } else if (message.status === 'loading') {
-            console.log('Loading custom model...');
-          } else if (message.status === 'error') {
-            console.error('Python model error:', message.message);
-          }
+          handleServerMessage(JSON.parse(line));
         } catch (e) {
           console.log('Python output:', line);
         }
       }
-    });
+    }
+  }
+}
+
+// Decode one binary frame from the server
+function handleServerFrame(payload) {
+  if (payload[0] === FRAME_PREDICTION) {
+    const id = payload.readUInt32BE(1);
+    const k = payload[6];
+    const results = [];
+    for (let i = 0; i < k; i++) {
+      results.push({
+        intent: serverIntents[payload.readUInt16BE(7 + 2 * i)],
+        confidence: payload.readFloatBE(7 + 2 * k + 4 * i)
+      });
+    }
+    resolvePending(id, { results });
+  } else if (payload[0] === FRAME_JSON) {
+    handleServerMessage(JSON.parse(payload.subarray(1).toString('utf8')));
+  }
+}
+
+// Encode a classification request in the current framing; requests with
+// extra fields (type, session) go as JSON frames once binary
+function encodeRequest(id, text, fields = null) {
+  if (requestFraming !== 'binary') {
+    return JSON.stringify({ id, text, ...fields }) + '\n';
+  }
+  if (fields) {
+    const json = Buffer.from(JSON.stringify({ id, text, ...fields }), 'utf8');
+    const jsonHeader = Buffer.alloc(5);
+    jsonHeader.writeUInt32BE(1 + json.length, 0);
+    jsonHeader.writeUInt8(FRAME_JSON, 4);
+    return Buffer.concat([jsonHeader, json]);
+  }
+  const body = Buffer.from(text, 'utf8');
+  const header = Buffer.alloc(9);
+  header.writeUInt32BE(5 + body.length, 0);
+  header.writeUInt8(FRAME_CLASSIFY, 4);
+  header.writeUInt32BE(id, 5);
+  return Buffer.concat([header, body]);
+}
+
+// Ask a fresh connection for binary framing when configured
+function negotiateFraming() {
+  if (config.inferenceServer.binaryFraming) {
+    serverConnection.write(JSON.stringify({ cmd: 'hello', framing: 'binary' }) + '\n');
+    requestFraming = 'binary';
+  }
+}
+
+function resolvePending(id, response) {
+  const pending = pendingRequests.get(id);
+  if (!pending) {
+    return;
+  }
+  pendingRequests.delete(id);
+  clearTimeout(pending.timeout);
+  pending.resolve(response);
+}
+
+function handleServerClosed(reason) {
+  modelReady = false;
+  serverAccepting = false;
+  serverConnection = null;
+  outputBuffer = Buffer.alloc(0);
+  requestFraming = 'json';
+  replyFraming = 'json';
+  
+  // Nobody will answer the requests still in flight
+  for (const pending of pendingRequests.values()) {
+    clearTimeout(pending.timeout);
+    pending.resolve({ error: reason, fallback: true });
+  }
+  pendingRequests.clear();
+  // The server's sessions went with it
+  speculatedSessions.clear();
+}
+
+// Private server for this app instance, over stdin/stdout
+function spawnStdioServer() {
+  const scriptPath = inferenceScriptPath();
+  
+  console.log('Starting Python inference server...');
+  pythonProcess = spawn('python3', [scriptPath, ...inferenceServerArgs()], {
+    cwd: path.dirname(scriptPath)
   });
+  serverConnection = pythonProcess.stdin;
+  negotiateFraming();
+  
+  pythonProcess.stdout.on('data', handleServerOutput);
   
   pythonProcess.stderr.on('data', (data) => {
     console.error('Python stderr:', data.toString());
@@ -54,49 +189,181 @@ function startPythonInferenceServer() {
   
   pythonProcess.on('close', (code) => {
     console.log(`Python inference server exited with code ${code}`);
-    modelReady = false;
+    pythonProcess = null;
+    handleServerClosed('Inference server exited');
   });
 }
 
-// IPC handler for intent classification using custom model
-ipcMain.handle('classify-intent', async (event, text) => {
-  if (!modelReady || !pythonProcess) {
-    return {
+// The daemon's stderr, next to its socket, so startup failures can be read
+function daemonLogPath() {
+  return path.join(path.dirname(config.inferenceServer.socketPath), 'daemon.log');
+}
+
+// Last line the daemon wrote to its log, or '' when there is none
+function lastDaemonLogLine() {
+  try {
+    const lines = fs.readFileSync(daemonLogPath(), 'utf8').trim().split('\n');
+    return lines[lines.length - 1];
+  } catch (e) {
+    return '';
+  }
+}
+
+// Shared daemon outliving this app instance, serving every instance
+function spawnDaemon() {
+  const scriptPath = inferenceScriptPath();
+  const { socketPath, idleTimeoutSeconds } = config.inferenceServer;
+  
+  console.log('Starting shared Python inference daemon...');
+  fs.mkdirSync(path.dirname(socketPath), { recursive: true, mode: 0o700 });
+  const log = fs.openSync(daemonLogPath(), 'a', 0o600);
+  const daemon = spawn('python3', [
+    scriptPath,
+    ...inferenceServerArgs(),
+    '--socket', socketPath,
+    '--idle-timeout', String(idleTimeoutSeconds)
+  ], {
+    cwd: path.dirname(scriptPath),
+    detached: true,
+    stdio: ['ignore', 'ignore', log]
+  });
+  fs.closeSync(log);
+  daemon.on('exit', (code) => {
+    if (code) {
+      console.error(`Inference daemon exited with code ${code}:`, lastDaemonLogLine());
+    }
+  });
+  daemon.unref();
+}
+
+// A socket path some other user created must not be trusted
+function socketOwnedByOtherUser(socketPath) {
+  try {
+    return fs.lstatSync(socketPath).uid !== process.getuid();
+  } catch (e) {
+    return false;
+  }
+}
+
+// Connect to the shared daemon, starting it first if nobody is listening
+function connectToDaemon(startIfMissing, attempt = 0) {
+  const { socketPath, connectRetries, connectRetryMs } = config.inferenceServer;
+  if (socketOwnedByOtherUser(socketPath)) {
+    console.error(`Not connecting to ${socketPath}: it belongs to another user`);
+    return;
+  }
+  const socket = net.createConnection(socketPath);
+  let connected = false;
+  
+  socket.on('connect', () => {
+    connected = true;
+    serverConnection = socket;
+    negotiateFraming();
+    console.log('Connected to shared inference daemon');
+  });
+  
+  socket.on('data', handleServerOutput);
+  
+  socket.on('error', (error) => {
+    if (connected) {
+      console.error('Inference daemon connection error:', error.message);
+      return;
+    }
+    if (startIfMissing) {
+      spawnDaemon();
+    }
+    if (attempt < connectRetries) {
+      setTimeout(() => connectToDaemon(false, attempt + 1), connectRetryMs);
+    } else {
+      const logLine = lastDaemonLogLine();
+      console.error('Could not reach inference daemon:', error.message,
+        logLine ? `(last daemon log line: ${logLine})` : '');
+    }
+  });
+  
+  socket.on('close', () => {
+    if (!connected) {
+      return;
+    }
+    handleServerClosed('Inference daemon connection closed');
+    if (!shuttingDown) {
+      // The daemon went away, bring it back
+      connectToDaemon(true);
+    }
+  });
+}
+
+// Route one message from the inference server
+function handleServerMessage(message) {
+  if (message.id !== undefined && pendingRequests.has(message.id)) {
+    if (message.status === 'success') {
+      resolvePending(message.id, { results: message.results });
+    } else {
+      resolvePending(message.id, { error: message.message, fallback: true });
+    }
+  } else if (message.status === 'hello') {
+    replyFraming = message.framing;
+  } else if (message.status === 'ready') {
+    modelReady = true;
+    serverIntents = message.intents;
+    console.log('✓ Custom intent classifier model loaded');
+    if (message.startup) {
+      console.log('Inference server startup (s):', message.startup);
+    }
+  } else if (message.status === 'loading') {
+    serverAccepting = Boolean(message.accepting);
+    if (message.intents) {
+      serverIntents = message.intents;
+    }
+    console.log('Loading custom model...');
+  } else if (message.status === 'error') {
+    console.error('Python model error:', message.message);
+  }
+}
+
+// Send one request to the inference server and wait for its reply
+function requestClassification(text, fields = null) {
+  if (!(modelReady || serverAccepting) || !serverConnection) {
+    return Promise.resolve({
       error: 'Model not ready',
       fallback: true
-    };
+    });
   }
   
   return new Promise((resolve) => {
+    const id = nextRequestId++;
     const timeout = setTimeout(() => {
+      pendingRequests.delete(id);
       resolve({ error: 'Classification timeout', fallback: true });
-    }, 5000);
+    }, config.inferenceServer.requestTimeoutMs);
     
-    const responseHandler = (data) => {
-      const lines = data.toString().split('\n');
-      lines.forEach(line => {
-        if (line.trim()) {
-          try {
-            const response = JSON.parse(line);
-            if (response.status === 'success') {
-              clearTimeout(timeout);
-              pythonProcess.stdout.removeListener('data', responseHandler);
-              resolve({ results: response.results });
-            } else if (response.status === 'error') {
-              clearTimeout(timeout);
-              pythonProcess.stdout.removeListener('data', responseHandler);
-              resolve({ error: response.message, fallback: true });
-            }
-          } catch (e) {
-            // Ignore parsing errors
-          }
-        }
-      });
-    };
-    
-    pythonProcess.stdout.on('data', responseHandler);
-    pythonProcess.stdin.write(JSON.stringify({ text }) + '\n');
+    pendingRequests.set(id, { resolve, timeout });
+    serverConnection.write(encodeRequest(id, text, fields));
   });
+}
+
+// Each window types into its own speculation session on the server
+function speculationSession(event) {
+  return config.inferenceServer.speculative ? `window-${event.sender.id}` : null;
+}
+
+// IPC handler for intent classification using custom model
+ipcMain.handle('classify-intent', async (event, text) => {
+  const session = speculationSession(event);
+  if (session && speculatedSessions.delete(session)) {
+    return requestClassification(text, { session });
+  }
+  return requestClassification(text);
+});
+
+// IPC handler for as-you-type prefixes; a newer prefix cancels the older one
+ipcMain.handle('speculate-intent', async (event, text) => {
+  const session = speculationSession(event);
+  if (!session || !modelReady) {
+    return { skipped: true };
+  }
+  speculatedSessions.add(session);
+  return requestClassification(text, { type: 'partial', session });
 });
 
 // Start local HTTP server for model files
@@ -193,8 +460,12 @@ app.on('window-all-closed', () => {
   if (modelServer) {
     modelServer.close();
   }
+  shuttingDown = true;
   if (pythonProcess) {
     pythonProcess.kill();
+  } else if (serverConnection) {
+    // Leave the shared daemon running for other instances
+    serverConnection.end();
   }
   if (process.platform !== 'darwin') {
     app.quit();
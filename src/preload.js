@@ -12,6 +12,9 @@ contextBridge.exposeInMainWorld('electronAPI', {
   // Custom model intent classification
   classifyIntent: (text) => ipcRenderer.invoke('classify-intent', text),
   
+  // Classify the command being typed ahead of submission
+  speculateIntent: (text) => ipcRenderer.invoke('speculate-intent', text),
+  
   // Listen for function execution results
   onFunctionResult: (callback) => ipcRenderer.on('function-result', callback)
 });